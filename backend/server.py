@@ -1,33 +1,491 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Depends, UploadFile, File, Request, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from fastapi.routing import APIRoute
+from fastapi.exceptions import RequestValidationError
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateMany, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+import bson
+from bson import ObjectId
 import os
+import asyncio
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Union, get_args, get_origin
+from collections import OrderedDict, deque
 import uuid
+import time
+import threading
+import contextvars
+import functools
+import itertools
+import random
+import base64
+import bisect
+import codecs
+import csv
+import io
+import json
+import re
+import unicodedata
 from datetime import datetime, date, timezone, timedelta
 from dateutil.relativedelta import relativedelta
 from passlib.context import CryptContext
 import hashlib
 from jose import JWTError, jwt
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Métricas en formato de texto Prometheus, expuestas en /metrics
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+def formatear_etiquetas(nombres, valores, extra=""):
+    partes = [f'{nombre}="{str(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+class Metric:
+    tipo = "untyped"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.valores = {}
+        # Los listeners de pymongo se ejecutan en los hilos de Motor
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, valores: tuple = (), cantidad: float = 1):
+        with self.lock:
+            self.valores[valores] = self.valores.get(valores, 0) + cantidad
+
+    def render(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        with self.lock:
+            valores = list(self.valores.items())
+        for clave, valor in valores:
+            lineas.append(f"{self.nombre}{formatear_etiquetas(self.etiquetas, clave)} {valor}")
+        return lineas
+
+class Counter(Metric):
+    tipo = "counter"
+
+class Gauge(Metric):
+    tipo = "gauge"
+
+    def dec(self, valores: tuple = (), cantidad: float = 1):
+        self.inc(valores, -cantidad)
+
+    def set(self, valores: tuple, valor: float):
+        with self.lock:
+            self.valores[valores] = valor
+
+class Histogram(Metric):
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = (), buckets: tuple = HTTP_BUCKETS):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = buckets
+
+    def observe(self, valores: tuple, segundos: float):
+        with self.lock:
+            serie = self.valores.get(valores)
+            if serie is None:
+                serie = self.valores[valores] = [[0] * len(self.buckets), 0, 0.0]
+            for i, limite in enumerate(self.buckets):
+                if segundos <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += 1
+            serie[2] += segundos
+
+    def render(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        with self.lock:
+            valores = [(clave, (list(serie[0]), serie[1], serie[2])) for clave, serie in self.valores.items()]
+        for clave, (cubetas, total, suma) in valores:
+            acumulado = 0
+            for limite, cantidad in zip(self.buckets, cubetas):
+                acumulado += cantidad
+                etiquetas = formatear_etiquetas(self.etiquetas, clave, f'le="{limite}"')
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            etiquetas = formatear_etiquetas(self.etiquetas, clave, 'le="+Inf"')
+            lineas.append(f"{self.nombre}_bucket{etiquetas} {total}")
+            lineas.append(f"{self.nombre}_sum{formatear_etiquetas(self.etiquetas, clave)} {suma}")
+            lineas.append(f"{self.nombre}_count{formatear_etiquetas(self.etiquetas, clave)} {total}")
+        return lineas
+
+METRICS = []
+http_requests = Counter("http_requests_total", "Peticiones HTTP por ruta, método y estado", ("method", "route", "status"))
+http_latency = Histogram("http_request_duration_seconds", "Latencia de las peticiones HTTP por ruta", ("method", "route"))
+http_in_flight = Gauge("http_requests_in_flight", "Peticiones HTTP en curso por ruta", ("method", "route"))
+mongo_commands = Histogram("mongodb_command_duration_seconds", "Duración de los comandos MongoDB", ("command", "collection", "outcome"), MONGO_BUCKETS)
+mongo_checkout = Histogram("mongodb_pool_checkout_wait_seconds", "Espera para obtener una conexión del pool", ("address",), MONGO_BUCKETS)
+mongo_pool_size = Gauge("mongodb_pool_connections", "Conexiones abiertas en el pool", ("address",))
+mongo_pool_in_use = Gauge("mongodb_pool_connections_in_use", "Conexiones del pool en uso", ("address",))
+
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self.colecciones = {}
+
+    def started(self, event):
+        coleccion = event.command.get(event.command_name)
+        self.colecciones[(event.request_id, event.connection_id)] = coleccion if isinstance(coleccion, str) else ""
+
+    def _registrar(self, event, outcome):
+        coleccion = self.colecciones.pop((event.request_id, event.connection_id), "")
+        mongo_commands.observe((event.command_name, coleccion, outcome), event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._registrar(event, "ok")
+
+    def failed(self, event):
+        self._registrar(event, "error")
+
+# Server-Timing por fases; global con SERVER_TIMING=1 o por petición con la cabecera X-Debug-Timing
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+SERVER_TIMING_LOG_RATE = float(os.environ.get("SERVER_TIMING_LOG_RATE", "0"))
+
+class Fases:
+    def __init__(self, cabecera: bool, registrar: bool):
+        self.cabecera = cabecera
+        self.registrar = registrar
+        self.duraciones = {}
+        self.fin_endpoint = None
+        self.lock = threading.Lock()
+
+    def add(self, nombre: str, segundos: float):
+        with self.lock:
+            self.duraciones[nombre] = self.duraciones.get(nombre, 0.0) + segundos
+
+    def header(self):
+        return ", ".join(f"{nombre};dur={segundos * 1000:.2f}" for nombre, segundos in self.duraciones.items())
+
+fases_actuales = contextvars.ContextVar("fases_actuales", default=None)
+
+def iniciar_fases(request: Request):
+    cabecera = SERVER_TIMING or bool(request.headers.get("x-debug-timing"))
+    registrar = SERVER_TIMING_LOG_RATE > 0 and random.random() < SERVER_TIMING_LOG_RATE
+    if cabecera or registrar:
+        return Fases(cabecera, registrar)
+    return None
+
+def terminar_fases(fases: Fases, total: float, fin: float, headers, ruta: str, estado: int):
+    if fases.fin_endpoint is not None:
+        fases.add("serializacion", fin - fases.fin_endpoint)
+    fases.add("total", total)
+    if fases.cabecera and headers is not None:
+        headers["Server-Timing"] = fases.header()
+        # Sin esta cabecera el navegador oculta Server-Timing en peticiones de otro origen
+        headers["Timing-Allow-Origin"] = "*"
+    if fases.registrar:
+        logger.info(json.dumps({
+            "evento": "server_timing",
+            "ruta": ruta,
+            "estado": estado,
+            "fases_ms": {nombre: round(segundos * 1000, 3) for nombre, segundos in fases.duraciones.items()},
+        }, ensure_ascii=False))
+
+class TimingListener(monitoring.CommandListener):
+    # Suma el tiempo de Mongo a la petición en curso; el objeto Fases se comparte con el hilo de Motor
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        fases = fases_actuales.get()
+        if fases is not None:
+            fases.add("mongo", event.duration_micros / 1e6)
+
+    def failed(self, event):
+        self.succeeded(event)
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        # El checkout empieza y termina en el mismo hilo del executor de Motor
+        self.local = threading.local()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        mongo_pool_size.inc((self._address(event),))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        mongo_pool_size.dec((self._address(event),))
+
+    def connection_check_out_started(self, event):
+        self.local.inicio = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self.local.inicio = None
+
+    def connection_checked_out(self, event):
+        inicio = getattr(self.local, "inicio", None)
+        if inicio is not None:
+            mongo_checkout.observe((self._address(event),), time.perf_counter() - inicio)
+            self.local.inicio = None
+        mongo_pool_in_use.inc((self._address(event),))
+
+    def connection_checked_in(self, event):
+        mongo_pool_in_use.dec((self._address(event),))
+
+    @staticmethod
+    def _address(event):
+        return "%s:%s" % event.address
+
+# Detector de consultas lentas y COLLSCAN
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_EXPLAIN_RATE = float(os.environ.get("SLOW_QUERY_EXPLAIN_RATE", "0"))
+SLOW_QUERY_MAX_SHAPES = int(os.environ.get("SLOW_QUERY_MAX_SHAPES", "500"))
+EXPLAIN_COMMANDS = {"find", "aggregate", "count", "distinct"}
+# Campos de sesión y transporte que explain no acepta dentro del comando
+EXPLAIN_EXCLUDED_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"}
+
+# Ruta que originó la operación; Motor copia el contexto al hilo donde corren los listeners
+ruta_actual = contextvars.ContextVar("ruta_actual", default="background")
+
+def forma_consulta(valor):
+    # Conserva campos y operadores y sustituye los valores, para agrupar consultas iguales
+    if isinstance(valor, dict):
+        return {clave: forma_consulta(v) for clave, v in valor.items()}
+    if isinstance(valor, list):
+        formas = [forma_consulta(v) for v in valor if isinstance(v, (dict, list))]
+        return formas or "?"
+    return "?"
+
+def describir_comando(nombre: str, comando: dict):
+    coleccion = comando.get(nombre)
+    partes = [f"{coleccion}.{nombre}" if isinstance(coleccion, str) else nombre]
+    if nombre == "aggregate":
+        etapas = []
+        for etapa in comando.get("pipeline", []):
+            operador = next(iter(etapa), "?")
+            etapas.append({operador: forma_consulta(etapa[operador])} if operador == "$match" else operador)
+        partes.append(json.dumps(etapas, ensure_ascii=False))
+    else:
+        for campo in ("filter", "query", "q"):
+            if campo in comando:
+                partes.append(json.dumps(forma_consulta(comando[campo]), ensure_ascii=False, sort_keys=True))
+        for campo in ("updates", "deletes"):
+            if comando.get(campo):
+                partes.append(json.dumps(forma_consulta(comando[campo][0].get("q", {})), ensure_ascii=False, sort_keys=True))
+    if comando.get("sort"):
+        partes.append("sort " + ",".join(comando["sort"]))
+    return " ".join(partes)
+
+def plan_con_collscan(plan):
+    if isinstance(plan, dict):
+        return plan.get("stage") == "COLLSCAN" or any(plan_con_collscan(v) for v in plan.values())
+    if isinstance(plan, list):
+        return any(plan_con_collscan(v) for v in plan)
+    return False
+
+class SlowQueryListener(monitoring.CommandListener):
+    def __init__(self, threshold_ms: float, explain_rate: float, max_shapes: int):
+        self.threshold_ms = threshold_ms
+        self.explain_rate = explain_rate
+        self.max_shapes = max_shapes
+        self.pendientes = {}
+        self.formas = {}
+        self.lock = threading.Lock()
+        self.loop = None
+
+    def started(self, event):
+        self.pendientes[(event.request_id, event.connection_id)] = (event.command, ruta_actual.get())
+
+    def succeeded(self, event):
+        self._registrar(event)
+
+    def failed(self, event):
+        self._registrar(event)
+
+    def _registrar(self, event):
+        pendiente = self.pendientes.pop((event.request_id, event.connection_id), None)
+        duracion_ms = event.duration_micros / 1000
+        if pendiente is None or duracion_ms < self.threshold_ms or event.command_name == "explain":
+            return
+        comando, ruta = pendiente
+        forma = describir_comando(event.command_name, comando)
+        logger.warning(f"Consulta lenta ({duracion_ms:.1f} ms) desde {ruta}: {forma}")
+        with self.lock:
+            estadistica = self.formas.get(forma)
+            if estadistica is None:
+                if len(self.formas) >= self.max_shapes:
+                    menor = min(self.formas, key=lambda k: self.formas[k]["max_ms"])
+                    del self.formas[menor]
+                estadistica = self.formas[forma] = {
+                    "forma": forma, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                    "ruta": ruta, "collscan": None,
+                }
+            estadistica["count"] += 1
+            estadistica["total_ms"] += duracion_ms
+            if duracion_ms >= estadistica["max_ms"]:
+                estadistica["max_ms"] = duracion_ms
+                estadistica["ruta"] = ruta
+            explicar = (
+                estadistica["collscan"] is None
+                and event.command_name in EXPLAIN_COMMANDS
+                and self.loop is not None
+                and random.random() < self.explain_rate
+            )
+            if explicar:
+                # Una sola explicación por forma; el resultado se marca al terminar
+                estadistica["collscan"] = False
+        if explicar:
+            explicado = {k: v for k, v in comando.items() if not k.startswith("$") and k not in EXPLAIN_EXCLUDED_FIELDS}
+            self.loop.call_soon_threadsafe(
+                lambda: asyncio.ensure_future(self.explicar(forma, ruta, comando.get("$db"), explicado))
+            )
+
+    async def explicar(self, forma: str, ruta: str, base: Optional[str], comando: dict):
+        try:
+            plan = await client[base or db.name].command({"explain": comando, "verbosity": "queryPlanner"})
+        except Exception:
+            logger.exception(f"No se pudo obtener explain de {forma}")
+            return
+        if plan_con_collscan(plan):
+            with self.lock:
+                if forma in self.formas:
+                    self.formas[forma]["collscan"] = True
+            logger.warning(f"COLLSCAN en {forma} desde {ruta}")
+
+    def top(self, limit: int):
+        with self.lock:
+            formas = [dict(estadistica) for estadistica in self.formas.values()]
+        formas.sort(key=lambda e: e["max_ms"], reverse=True)
+        for estadistica in formas:
+            estadistica["avg_ms"] = round(estadistica["total_ms"] / estadistica["count"], 3)
+        return formas[:limit]
+
+slow_queries = SlowQueryListener(SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN_RATE, SLOW_QUERY_MAX_SHAPES)
+
+def medir_cuerpo(cuerpo, etiquetas: tuple, inicio: float):
+    # En streaming la petición sigue en curso hasta el último bloque (o la desconexión), no al devolver la respuesta
+    async def iterar():
+        try:
+            async for bloque in cuerpo:
+                yield bloque
+        finally:
+            http_latency.observe(etiquetas, time.perf_counter() - inicio)
+            http_in_flight.dec(etiquetas)
+    return iterar()
+
+class MetricsRoute(APIRoute):
+    # Instrumenta cada ruta con su plantilla (p. ej. /api/productos/{producto_id}) sin resolverla de nuevo
+    def get_route_handler(self):
+        endpoint = self.dependant.call
+        if asyncio.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def timed_endpoint(**kwargs):
+                fases = fases_actuales.get()
+                if fases is None:
+                    return await endpoint(**kwargs)
+                inicio = time.perf_counter()
+                try:
+                    resultado = await endpoint(**kwargs)
+                except BaseException:
+                    fases.add("app", time.perf_counter() - inicio)
+                    raise
+                fases.fin_endpoint = time.perf_counter()
+                fases.add("app", fases.fin_endpoint - inicio)
+                return resultado
+
+            self.dependant.call = timed_endpoint
+        handler = super().get_route_handler()
+        metodo = ",".join(sorted(self.methods))
+        ruta = self.path_format
+        etiquetas = (metodo, ruta)
+
+        async def instrumented_handler(request: Request):
+            ruta_actual.set(f"{metodo} {ruta}")
+            fases = iniciar_fases(request)
+            if fases is None and not METRICS_ENABLED:
+                return await handler(request)
+            token = fases_actuales.set(fases)
+            if METRICS_ENABLED:
+                http_in_flight.inc(etiquetas)
+            inicio = time.perf_counter()
+            estado = 500
+            headers = None
+            streaming = False
+            try:
+                response = await handler(request)
+                estado = response.status_code
+                headers = response.headers
+                if METRICS_ENABLED and isinstance(response, StreamingResponse):
+                    response.body_iterator = medir_cuerpo(response.body_iterator, etiquetas, inicio)
+                    streaming = True
+                return response
+            except HTTPException as e:
+                estado = e.status_code
+                if fases is not None:
+                    headers = e.headers = dict(e.headers or {})
+                raise
+            except RequestValidationError:
+                estado = 422
+                raise
+            except NotModified as e:
+                estado = 304
+                headers = e.headers
+                raise
+            finally:
+                fin = time.perf_counter()
+                fases_actuales.reset(token)
+                if METRICS_ENABLED:
+                    if not streaming:
+                        http_latency.observe(etiquetas, fin - inicio)
+                        http_in_flight.dec(etiquetas)
+                    http_requests.inc((metodo, ruta, estado))
+                if fases is not None:
+                    terminar_fases(fases, fin - inicio, fin, headers, f"{metodo} {ruta}", estado)
+
+        return instrumented_handler
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    event_listeners=([CommandMetrics(), PoolMetrics()] if METRICS_ENABLED else []) + [slow_queries, TimingListener()]
+)
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
 app = FastAPI()
 
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=MetricsRoute)
 
 # Security configurations
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "your-secret-key-change-in-production")
@@ -36,21 +494,502 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=12)
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+# Días que se conservan las marcas de eliminación para /sync
+SYNC_TOMBSTONE_DAYS = int(os.environ.get("SYNC_TOMBSTONE_DAYS", "30"))
+
+# Días que se conservan los movimientos de stock sin agregar (0 = sin caducidad); los resúmenes diarios no caducan
+MOVIMIENTOS_RETENTION_DAYS = int(os.environ.get("MOVIMIENTOS_RETENTION_DAYS", "180"))
+
+# Índices declarativos por colección, aplicados al arrancar la aplicación
+MONGO_INDEXES = {
+    "productos": [
+        IndexModel([("id", ASCENDING)], name="id_unico", unique=True),
+        IndexModel([("codigo", ASCENDING)], name="codigo_unico", unique=True),
+        IndexModel([("codigo", ASCENDING), ("id", ASCENDING)], name="codigo_id"),
+        IndexModel([("stock_actual", ASCENDING)], name="stock_actual"),
+        IndexModel([("fecha_vencimiento", ASCENDING)], name="fecha_vencimiento"),
+        IndexModel([("_busqueda", ASCENDING)], name="busqueda"),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ],
+    "usuarios": [
+        IndexModel([("id", ASCENDING)], name="id_unico", unique=True),
+        IndexModel([("username", ASCENDING)], name="username_unico", unique=True),
+    ],
+    "contactos": [
+        IndexModel([("id", ASCENDING)], name="id_unico", unique=True),
+        IndexModel([("nombre", ASCENDING), ("id", ASCENDING)], name="nombre_id"),
+        IndexModel([("_busqueda", ASCENDING)], name="busqueda"),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ],
+    "configuracion": [
+        IndexModel([("id", ASCENDING)], name="id_unico", unique=True),
+    ],
+    "alertas_materializadas": [
+        IndexModel([("id", ASCENDING), ("tipo_alerta", ASCENDING)], name="id_tipo_unico", unique=True),
+        IndexModel([("producto_oid", ASCENDING), ("orden", ASCENDING)], name="orden"),
+        IndexModel([("codigo", ASCENDING)], name="codigo"),
+    ],
+    "eventos": [
+        IndexModel(
+            [("created_at", ASCENDING)],
+            name="created_at_ttl",
+            expireAfterSeconds=int(os.environ.get("EVENTS_RETENTION_SECONDS", "3600")),
+        ),
+    ],
+    "movimientos": [
+        IndexModel([("producto_id", ASCENDING), ("fecha", DESCENDING)], name="producto_fecha"),
+        IndexModel(
+            [("fecha", ASCENDING)],
+            name="fecha_ttl",
+            expireAfterSeconds=MOVIMIENTOS_RETENTION_DAYS * 24 * 60 * 60,
+        ) if MOVIMIENTOS_RETENTION_DAYS else IndexModel([("fecha", ASCENDING)], name="fecha"),
+    ],
+    "movimientos_diarios": [
+        IndexModel([("producto_id", ASCENDING), ("dia", ASCENDING)], name="producto_dia_unico", unique=True),
+        IndexModel([("dia", ASCENDING)], name="dia"),
+    ],
+    "eliminados": [
+        IndexModel(
+            [("deleted_at", ASCENDING)],
+            name="deleted_at_ttl",
+            expireAfterSeconds=SYNC_TOMBSTONE_DAYS * 24 * 60 * 60,
+        ),
+    ],
+}
 
 # Helper functions for MongoDB serialization
+# Las fechas se guardan como fechas BSON (medianoche UTC); DATE_STORAGE=string mantiene el texto ISO anterior.
+# Mientras dure la migración conviven ambos formatos y las lecturas aceptan los dos
+FECHAS_NATIVAS = os.environ.get("DATE_STORAGE", "native") != "string"
+FECHA_CAMPOS = ("fecha_ingreso", "fecha_vencimiento")
+
+def fecha_bson(valor: date):
+    return datetime.combine(valor, datetime.min.time())
+
+def como_guardada(valor: datetime):
+    # BSON guarda milisegundos en UTC y las lecturas devuelven la fecha sin zona: misma forma sin releer
+    valor = valor.astimezone(timezone.utc).replace(tzinfo=None)
+    return valor.replace(microsecond=valor.microsecond // 1000 * 1000)
+
 def prepare_for_mongo(data):
-    if isinstance(data.get('fecha_ingreso'), date):
-        data['fecha_ingreso'] = data['fecha_ingreso'].isoformat()
-    if isinstance(data.get('fecha_vencimiento'), date):
-        data['fecha_vencimiento'] = data['fecha_vencimiento'].isoformat()
+    for campo in FECHA_CAMPOS:
+        valor = data.get(campo)
+        if isinstance(valor, date) and not isinstance(valor, datetime):
+            data[campo] = fecha_bson(valor) if FECHAS_NATIVAS else valor.isoformat()
     return data
 
-def parse_from_mongo(item):
-    if isinstance(item.get('fecha_ingreso'), str):
-        item['fecha_ingreso'] = datetime.fromisoformat(item['fecha_ingreso']).date()
-    if isinstance(item.get('fecha_vencimiento'), str):
-        item['fecha_vencimiento'] = datetime.fromisoformat(item['fecha_vencimiento']).date()
-    return item
+def filtro_fecha(valor: date):
+    return {"$in": [fecha_bson(valor), valor.isoformat()]}
+
+def rango_vencimiento(desde: Optional[str], hasta: str):
+    # Un rango solo abarca un tipo BSON: se consulta el texto ISO y la fecha nativa por separado
+    rango_texto = {"$gt": desde or "", "$lte": hasta}
+    rango_fecha = {"$lte": fecha_bson(date.fromisoformat(hasta))}
+    if desde:
+        rango_fecha["$gt"] = fecha_bson(date.fromisoformat(desde))
+    return [{"fecha_vencimiento": rango_texto}, {"fecha_vencimiento": rango_fecha}]
+
+def como_fecha(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, str):
+        return date.fromisoformat(valor[:10])
+    return valor
+
+# In-process TTL/LRU cache
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key, value):
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+        }
+
+# Usuarios autenticados por username; cada worker invalida su copia y el TTL acota la desactualización entre workers
+user_cache = TTLCache(
+    maxsize=int(os.environ.get("USER_CACHE_SIZE", "1024")),
+    ttl=float(os.environ.get("USER_CACHE_TTL", "60")),
+)
+
+# JSON de los productos más escaneados por código; las escrituras locales lo invalidan y el TTL acota al resto
+codigo_cache = TTLCache(
+    maxsize=int(os.environ.get("CODIGO_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("CODIGO_CACHE_TTL", "10")),
+)
+
+# Versiones por colección para ETag; compartidas entre workers en Mongo y cacheadas en cada proceso
+VERSION_REFRESH_SECONDS = float(os.environ.get("VERSION_REFRESH_SECONDS", "1"))
+
+class VersionCache:
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self.versions = {}
+        self.checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self):
+        if time.monotonic() - self.checked_at >= self.refresh_seconds:
+            self.misses += 1
+            self.versions = await db.versiones.find_one({"_id": "versiones"}) or {}
+            self.checked_at = time.monotonic()
+        else:
+            self.hits += 1
+        return self.versions
+
+    async def bump(self, *colecciones):
+        self.versions = await db.versiones.find_one_and_update(
+            {"_id": "versiones"},
+            {"$inc": {coleccion: 1 for coleccion in colecciones}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self.checked_at = time.monotonic()
+
+version_cache = VersionCache(VERSION_REFRESH_SECONDS)
+
+class NotModified(Exception):
+    def __init__(self, etag: str):
+        self.etag = etag
+        self.headers = {}
+
+@app.exception_handler(NotModified)
+async def not_modified_handler(request: Request, exc: NotModified):
+    return Response(status_code=304, headers={**exc.headers, "ETag": exc.etag, "Cache-Control": "no-cache"})
+
+def etag_matches(if_none_match: Optional[str], etag: str):
+    if not if_none_match:
+        return False
+    candidates = [value.strip().removeprefix("W/") for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def etag_dependency(*colecciones):
+    async def dependency(request: Request, response: Response):
+        versiones = await version_cache.get()
+        partes = [f"{coleccion}.{versiones.get(coleccion, 0)}" for coleccion in colecciones]
+        if "alertas" in colecciones:
+            # dias_para_vencer y la ventana de vencimiento cambian cada día
+            partes.append(datetime.now().date().isoformat())
+        partes.append(request.url.query)
+        etag = '"' + hashlib.sha1("|".join(partes).encode()).hexdigest()[:24] + '"'
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            raise NotModified(etag)
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+        return {"ETag": etag, "Cache-Control": "no-cache"}
+    return dependency
+
+# Keyset pagination helpers
+def encode_cursor(valores):
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+
+def decode_cursor(cursor, campos):
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        valores = None
+    # Solo valores escalares: un objeto en el cursor acabaría como operador en el filtro ({"$ne": ...})
+    if (not isinstance(valores, list) or len(valores) != len(campos)
+            or not all(valor is None or isinstance(valor, (str, int, float)) for valor in valores)):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return valores
+
+def keyset_filter(campos, valores):
+    # (a, b) > (va, vb)  <=>  a > va  OR  (a == va AND b > vb)
+    condiciones = []
+    for i, campo in enumerate(campos):
+        condicion = dict(zip(campos[:i], valores[:i]))
+        condicion[campo] = {"$gt": valores[i]}
+        condiciones.append(condicion)
+    return {"$or": condiciones}
+
+async def paginar_keyset(collection, campos, cursor: str, limit: int, projection: Optional[dict] = None):
+    filtro = keyset_filter(campos, decode_cursor(cursor, campos)) if cursor else {}
+    docs = await collection.find(filtro, projection).sort([(campo, ASCENDING) for campo in campos]).limit(limit + 1).to_list(length=None)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor([docs[-1].get(campo) for campo in campos])
+    return docs, next_cursor
+
+# Search helpers: tokens normalizados (sin mayúsculas ni tildes) en un campo multikey indexado
+SEARCH_MAX_CANDIDATES = int(os.environ.get("SEARCH_MAX_CANDIDATES", "500"))
+SEARCH_FIELDS = {
+    "productos": ["codigo", "descripcion"],
+    "contactos": ["nombre", "correo"],
+}
+
+def normalizar_texto(texto: str):
+    texto = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in texto if not unicodedata.combining(c)).casefold().strip()
+
+def tokens_busqueda(doc: dict, campos):
+    tokens = set()
+    for campo in campos:
+        valor = doc.get(campo)
+        if not valor:
+            continue
+        normalizado = normalizar_texto(valor)
+        tokens.update(re.findall(r"\w+", normalizado))
+        # Códigos y correos también se indexan completos, con su puntuación
+        if len(normalizado) <= 64 and not re.search(r"\s", normalizado):
+            tokens.add(normalizado)
+    return sorted(tokens)
+
+async def buscar_documentos(collection, campos_orden, q: str, skip: int, limit: int):
+    consulta = normalizar_texto(q)
+    terminos = re.findall(r"\w+", consulta)
+    if not terminos:
+        return [], 0, False
+    
+    # Primero coincidencias exactas de todos los términos y luego por prefijo, siempre por el índice.
+    # Los candidatos salen en el orden del catálogo: si hay más de SEARCH_MAX_CANDIDATES, la puntuación
+    # ordena siempre los mismos y la respuesta lo indica con truncado y el total real de coincidencias
+    orden = [(campo, ASCENDING) for campo in [*campos_orden, "id"]]
+    candidatos = await collection.find({"_busqueda": {"$all": terminos}}).hint("busqueda").sort(orden).limit(SEARCH_MAX_CANDIDATES + 1).to_list(length=None)
+    prefijos = [{"_busqueda": {"$regex": f"^{re.escape(t)}"}} for t in terminos]
+    if len(candidatos) <= SEARCH_MAX_CANDIDATES:
+        filtro = {"$and": prefijos + [{"_id": {"$nin": [c["_id"] for c in candidatos]}}]}
+        candidatos += await collection.find(filtro).hint("busqueda").sort(orden).limit(SEARCH_MAX_CANDIDATES + 1 - len(candidatos)).to_list(length=None)
+    truncado = len(candidatos) > SEARCH_MAX_CANDIDATES
+    candidatos = candidatos[:SEARCH_MAX_CANDIDATES]
+    # Las coincidencias exactas también cumplen los prefijos: el total las cuenta una vez
+    total = await collection.count_documents({"$and": prefijos}, hint="busqueda") if truncado else len(candidatos)
+    
+    def puntuacion(doc):
+        tokens = set(doc.get("_busqueda", []))
+        score = sum(2 if t in tokens else 1 for t in terminos)
+        if consulta in tokens:
+            score += 2 * len(terminos)
+        return (-score, *[doc.get(campo) or "" for campo in campos_orden], doc.get("id") or "")
+    
+    candidatos.sort(key=puntuacion)
+    return candidatos[skip:skip + limit], total, truncado
+
+async def indexar_busqueda_pendiente(batch_size: int = 1000):
+    # Completa _busqueda en documentos anteriores a la búsqueda, en segundo plano
+    for collection_name, campos in SEARCH_FIELDS.items():
+        collection = db[collection_name]
+        total = 0
+        while True:
+            docs = await collection.find(
+                {"_busqueda": {"$exists": False}}, {campo: 1 for campo in campos}
+            ).limit(batch_size).to_list(length=None)
+            if not docs:
+                break
+            await collection.bulk_write(
+                [UpdateOne({"_id": doc["_id"]}, {"$set": {"_busqueda": tokens_busqueda(doc, campos)}}) for doc in docs],
+                ordered=False
+            )
+            total += len(docs)
+        if total:
+            logger.info(f"Tokens de búsqueda generados para {total} documentos de {collection_name}")
+
+DATE_MIGRATION_BATCH_SIZE = int(os.environ.get("DATE_MIGRATION_BATCH_SIZE", "1000"))
+
+async def migrar_fechas(batch_size: int = DATE_MIGRATION_BATCH_SIZE):
+    # Convierte las fechas ISO en texto a fechas BSON por lotes; al reiniciar retoma con las que queden en texto.
+    # Al terminar queda una marca en "migraciones" y los arranques siguientes no vuelven a recorrer productos
+    if await db.migraciones.find_one({"_id": "fechas_nativas"}):
+        return
+    pendientes = {"$or": [{campo: {"$type": "string"}} for campo in FECHA_CAMPOS]}
+    ultimo = None
+    total = 0
+    invalidas = 0
+    while True:
+        filtro = pendientes if ultimo is None else {"$and": [pendientes, {"_id": {"$gt": ultimo}}]}
+        docs = await db.productos.find(
+            filtro, {campo: 1 for campo in FECHA_CAMPOS}
+        ).sort("_id", 1).limit(batch_size).to_list(length=None)
+        if not docs:
+            break
+        operaciones = []
+        for doc in docs:
+            cambios = {}
+            for campo in FECHA_CAMPOS:
+                valor = doc.get(campo)
+                if not isinstance(valor, str):
+                    continue
+                try:
+                    cambios[campo] = fecha_bson(date.fromisoformat(valor[:10])) if valor else None
+                except ValueError:
+                    invalidas += 1
+            if cambios:
+                # Se exige el valor leído: si otra escritura lo cambió entretanto, esa escritura prevalece
+                operaciones.append(UpdateOne(
+                    {"_id": doc["_id"], **{campo: doc[campo] for campo in cambios}},
+                    {"$set": cambios}
+                ))
+        if operaciones:
+            total += (await db.productos.bulk_write(operaciones, ordered=False)).modified_count
+        ultimo = docs[-1]["_id"]
+    await db.migraciones.update_one(
+        {"_id": "fechas_nativas"},
+        {"$set": {"completada_en": datetime.now(timezone.utc), "migrados": total, "invalidas": invalidas}},
+        upsert=True
+    )
+    if invalidas:
+        logger.warning(f"{invalidas} fechas de productos no son ISO válidas y quedan como texto")
+    if total:
+        logger.info(f"Fechas migradas a formato nativo en {total} productos")
+        # Las alertas materializadas copian fecha_vencimiento: se regeneran con el nuevo formato
+        await reconstruir_alertas(await cargar_configuracion())
+
+# Fast JSON path for list endpoints
+FAST_JSON = os.environ.get("FAST_JSON", "1") == "1"
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        text = value.isoformat()
+        return text[:-6] + "Z" if text.endswith("+00:00") else text
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def json_bytes(content, orjson_compatible: bool = True):
+    fases = fases_actuales.get()
+    inicio = time.perf_counter() if fases is not None else 0.0
+    if orjson is not None and orjson_compatible:
+        contenido = orjson.dumps(content, option=orjson.OPT_UTC_Z)
+    else:
+        contenido = json.dumps(
+            content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_json_default
+        ).encode("utf-8")
+    if fases is not None:
+        fases.add("serializacion", time.perf_counter() - inicio)
+    return contenido
+
+def json_response(content, orjson_compatible: bool = True, headers: Optional[dict] = None):
+    return Response(content=json_bytes(content, orjson_compatible), media_type="application/json", headers=headers)
+
+class FastSerializer:
+    # Convierte documentos de Mongo en filas JSON idénticas a las del response_model, sin instanciar Pydantic
+    def __init__(self, model):
+        self.fields = []
+        for name, field in model.model_fields.items():
+            annotation = field.annotation
+            if get_origin(annotation) is Union:
+                annotation = next(a for a in get_args(annotation) if a is not type(None))
+            self.fields.append((name, annotation, field))
+        self.projection = {"_id": 0, **{name: 1 for name, _, _ in self.fields}}
+
+    def rows(self, docs):
+        fases = fases_actuales.get()
+        inicio = time.perf_counter() if fases is not None else 0.0
+        rows = []
+        # orjson escribe 1e-7 donde json escribe 1e-07: esos valores usan el encoder estándar
+        orjson_compatible = True
+        for doc in docs:
+            row = {}
+            for name, annotation, field in self.fields:
+                value = doc[name] if name in doc else field.get_default(call_default_factory=True)
+                if value is not None:
+                    if annotation is date:
+                        if isinstance(value, str):
+                            value = value[:10]
+                        elif isinstance(value, datetime):
+                            value = value.date()
+                    elif annotation is int and isinstance(value, float):
+                        value = int(value)
+                    elif annotation is float:
+                        value = float(value)
+                        if value and not 1e-4 <= abs(value) < 1e16:
+                            orjson_compatible = False
+                row[name] = value
+            rows.append(row)
+        if fases is not None:
+            fases.add("parse", time.perf_counter() - inicio)
+        return rows, orjson_compatible
+
+# Index management
+async def find_duplicates(collection, keys, limit=5):
+    group_id = {field: f"${field}" for field, _ in keys}
+    pipeline = [
+        {"$group": {"_id": group_id, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": limit},
+    ]
+    return [doc["_id"] async for doc in collection.aggregate(pipeline, allowDiskUse=True)]
+
+async def ensure_indexes(indexes=MONGO_INDEXES):
+    # Se comparan también las opciones: un índice con las mismas claves pero sin unique impide arrancar,
+    # y un cambio de expireAfterSeconds (retenciones configurables) se aplica sobre el índice existente
+    report = {"created": [], "existing": [], "updated": []}
+    for collection_name, index_models in indexes.items():
+        collection = db[collection_name]
+        existing = {
+            tuple(tuple(k) for k in info["key"]): {**info, "name": name}
+            for name, info in (await collection.index_information()).items()
+        }
+        for index in index_models:
+            keys = tuple(index.document["key"].items())
+            label = f"{collection_name}.{index.document['name']}"
+            actual = existing.get(keys)
+            if actual is not None:
+                if bool(actual.get("unique")) != bool(index.document.get("unique")):
+                    raise RuntimeError(
+                        f"El índice {actual['name']} de {collection_name} no coincide en unique con {label}: "
+                        f"hay que eliminarlo para que se cree con la definición actual"
+                    )
+                ttl = index.document.get("expireAfterSeconds")
+                if ttl == actual.get("expireAfterSeconds"):
+                    report["existing"].append(label)
+                    continue
+                if ttl is not None and actual.get("expireAfterSeconds") is not None:
+                    await db.command("collMod", collection_name, index={"name": actual["name"], "expireAfterSeconds": ttl})
+                    report["updated"].append(label)
+                    continue
+                # Activar o quitar la caducidad cambia el tipo de índice: se recrea
+                await collection.drop_index(actual["name"])
+                report["updated"].append(label)
+            try:
+                await collection.create_indexes([index])
+            except OperationFailure as e:
+                if e.code != 11000:
+                    raise
+                duplicates = await find_duplicates(collection, keys)
+                raise RuntimeError(
+                    f"No se puede crear el índice único {label}: existen valores duplicados {duplicates}"
+                ) from e
+            if actual is None:
+                report["created"].append(label)
+    return report
 
 # Authentication helper functions
 def verify_password(plain_password, hashed_password):
@@ -75,6 +1014,8 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    fases = fases_actuales.get()
+    inicio = time.perf_counter()
     try:
         token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -83,11 +1024,50 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             raise credentials_exception
     except JWTError:
         raise credentials_exception
+    finally:
+        if fases is not None:
+            fases.add("jwt", time.perf_counter() - inicio)
     
-    user = await db.usuarios.find_one({"username": username})
-    if user is None:
-        raise credentials_exception
-    return Usuario(**user)
+    inicio = time.perf_counter()
+    try:
+        usuario = user_cache.get(username)
+        if usuario is None:
+            user = await db.usuarios.find_one({"username": username})
+            if user is None:
+                raise credentials_exception
+            usuario = Usuario(**user)
+            user_cache.set(username, usuario)
+        # Desactivar un usuario invalida su entrada en caché: sus tokens dejan de valer en la siguiente petición
+        if not usuario.activo:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Usuario inactivo",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        return usuario
+    finally:
+        if fases is not None:
+            fases.add("usuario", time.perf_counter() - inicio)
+
+async def get_current_user_stream(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security), access_token: Optional[str] = Query(None)):
+    # EventSource no puede enviar cabeceras: se acepta también el token como parámetro
+    if credentials is None:
+        if not access_token:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Not authenticated",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=access_token)
+    return await get_current_user(credentials)
+
+async def get_current_maestro(current_user: "Usuario" = Depends(get_current_user)):
+    if current_user.rol != "maestro":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Se requiere rol maestro"
+        )
+    return current_user
 
 # Define Models
 class Usuario(BaseModel):
@@ -114,6 +1094,7 @@ class UsuarioUpdate(BaseModel):
 class PasswordChange(BaseModel):
     user_id: str
     new_password: str
+    current_password: Optional[str] = None  # obligatoria salvo para un maestro
 
 class UsuarioLogin(BaseModel):
     username: str
@@ -166,6 +1147,22 @@ class Producto(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class ProductoPagina(BaseModel):
+    items: List[Producto]
+    next_cursor: Optional[str] = None
+
+class ProductoBusqueda(BaseModel):
+    items: List[Producto]
+    total: int
+    truncado: bool = False
+
+class CodigosLote(BaseModel):
+    codigos: List[str] = Field(..., min_length=1, max_length=500)
+
+class ProductoLote(BaseModel):
+    items: List[Producto]
+    no_encontrados: List[str]
+
 class ProductoCreate(BaseModel):
     codigo: str
     descripcion: str
@@ -175,6 +1172,35 @@ class ProductoCreate(BaseModel):
     fecha_ingreso: Optional[date] = None
     fecha_vencimiento: Optional[date] = None
 
+class AjusteStock(BaseModel):
+    delta: int
+    permitir_negativo: bool = False
+
+class LineaPedido(BaseModel):
+    id: Optional[str] = None
+    codigo: Optional[str] = None
+    cantidad: int = Field(..., gt=0)
+
+class Pedido(BaseModel):
+    lineas: List[LineaPedido] = Field(..., min_length=1, max_length=1000)
+
+class LineaPedidoResultado(BaseModel):
+    id: str
+    codigo: str
+    cantidad: int
+    stock_actual: int
+
+class ImportacionError(BaseModel):
+    fila: int
+    codigo: Optional[str] = None
+    errores: List[str]
+
+class ImportacionResultado(BaseModel):
+    insertados: int = 0
+    actualizados: int = 0
+    fallidos: int = 0
+    errores: List[ImportacionError] = []
+
 class ProductoUpdate(BaseModel):
     codigo: Optional[str] = None
     descripcion: Optional[str] = None
@@ -192,6 +1218,16 @@ class Contacto(BaseModel):
     correo: Optional[str] = None
     tipo: str = "Proveedor"  # "Proveedor" o "Tienda"
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class ContactoPagina(BaseModel):
+    items: List[Contacto]
+    next_cursor: Optional[str] = None
+
+class ContactoBusqueda(BaseModel):
+    items: List[Contacto]
+    total: int
+    truncado: bool = False
 
 class ContactoCreate(BaseModel):
     nombre: str
@@ -226,6 +1262,89 @@ class AlertaProducto(BaseModel):
     fecha_vencimiento: Optional[date]
     dias_para_vencer: Optional[int]
 
+class PedidoResultado(BaseModel):
+    id: str
+    lineas: List[LineaPedidoResultado]
+    alertas: List[AlertaProducto]
+
+class ClaseABC(BaseModel):
+    clase: str
+    productos: int
+    valor: float
+    porcentaje_valor: float
+
+class ItemAnalitica(BaseModel):
+    id: str
+    codigo: str
+    stock_actual: int
+    valor: float
+    clase: str
+    valor_en_riesgo: float
+    dias_para_vencer: Optional[int] = None
+    dias_cobertura: Optional[float] = None
+
+class AnaliticaInventario(BaseModel):
+    generado_en: datetime
+    productos: int
+    unidades: int
+    valor_total: float
+    abc: List[ClaseABC]
+    valor_en_riesgo: float
+    valor_vencido: float
+    productos_en_riesgo: int
+    dias_ventas: int
+    con_ventas: bool
+    productos_sin_ventas: int
+    productos_bajo_cobertura: int
+    mediana_dias_cobertura: Optional[float] = None
+    top_valor: List[ItemAnalitica]
+    top_riesgo: List[ItemAnalitica]
+    menor_cobertura: List[ItemAnalitica]
+
+class Movimiento(BaseModel):
+    producto_id: str
+    codigo: str
+    tipo: str  # "alta", "edicion", "ajuste", "importacion", "pedido", "baja"
+    delta: int
+    stock_resultante: int
+    usuario: Optional[str] = None
+    referencia: Optional[str] = None
+    fecha: datetime
+
+class StockDiario(BaseModel):
+    dia: date
+    entradas: int = 0
+    salidas: int = 0
+    vendidas: int = 0
+    cierre: int
+
+class VentaDiaria(BaseModel):
+    dia: date
+    vendidas: int = 0
+    salidas: int = 0
+    entradas: int = 0
+
+class Bootstrap(BaseModel):
+    productos: List[Producto]
+    contactos: List[Contacto]
+    alertas: List[AlertaProducto]
+    configuracion: Configuracion
+
+class EliminadosSync(BaseModel):
+    productos: List[str] = []
+    contactos: List[str] = []
+
+class Sincronizacion(BaseModel):
+    productos: List[Producto]
+    contactos: List[Contacto]
+    eliminados: EliminadosSync
+    token: str
+    completo: bool
+
+PRODUCTO_JSON = FastSerializer(Producto)
+CONTACTO_JSON = FastSerializer(Contacto)
+ALERTA_JSON = FastSerializer(AlertaProducto)
+
 # AUTHENTICATION ENDPOINTS
 @api_router.post("/register", response_model=dict)
 async def register(user: UsuarioCreate):
@@ -248,7 +1367,13 @@ async def register(user: UsuarioCreate):
         "created_at": datetime.now(timezone.utc)
     }
     
-    await db.usuarios.insert_one(user_dict)
+    try:
+        await db.usuarios.insert_one(user_dict)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="El usuario ya existe"
+        )
     return {"message": "Usuario registrado exitosamente"}
 
 @api_router.post("/login", response_model=Token)
@@ -291,27 +1416,321 @@ async def read_users_me(current_user: Usuario = Depends(get_current_user)):
         "activo": current_user.activo
     }
 
+# USUARIOS ENDPOINTS
+@api_router.put("/usuarios/{user_id}", response_model=dict)
+async def actualizar_usuario(user_id: str, usuario_update: UsuarioUpdate, current_user: Usuario = Depends(get_current_maestro)):
+    update_dict = {k: v for k, v in usuario_update.dict().items() if v is not None}
+    if not update_dict:
+        raise HTTPException(status_code=400, detail="No hay datos para actualizar")
+    
+    usuario = await db.usuarios.find_one_and_update({"id": user_id}, {"$set": update_dict})
+    if not usuario:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    user_cache.invalidate(usuario["username"])
+    return {"message": "Usuario actualizado exitosamente"}
+
+@api_router.post("/usuarios/password", response_model=dict)
+async def cambiar_password(password_change: PasswordChange, current_user: Usuario = Depends(get_current_user)):
+    if current_user.rol != "maestro" and current_user.id != password_change.user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No autorizado")
+    
+    filtro = {"id": password_change.user_id}
+    if current_user.rol != "maestro":
+        # Un token robado no basta para cambiar la contraseña: se exige la actual
+        actual = await db.usuarios.find_one(filtro, {"_id": 0, "hashed_password": 1})
+        if not actual or not password_change.current_password or not verify_password(password_change.current_password, actual["hashed_password"]):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Contraseña actual incorrecta")
+        # Si otra petición la cambió entre medias, la actualización no aplica
+        filtro["hashed_password"] = actual["hashed_password"]
+    
+    usuario = await db.usuarios.find_one_and_update(
+        filtro,
+        {"$set": {"hashed_password": get_password_hash(password_change.new_password)}}
+    )
+    if not usuario:
+        if current_user.rol != "maestro":
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="La contraseña cambió durante la operación")
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    user_cache.invalidate(usuario["username"])
+    return {"message": "Contraseña actualizada exitosamente"}
+
+@api_router.get("/admin/cache", response_model=dict)
+async def estadisticas_cache(current_user: Usuario = Depends(get_current_maestro)):
+    return {"usuarios": user_cache.stats(), "codigos": codigo_cache.stats(), "eventos": event_bus.stats()}
+
+@api_router.get("/admin/consultas-lentas", response_model=List[dict])
+async def consultas_lentas(limit: int = Query(20, ge=1, le=SLOW_QUERY_MAX_SHAPES), current_user: Usuario = Depends(get_current_maestro)):
+    return slow_queries.top(limit)
+
 # PRODUCTOS ENDPOINTS
+codigo_cache_invalidaciones = 0
+
+def invalidar_codigos(*codigos):
+    global codigo_cache_invalidaciones
+    codigo_cache_invalidaciones += 1
+    for codigo in codigos:
+        codigo_cache.invalidate(codigo)
+
+async def productos_por_codigo(codigos: List[str]):
+    # Devuelve {codigo: JSON del producto}; solo los códigos que faltan en la caché van a Mongo, en una consulta
+    encontrados = {}
+    faltantes = []
+    for codigo in codigos:
+        contenido = codigo_cache.get(codigo)
+        if contenido is None:
+            faltantes.append(codigo)
+        else:
+            encontrados[codigo] = contenido
+    if faltantes:
+        invalidaciones = codigo_cache_invalidaciones
+        docs = await db.productos.find({"codigo": {"$in": faltantes}}, PRODUCTO_JSON.projection).to_list(length=None)
+        for doc in docs:
+            filas, orjson_compatible = PRODUCTO_JSON.rows([doc])
+            contenido = json_bytes(filas[0], orjson_compatible)
+            # Una escritura durante la lectura pudo dejar este resultado obsoleto: no se cachea
+            if invalidaciones == codigo_cache_invalidaciones:
+                codigo_cache.set(doc["codigo"], contenido)
+            encontrados[doc["codigo"]] = contenido
+    return encontrados
+
 @api_router.post("/productos", response_model=Producto)
 async def crear_producto(producto: ProductoCreate, current_user: Usuario = Depends(get_current_user)):
     producto_dict = producto.dict()
     producto_obj = Producto(**producto_dict)
-    # Prepare the dict for MongoDB insertion (convert dates to strings)
+    # Prepare the dict for MongoDB insertion (dates as BSON dates)
     mongo_dict = prepare_for_mongo(producto_obj.dict())
-    await db.productos.insert_one(mongo_dict)
+    mongo_dict["_busqueda"] = tokens_busqueda(mongo_dict, SEARCH_FIELDS["productos"])
+    try:
+        await db.productos.insert_one(mongo_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Ya existe un producto con ese código")
+    invalidar_codigos(producto_obj.codigo)
+    await registrar_movimientos([movimiento(
+        producto_obj.id, producto_obj.codigo, "alta", producto_obj.stock_actual, producto_obj.stock_actual,
+        current_user.username, producto_obj.created_at
+    )])
+    await refrescar_alertas({"id": producto_obj.id})
+    await version_cache.bump("productos", "alertas")
+    await publicar_evento("producto_creado", producto_obj.model_dump(mode="json"))
     return producto_obj
 
-@api_router.get("/productos", response_model=List[Producto])
-async def obtener_productos(skip: int = Query(0, ge=0), limit: int = Query(1000, le=3000), current_user: Usuario = Depends(get_current_user)):
+@api_router.get("/productos", response_model=Union[List[Producto], ProductoPagina])
+async def obtener_productos(skip: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=3000), cursor: Optional[str] = None, current_user: Usuario = Depends(get_current_user), etag_headers: dict = Depends(etag_dependency("productos"))):
+    # Con cursor (vacío para la primera página) se pagina por (codigo, id) y se devuelve next_cursor
+    if cursor is not None:
+        productos, next_cursor = await paginar_keyset(
+            db.productos, ["codigo", "id"], cursor, limit, PRODUCTO_JSON.projection if FAST_JSON else None
+        )
+        if FAST_JSON:
+            items, orjson_compatible = PRODUCTO_JSON.rows(productos)
+            return json_response({"items": items, "next_cursor": next_cursor}, orjson_compatible, etag_headers)
+        return ProductoPagina(
+            items=[Producto(**producto) for producto in productos],
+            next_cursor=next_cursor
+        )
+    if FAST_JSON:
+        productos = await db.productos.find({}, PRODUCTO_JSON.projection).skip(skip).limit(limit).to_list(length=None)
+        return json_response(*PRODUCTO_JSON.rows(productos), etag_headers)
     productos = await db.productos.find().skip(skip).limit(limit).to_list(length=None)
-    return [Producto(**parse_from_mongo(producto)) for producto in productos]
+    return [Producto(**producto) for producto in productos]
+
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+
+async def exportar_productos_stream(filtro: dict, formato: str):
+    campos = list(Producto.model_fields)
+    cursor = db.productos.find(filtro, {"_id": 0}).batch_size(EXPORT_BATCH_SIZE)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if formato == "csv":
+        writer.writerow(campos)
+    filas = 0
+    # Se emite un bloque por lote del cursor: la memoria queda acotada y el envío aplica contrapresión
+    async for producto in cursor:
+        producto = Producto(**producto)
+        if formato == "csv":
+            writer.writerow(["" if v is None else v for v in producto.model_dump(mode="json").values()])
+        else:
+            buffer.write(producto.model_dump_json())
+            buffer.write("\n")
+        filas += 1
+        if filas % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@api_router.get("/productos/export")
+async def exportar_productos(formato: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"), filtros: ProductoUpdate = Depends(), current_user: Usuario = Depends(get_current_user)):
+    filtro = {
+        k: filtro_fecha(v) if k in FECHA_CAMPOS else v
+        for k, v in filtros.dict().items() if v is not None
+    }
+    media_type = "text/csv" if formato == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        exportar_productos_stream(filtro, formato),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=inventario.{formato}"}
+    )
+
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "1000"))
+
+def validar_utf8(archivo):
+    # Un registro CSV puede ocupar varias líneas: el archivo se valida entero antes de escribir ningún lote
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    linea = 1
+    try:
+        for bloque in iter(lambda: archivo.read(1 << 16), b""):
+            try:
+                linea += decoder.decode(bloque).count("\n")
+            except UnicodeDecodeError as e:
+                linea += bloque[:e.start].count(b"\n")
+                raise
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail=f"El archivo no es UTF-8 válido (línea {linea})")
+    archivo.seek(0)
+
+def leer_filas_importacion(archivo, formato: str):
+    if formato == "csv":
+        validar_utf8(archivo)
+        reader = csv.DictReader(io.TextIOWrapper(archivo, encoding="utf-8-sig", newline=""))
+        for fila in reader:
+            yield reader.line_num, {k: v for k, v in fila.items() if k and v not in (None, "")}
+        return
+    # NDJSON se decodifica por línea: una línea con bytes inválidos es un error de esa fila
+    for numero, linea in enumerate(archivo, start=1):
+        try:
+            linea = linea.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            yield numero, ValueError("La línea no es UTF-8 válido")
+            continue
+        if not linea.strip():
+            continue
+        try:
+            fila = json.loads(linea)
+        except ValueError as e:
+            yield numero, e
+            continue
+        yield numero, fila if isinstance(fila, dict) else ValueError("La línea no es un objeto JSON")
+
+def upsert_por_codigo(producto: ProductoCreate):
+    ahora = datetime.now(timezone.utc)
+    campos = prepare_for_mongo(producto.dict(exclude_unset=True))
+    campos["codigo"] = producto.codigo
+    campos["updated_at"] = ahora
+    campos["_busqueda"] = tokens_busqueda(producto.dict(), SEARCH_FIELDS["productos"])
+    # Las columnas ausentes no pisan valores existentes; solo toman su valor por defecto al insertar
+    por_defecto = {k: v for k, v in prepare_for_mongo(producto.dict()).items() if k not in campos}
+    por_defecto.update({"id": str(uuid.uuid4()), "created_at": ahora})
+    return UpdateOne(
+        {"codigo": producto.codigo},
+        {"$set": campos, "$setOnInsert": por_defecto},
+        upsert=True
+    )
+
+async def stock_por_codigo(codigos: List[str]):
+    docs = await db.productos.find(
+        {"codigo": {"$in": codigos}}, {"_id": 0, "id": 1, "codigo": 1, "stock_actual": 1}
+    ).to_list(length=None)
+    return {doc["codigo"]: doc for doc in docs}
+
+async def aplicar_lote_importacion(operaciones: list, filas: list, resultado: ImportacionResultado, usuario: str):
+    # El stock se lee antes y después del lote para registrar la diferencia como movimiento
+    codigos = [codigo for _, codigo in filas]
+    anteriores = await stock_por_codigo(codigos)
+    try:
+        detalle = (await db.productos.bulk_write(operaciones, ordered=False)).bulk_api_result
+    except BulkWriteError as e:
+        detalle = e.details
+    for error in detalle.get("writeErrors", []):
+        fila, codigo = filas[error["index"]]
+        resultado.errores.append(ImportacionError(fila=fila, codigo=codigo, errores=[error["errmsg"]]))
+    resultado.insertados += detalle.get("nUpserted", 0)
+    resultado.actualizados += detalle.get("nMatched", 0)
+    resultado.fallidos += len(detalle.get("writeErrors", []))
+    invalidar_codigos(*codigos)
+    ahora = datetime.now(timezone.utc)
+    movimientos = []
+    for codigo, actual in (await stock_por_codigo(codigos)).items():
+        anterior = anteriores.get(codigo)
+        delta = actual.get("stock_actual", 0) - (anterior.get("stock_actual", 0) if anterior else 0)
+        if anterior is None or delta:
+            movimientos.append(movimiento(
+                actual["id"], codigo, "importacion" if anterior else "alta", delta, actual.get("stock_actual", 0), usuario, ahora
+            ))
+    await registrar_movimientos(movimientos)
+    await refrescar_alertas({"codigo": {"$in": codigos}})
+    await version_cache.bump("productos", "alertas")
+    await publicar_evento("productos_importados", {
+        "codigos": codigos,
+        "insertados": detalle.get("nUpserted", 0),
+        "actualizados": detalle.get("nMatched", 0),
+    })
+
+@api_router.post("/productos/import", response_model=ImportacionResultado)
+async def importar_productos(archivo: UploadFile = File(...), formato: Optional[str] = Query(None, alias="format", pattern="^(ndjson|csv)$"), batch_size: int = Query(IMPORT_BATCH_SIZE, ge=1, le=10000), current_user: Usuario = Depends(get_current_user)):
+    if formato is None:
+        formato = "csv" if (archivo.filename or "").lower().endswith(".csv") else "ndjson"
+    
+    resultado = ImportacionResultado()
+    operaciones, filas = [], []
+    for numero, fila in leer_filas_importacion(archivo.file, formato):
+        try:
+            if isinstance(fila, Exception):
+                raise fila
+            producto = ProductoCreate(**fila)
+        except ValidationError as e:
+            resultado.fallidos += 1
+            # El código se informa como texto aunque venga como número (p. ej. un código de barras)
+            resultado.errores.append(ImportacionError(
+                fila=numero,
+                codigo=str(fila["codigo"]) if fila.get("codigo") is not None else None,
+                errores=[f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors()]
+            ))
+            continue
+        except ValueError as e:
+            resultado.fallidos += 1
+            resultado.errores.append(ImportacionError(fila=numero, errores=[str(e)]))
+            continue
+        
+        operaciones.append(upsert_por_codigo(producto))
+        filas.append((numero, producto.codigo))
+        if len(operaciones) >= batch_size:
+            await aplicar_lote_importacion(operaciones, filas, resultado, current_user.username)
+            operaciones, filas = [], []
+    
+    if operaciones:
+        await aplicar_lote_importacion(operaciones, filas, resultado, current_user.username)
+    return resultado
+
+@api_router.get("/productos/codigo/{codigo}", response_model=Producto)
+async def obtener_producto_por_codigo(codigo: str, current_user: Usuario = Depends(get_current_user)):
+    contenido = (await productos_por_codigo([codigo])).get(codigo)
+    if contenido is None:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    return Response(content=contenido, media_type="application/json")
+
+@api_router.post("/productos/codigo:batch", response_model=ProductoLote)
+async def obtener_productos_por_codigo(lote: CodigosLote, current_user: Usuario = Depends(get_current_user)):
+    codigos = list(dict.fromkeys(lote.codigos))
+    encontrados = await productos_por_codigo(codigos)
+    # La respuesta se arma con el JSON cacheado de cada producto, sin volver a serializarlo
+    contenido = b'{"items":[' + b",".join(encontrados[c] for c in codigos if c in encontrados) + b'],"no_encontrados":'
+    contenido += json_bytes([c for c in codigos if c not in encontrados]) + b"}"
+    return Response(content=contenido, media_type="application/json")
+
+@api_router.get("/productos/search", response_model=ProductoBusqueda)
+async def buscar_productos(q: str = Query(..., min_length=1), skip: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=200), current_user: Usuario = Depends(get_current_user)):
+    productos, total, truncado = await buscar_documentos(db.productos, ["codigo"], q, skip, limit)
+    return ProductoBusqueda(items=[Producto(**p) for p in productos], total=total, truncado=truncado)
 
 @api_router.get("/productos/{producto_id}", response_model=Producto)
 async def obtener_producto(producto_id: str, current_user: Usuario = Depends(get_current_user)):
     producto = await db.productos.find_one({"id": producto_id})
     if not producto:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
-    return Producto(**parse_from_mongo(producto))
+    return Producto(**producto)
 
 @api_router.put("/productos/{producto_id}", response_model=Producto)
 async def actualizar_producto(producto_id: str, producto_update: ProductoUpdate, current_user: Usuario = Depends(get_current_user)):
@@ -320,44 +1739,655 @@ async def actualizar_producto(producto_id: str, producto_update: ProductoUpdate,
         raise HTTPException(status_code=400, detail="No hay datos para actualizar")
     
     update_dict = prepare_for_mongo(update_dict)
-    update_dict["updated_at"] = datetime.now(timezone.utc)
+    update_dict["updated_at"] = como_guardada(datetime.now(timezone.utc))
     
-    result = await db.productos.update_one(
-        {"id": producto_id}, 
-        {"$set": update_dict}
-    )
+    try:
+        # Se devuelve el documento anterior: da el código previo a invalidar y la diferencia de stock,
+        # y con el $set aplicado encima es el estado posterior sin releer (un borrado concurrente no lo anula)
+        anterior = await db.productos.find_one_and_update(
+            {"id": producto_id},
+            {"$set": update_dict},
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Ya existe un producto con ese código")
     
-    if result.matched_count == 0:
+    if anterior is None:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
+    producto_actualizado = {**anterior, **update_dict}
     
-    producto_actualizado = await db.productos.find_one({"id": producto_id})
-    return Producto(**parse_from_mongo(producto_actualizado))
+    invalidar_codigos(anterior["codigo"], producto_actualizado["codigo"])
+    if "stock_actual" in update_dict and update_dict["stock_actual"] != anterior.get("stock_actual", 0):
+        await registrar_movimientos([movimiento(
+            producto_id, producto_actualizado["codigo"], "edicion",
+            update_dict["stock_actual"] - anterior.get("stock_actual", 0), update_dict["stock_actual"],
+            current_user.username, update_dict["updated_at"]
+        )])
+    await refrescar_alertas({"id": producto_id})
+    await version_cache.bump("productos", "alertas")
+    if "codigo" in update_dict or "descripcion" in update_dict:
+        await db.productos.update_one(
+            {"id": producto_id},
+            {"$set": {"_busqueda": tokens_busqueda(producto_actualizado, SEARCH_FIELDS["productos"])}}
+        )
+    producto_obj = Producto(**producto_actualizado)
+    await publicar_evento("producto_actualizado", producto_obj.model_dump(mode="json"))
+    return producto_obj
+
+@api_router.post("/productos/{producto_id}/ajuste", response_model=Producto)
+async def ajustar_stock(producto_id: str, ajuste: AjusteStock, current_user: Usuario = Depends(get_current_user)):
+    filtro = {"id": producto_id}
+    if ajuste.delta < 0 and not ajuste.permitir_negativo:
+        filtro["stock_actual"] = {"$gte": -ajuste.delta}
+    
+    # Incremento atómico en el servidor: sin lectura previa ni actualizaciones perdidas
+    producto_actualizado = await db.productos.find_one_and_update(
+        filtro,
+        {"$inc": {"stock_actual": ajuste.delta}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not producto_actualizado:
+        if not await db.productos.count_documents({"id": producto_id}, limit=1):
+            raise HTTPException(status_code=404, detail="Producto no encontrado")
+        raise HTTPException(status_code=409, detail="Stock insuficiente para el ajuste")
+    
+    invalidar_codigos(producto_actualizado["codigo"])
+    if ajuste.delta:
+        await registrar_movimientos([movimiento(
+            producto_id, producto_actualizado["codigo"], "ajuste", ajuste.delta, producto_actualizado["stock_actual"],
+            current_user.username, producto_actualizado["updated_at"]
+        )])
+    await refrescar_alertas({"id": producto_id})
+    await version_cache.bump("productos", "alertas")
+    producto_obj = Producto(**producto_actualizado)
+    await publicar_evento("producto_actualizado", producto_obj.model_dump(mode="json"))
+    return producto_obj
 
 @api_router.delete("/productos/{producto_id}")
 async def eliminar_producto(producto_id: str, current_user: Usuario = Depends(get_current_user)):
-    result = await db.productos.delete_one({"id": producto_id})
-    if result.deleted_count == 0:
+    eliminado = await db.productos.find_one_and_delete({"id": producto_id}, projection={"_id": 0, "codigo": 1, "stock_actual": 1})
+    if eliminado is None:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
+    invalidar_codigos(eliminado["codigo"])
+    await registrar_movimientos([movimiento(
+        producto_id, eliminado["codigo"], "baja", -eliminado.get("stock_actual", 0), 0, current_user.username
+    )])
+    await refrescar_alertas({"id": producto_id}, eliminado=True)
+    await registrar_eliminacion("productos", producto_id)
+    await version_cache.bump("productos", "alertas")
+    await publicar_evento("producto_eliminado", {"id": producto_id})
     return {"message": "Producto eliminado exitosamente"}
 
+# PEDIDOS ENDPOINTS
+# auto: transacciones si el despliegue es replica set o mongos; si no, compensación
+PEDIDOS_TRANSACCIONES = os.environ.get("PEDIDOS_TRANSACCIONES", "auto")
+transacciones_soportadas = None
+
+class StockInsuficiente(Exception):
+    pass
+
+async def soporta_transacciones():
+    global transacciones_soportadas
+    if transacciones_soportadas is None:
+        if PEDIDOS_TRANSACCIONES == "auto":
+            hello = await db.command("hello")
+            transacciones_soportadas = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+        else:
+            transacciones_soportadas = PEDIDOS_TRANSACCIONES == "1"
+    return transacciones_soportadas
+
+async def resolver_lineas_pedido(lineas: List[LineaPedido]):
+    # Una sola lectura resuelve ids y códigos; las líneas del mismo producto se suman
+    ids = [linea.id for linea in lineas if linea.id]
+    codigos = [linea.codigo for linea in lineas if not linea.id]
+    productos = await db.productos.find(
+        {"$or": [{"id": {"$in": ids}}, {"codigo": {"$in": codigos}}]},
+        {"_id": 0, "id": 1, "codigo": 1}
+    ).to_list(length=None)
+    por_id = {p["id"]: p for p in productos}
+    por_codigo = {p["codigo"]: p for p in productos}
+    cantidades = {}
+    faltantes = []
+    for linea in lineas:
+        producto = por_id.get(linea.id) if linea.id else por_codigo.get(linea.codigo)
+        if producto is None:
+            faltantes.append(linea.id or linea.codigo)
+            continue
+        cantidades[producto["id"]] = cantidades.get(producto["id"], 0) + linea.cantidad
+    if faltantes:
+        raise HTTPException(status_code=404, detail=f"Productos no encontrados: {', '.join(faltantes)}")
+    return cantidades, {p["id"]: p["codigo"] for p in productos}
+
+async def codigos_sin_stock(cantidades: dict, codigos: dict, session=None):
+    productos = await db.productos.find(
+        {"id": {"$in": list(cantidades)}}, {"_id": 0, "id": 1, "stock_actual": 1}, session=session
+    ).to_list(length=None)
+    return [codigos[p["id"]] for p in productos if p.get("stock_actual", 0) < cantidades[p["id"]]]
+
+def operaciones_pedido(cantidades: dict, ahora: datetime, pedido_id: Optional[str] = None):
+    # Cada $inc solo aplica si hay stock suficiente; sin transacciones la línea queda marcada con el pedido
+    operaciones = []
+    for producto_id, cantidad in cantidades.items():
+        update = {"$inc": {"stock_actual": -cantidad}, "$set": {"updated_at": ahora}}
+        if pedido_id:
+            update["$push"] = {"_pedidos_pendientes": pedido_id}
+        operaciones.append(UpdateOne({"id": producto_id, "stock_actual": {"$gte": cantidad}}, update))
+    return operaciones
+
+async def despachar_con_transaccion(cantidades: dict, codigos: dict, ahora: datetime):
+    operaciones = operaciones_pedido(cantidades, ahora)
+
+    async def aplicar(session):
+        resultado = await db.productos.bulk_write(operaciones, ordered=False, session=session)
+        if resultado.matched_count != len(operaciones):
+            raise StockInsuficiente()
+
+    try:
+        async with await client.start_session() as session:
+            await session.with_transaction(aplicar)
+    except StockInsuficiente:
+        # Tras abortar se lee el stock previo al pedido: dentro de la transacción ya estaría descontado
+        raise StockInsuficiente(await codigos_sin_stock(cantidades, codigos))
+
+def limpiar_pendientes(cantidades: dict, pedido_id: str):
+    # Acotado por id para usar el índice; la marca vacía se elimina en el mismo bulk_write
+    ids = {"id": {"$in": list(cantidades)}}
+    return [
+        UpdateMany({**ids, "_pedidos_pendientes": pedido_id}, {"$pull": {"_pedidos_pendientes": pedido_id}}),
+        UpdateMany({**ids, "_pedidos_pendientes": {"$size": 0}}, {"$unset": {"_pedidos_pendientes": ""}}),
+    ]
+
+async def despachar_con_compensacion(cantidades: dict, codigos: dict, ahora: datetime, pedido_id: str):
+    operaciones = operaciones_pedido(cantidades, ahora, pedido_id)
+    resultado = await db.productos.bulk_write(operaciones, ordered=False)
+    if resultado.matched_count != len(operaciones):
+        await db.productos.bulk_write([
+            UpdateOne(
+                {"id": producto_id, "_pedidos_pendientes": pedido_id},
+                {"$inc": {"stock_actual": cantidad}}
+            )
+            for producto_id, cantidad in cantidades.items()
+        ] + limpiar_pendientes(cantidades, pedido_id))
+        raise StockInsuficiente(await codigos_sin_stock(cantidades, codigos))
+    await db.productos.bulk_write(limpiar_pendientes(cantidades, pedido_id))
+
+@api_router.post("/pedidos", response_model=PedidoResultado)
+async def registrar_pedido(pedido: Pedido, current_user: Usuario = Depends(get_current_user)):
+    if any(bool(linea.id) == bool(linea.codigo) for linea in pedido.lineas):
+        raise HTTPException(status_code=400, detail="Cada línea debe indicar id o codigo")
+    cantidades, codigos = await resolver_lineas_pedido(pedido.lineas)
+    pedido_id = str(uuid.uuid4())
+    ahora = datetime.now(timezone.utc)
+    # Todas las líneas van en un solo bulk_write: los round trips no crecen con el número de líneas
+    try:
+        if await soporta_transacciones():
+            await despachar_con_transaccion(cantidades, codigos, ahora)
+        else:
+            await despachar_con_compensacion(cantidades, codigos, ahora, pedido_id)
+    except StockInsuficiente as e:
+        raise HTTPException(status_code=409, detail=f"Stock insuficiente para: {', '.join(e.args[0])}")
+    
+    invalidar_codigos(*codigos.values())
+    productos = await db.productos.find(
+        {"id": {"$in": list(cantidades)}}, {"_id": 0, "id": 1, "stock_actual": 1}
+    ).to_list(length=None)
+    stock = {p["id"]: p["stock_actual"] for p in productos}
+    await registrar_movimientos([
+        movimiento(producto_id, codigos[producto_id], "pedido", -cantidad, stock.get(producto_id, 0), current_user.username, ahora, pedido_id)
+        for producto_id, cantidad in cantidades.items()
+    ])
+    alertas = await refrescar_alertas({"id": {"$in": list(cantidades)}})
+    await version_cache.bump("productos", "alertas")
+    lineas = [
+        LineaPedidoResultado(id=producto_id, codigo=codigos[producto_id], cantidad=cantidad, stock_actual=stock.get(producto_id, 0))
+        for producto_id, cantidad in cantidades.items()
+    ]
+    await publicar_evento("pedido_despachado", {"id": pedido_id, "lineas": [linea.model_dump() for linea in lineas]})
+    return PedidoResultado(id=pedido_id, lineas=lineas, alertas=alertas)
+
+# MOVIMIENTOS DE STOCK
+# Cada cambio de stock_actual deja un movimiento inmutable en "movimientos" y suma en el resumen
+# diario del producto en "movimientos_diarios" (días en UTC); las consultas históricas leen los resúmenes
+def movimiento(producto_id: str, codigo: str, tipo: str, delta: int, stock_resultante: int, usuario: Optional[str], fecha: Optional[datetime] = None, referencia: Optional[str] = None):
+    return {
+        "producto_id": producto_id,
+        "codigo": codigo,
+        "tipo": tipo,
+        "delta": delta,
+        "stock_resultante": stock_resultante,
+        "usuario": usuario,
+        "referencia": referencia,
+        "fecha": fecha or datetime.now(timezone.utc),
+    }
+
+def dia_utc(fecha: datetime):
+    if fecha.tzinfo is not None:
+        fecha = fecha.astimezone(timezone.utc)
+    return datetime(fecha.year, fecha.month, fecha.day)
+
+def operacion_resumen(mov: dict):
+    # Update con pipeline: los contadores se suman y el cierre solo lo reemplaza un movimiento posterior,
+    # así dos escrituras concurrentes que llegan desordenadas no dejan un cierre antiguo
+    entradas = max(mov["delta"], 0)
+    salidas = max(-mov["delta"], 0)
+    return UpdateOne(
+        {"producto_id": mov["producto_id"], "dia": dia_utc(mov["fecha"])},
+        [{"$set": {
+            "codigo": mov["codigo"],
+            "entradas": {"$add": [{"$ifNull": ["$entradas", 0]}, entradas]},
+            "salidas": {"$add": [{"$ifNull": ["$salidas", 0]}, salidas]},
+            "vendidas": {"$add": [{"$ifNull": ["$vendidas", 0]}, salidas if mov["tipo"] == "pedido" else 0]},
+            "movimientos": {"$add": [{"$ifNull": ["$movimientos", 0]}, 1]},
+            "cierre": {"$cond": [
+                {"$lte": [{"$ifNull": ["$cierre_en", mov["fecha"]]}, mov["fecha"]]},
+                mov["stock_resultante"],
+                "$cierre",
+            ]},
+            "cierre_en": {"$max": ["$cierre_en", mov["fecha"]]},
+        }}],
+        upsert=True
+    )
+
+async def registrar_movimientos(movimientos: List[dict]):
+    if not movimientos:
+        return
+    resumenes = [operacion_resumen(mov) for mov in movimientos]
+    await asyncio.gather(
+        db.movimientos.insert_many(movimientos, ordered=False),
+        db.movimientos_diarios.bulk_write(resumenes, ordered=False),
+    )
+
+def dias_consulta(dias: int):
+    hoy = datetime.now(timezone.utc).date()
+    return [hoy - timedelta(days=n) for n in range(dias - 1, -1, -1)]
+
+@api_router.get("/productos/{producto_id}/movimientos", response_model=List[Movimiento])
+async def obtener_movimientos(producto_id: str, limit: int = Query(100, ge=1, le=1000), current_user: Usuario = Depends(get_current_user)):
+    # Movimientos sin agregar, solo dentro de MOVIMIENTOS_RETENTION_DAYS
+    return await db.movimientos.find(
+        {"producto_id": producto_id}, {"_id": 0}
+    ).sort("fecha", DESCENDING).limit(limit).to_list(length=None)
+
+@api_router.get("/productos/{producto_id}/stock-diario", response_model=List[StockDiario])
+async def obtener_stock_diario(producto_id: str, dias: int = Query(90, ge=1, le=730), current_user: Usuario = Depends(get_current_user)):
+    calendario = dias_consulta(dias)
+    inicio = fecha_bson(calendario[0])
+    resumenes, previo, producto = await asyncio.gather(
+        db.movimientos_diarios.find(
+            {"producto_id": producto_id, "dia": {"$gte": inicio}}, {"_id": 0}
+        ).sort("dia", ASCENDING).to_list(length=None),
+        db.movimientos_diarios.find_one(
+            {"producto_id": producto_id, "dia": {"$lt": inicio}}, {"_id": 0, "cierre": 1}, sort=[("dia", DESCENDING)]
+        ),
+        db.productos.find_one({"id": producto_id}, {"_id": 0, "stock_actual": 1}),
+    )
+    if producto is None and not resumenes and previo is None:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    
+    # Stock al abrir el periodo: cierre anterior, o se deduce del primer día con movimientos,
+    # o sin movimientos en el periodo es el stock actual
+    if previo is not None:
+        stock = previo["cierre"]
+    elif resumenes:
+        stock = resumenes[0]["cierre"] - resumenes[0]["entradas"] + resumenes[0]["salidas"]
+    else:
+        stock = producto.get("stock_actual", 0)
+    
+    por_dia = {como_fecha(r["dia"]): r for r in resumenes}
+    serie = []
+    for dia in calendario:
+        resumen = por_dia.get(dia)
+        if resumen is None:
+            serie.append(StockDiario(dia=dia, cierre=stock))
+            continue
+        stock = resumen["cierre"]
+        serie.append(StockDiario(
+            dia=dia,
+            entradas=resumen["entradas"],
+            salidas=resumen["salidas"],
+            vendidas=resumen["vendidas"],
+            cierre=stock,
+        ))
+    return serie
+
+@api_router.get("/movimientos/ventas-diarias", response_model=List[VentaDiaria])
+async def obtener_ventas_diarias(dias: int = Query(30, ge=1, le=730), producto_id: Optional[str] = None, current_user: Usuario = Depends(get_current_user)):
+    calendario = dias_consulta(dias)
+    filtro = {"dia": {"$gte": fecha_bson(calendario[0])}}
+    if producto_id:
+        filtro["producto_id"] = producto_id
+    totales = await db.movimientos_diarios.aggregate([
+        {"$match": filtro},
+        {"$group": {
+            "_id": "$dia",
+            "vendidas": {"$sum": "$vendidas"},
+            "salidas": {"$sum": "$salidas"},
+            "entradas": {"$sum": "$entradas"},
+        }},
+    ]).to_list(length=None)
+    por_dia = {como_fecha(t["_id"]): t for t in totales}
+    return [
+        VentaDiaria(dia=dia, **{k: v for k, v in por_dia[dia].items() if k != "_id"}) if dia in por_dia else VentaDiaria(dia=dia)
+        for dia in calendario
+    ]
+
+# ANALÍTICA DE INVENTARIO
+# Una sola agregación une productos y ventas recientes en Mongo y devuelve columnas (arrays por bloque de ids)
+# en vez de un documento por producto; el cálculo es vectorizado con numpy sobre esas columnas
+ANALYTICS_SALES_DAYS = int(os.environ.get("ANALYTICS_SALES_DAYS", "30"))
+ANALYTICS_MIN_COVER_DAYS = float(os.environ.get("ANALYTICS_MIN_COVER_DAYS", "7"))
+ANALYTICS_TOP = int(os.environ.get("ANALYTICS_TOP", "20"))
+ABC_UMBRALES = (0.8, 0.95)
+ABC_CLASES = ("A", "B", "C")
+# Columnas numéricas con su tipo BSON fijo (el pipeline las convierte): int64 = 0x12, double = 0x01
+ANALITICA_COLUMNAS = (
+    ("stock_actual", "long", 0x12, "<i8"),
+    ("precio_venta", "double", 0x01, "<f8"),
+    ("dias_para_vencer", "double", 0x01, "<f8"),
+    ("vendidas", "double", 0x01, "<f8"),
+)
+
+analitica_lock = asyncio.Lock()
+analitica_cache = (None, None)
+
+def analitica_pipeline(hoy: date, inicio_ventas: datetime):
+    # $convert acepta fechas nativas y texto ISO; sin vencimiento o con un texto que no es fecha queda NaN
+    vencimiento = {"$convert": {"input": "$fecha_vencimiento", "to": "date", "onError": None, "onNull": None}}
+    dias_para_vencer = {"$floor": {"$divide": [{"$subtract": [vencimiento, fecha_bson(hoy)]}, 24 * 60 * 60 * 1000]}}
+    return [
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "producto": {"$literal": True},
+            "stock_actual": 1,
+            "precio_venta": 1,
+            "dias_para_vencer": {"$ifNull": [dias_para_vencer, float("nan")]},
+        }},
+        {"$unionWith": {"coll": "movimientos_diarios", "pipeline": [
+            {"$match": {"dia": {"$gte": inicio_ventas}, "vendidas": {"$gt": 0}}},
+            {"$project": {"_id": 0, "id": "$producto_id", "vendidas": 1}},
+        ]}},
+        {"$group": {
+            "_id": "$id",
+            "producto": {"$max": "$producto"},
+            "stock_actual": {"$max": "$stock_actual"},
+            "precio_venta": {"$max": "$precio_venta"},
+            "dias_para_vencer": {"$max": "$dias_para_vencer"},
+            "vendidas": {"$sum": "$vendidas"},
+        }},
+        # Ventas de productos ya eliminados no cuentan
+        {"$match": {"producto": True}},
+        # Los ids son uuid4: sus dos primeros caracteres reparten el catálogo en hasta 256 bloques.
+        # Cada columna sale con un único tipo BSON para poder leerla sin decodificar valor a valor
+        {"$group": {
+            "_id": {"$substrCP": ["$_id", 0, 2]},
+            "n": {"$sum": 1},
+            "id": {"$push": "$_id"},
+            **{
+                campo: {"$push": {"$convert": {"input": f"${campo}", "to": tipo, "onError": 0, "onNull": 0}}}
+                for campo, tipo, _, _ in ANALITICA_COLUMNAS
+            },
+        }},
+    ]
+
+def campos_bson(datos: bytes, inicio: int):
+    # Tipo y posición del valor de cada campo de primer nivel de un documento BSON
+    fin = inicio + int.from_bytes(datos[inicio:inicio + 4], "little")
+    pos = inicio + 4
+    campos = {}
+    while pos < fin - 1:
+        tipo = datos[pos]
+        cierre = datos.index(0, pos + 1)
+        nombre = datos[pos + 1:cierre].decode()
+        pos = cierre + 1
+        campos[nombre] = (tipo, pos)
+        if tipo == 0x02:
+            pos += 4 + int.from_bytes(datos[pos:pos + 4], "little")
+        elif tipo in (0x03, 0x04):
+            pos += int.from_bytes(datos[pos:pos + 4], "little")
+        elif tipo == 0x10:
+            pos += 4
+        elif tipo in (0x01, 0x09, 0x12):
+            pos += 8
+        else:
+            raise ValueError(f"Tipo BSON {tipo:#x} inesperado en {nombre}")
+    return campos, fin
+
+def columna_bson(datos: bytes, pos: int, n: int, tipo: int, dtype: str):
+    # Cada elemento de un array BSON es tipo (1 byte), clave "0", "1"... con su 0 final y 8 bytes de valor.
+    # Las claves con el mismo número de dígitos dan un paso constante: cada tramo se copia desde una vista con stride
+    valores = np.empty(n, dtype=dtype)
+    inicio = pos + 4
+    desde = 0
+    digitos = 1
+    while desde < n:
+        hasta = min(n, 10 ** digitos)
+        paso = 10 + digitos
+        tipos = np.ndarray((hasta - desde,), np.uint8, datos, inicio, (paso,))
+        if not (tipos == tipo).all():
+            raise ValueError("Columna BSON con tipos mezclados")
+        valores[desde:hasta] = np.ndarray((hasta - desde,), dtype, datos, inicio + 2 + digitos, (paso,))
+        inicio += paso * (hasta - desde)
+        desde = hasta
+        digitos += 1
+    if inicio + 1 != pos + int.from_bytes(datos[pos:pos + 4], "little"):
+        raise ValueError("Columna BSON con longitud inesperada")
+    return valores
+
+class DatosAnalitica:
+    # Columnas numéricas de todos los bloques; los ids quedan sin decodificar hasta saber qué productos se listan
+    def __init__(self):
+        self.partes = {campo: [] for campo, _, _, _ in ANALITICA_COLUMNAS}
+        self.bloques = []
+        self.total = 0
+
+    def agregar_lote(self, lote: bytes):
+        inicio = 0
+        while inicio < len(lote):
+            campos, fin = campos_bson(lote, inicio)
+            n = int.from_bytes(lote[campos["n"][1]:campos["n"][1] + 4], "little")
+            for campo, _, tipo, dtype in ANALITICA_COLUMNAS:
+                self.partes[campo].append(columna_bson(lote, campos[campo][1], n, tipo, dtype))
+            self.bloques.append((self.total, lote, campos["id"][1]))
+            self.total += n
+            inicio = fin
+
+    def columnas(self):
+        return {
+            campo: np.concatenate(partes) if partes else np.empty(0, dtype=dtype)
+            for (campo, _, _, dtype), partes in zip(ANALITICA_COLUMNAS, self.partes.values())
+        }
+
+    def ids(self, indices):
+        # Solo se decodifica el array de ids de los bloques que contienen algún índice pedido
+        comienzos = [comienzo for comienzo, _, _ in self.bloques]
+        por_bloque = {}
+        for indice in indices:
+            por_bloque.setdefault(bisect.bisect_right(comienzos, indice) - 1, []).append(indice)
+        ids = {}
+        for numero, pedidos in por_bloque.items():
+            comienzo, lote, pos = self.bloques[numero]
+            array = bson.decode(lote[pos:pos + int.from_bytes(lote[pos:pos + 4], "little")])
+            for indice in pedidos:
+                ids[indice] = array[str(indice - comienzo)]
+        return ids
+
+def calcular_analitica(columnas: dict, horizonte_dias: int):
+    stock = columnas["stock_actual"]
+    precio = columnas["precio_venta"]
+    dias_vencer = columnas["dias_para_vencer"]
+    n = len(stock)
+    # El stock negativo (ajustes con permitir_negativo) no suma valor
+    unidades = np.clip(stock, 0, None)
+    valor = unidades * precio
+    valor_total = float(valor.sum())
+    
+    # ABC por valor acumulado: un producto es A mientras el valor anterior a él no supere el 80 %
+    orden = np.argsort(-valor)
+    previo = np.cumsum(valor[orden]) - valor[orden]
+    participacion = previo / valor_total if valor_total > 0 else np.ones(n)
+    clase = np.empty(n, dtype=np.int8)
+    clase[orden] = np.searchsorted(ABC_UMBRALES, participacion, side="right")
+    clase[valor <= 0] = 2
+    
+    # Ventas diarias medias del periodo
+    ventas = columnas["vendidas"] / ANALYTICS_SALES_DAYS
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cobertura = np.where(ventas > 0, unidades / ventas, np.nan)
+    
+    # Valor en riesgo: lo que no se venderá antes de vencer al ritmo actual, ponderado por cercanía al vencimiento
+    con_vencimiento = ~np.isnan(dias_vencer)
+    dias = np.nan_to_num(dias_vencer)
+    peso = np.where(con_vencimiento, np.clip(1 - dias / max(horizonte_dias, 1), 0, 1), 0)
+    sin_vender = np.clip(unidades - ventas * np.clip(dias, 0, None), 0, None)
+    riesgo = sin_vender * precio * peso
+    vencido = con_vencimiento & (dias < 0)
+    
+    valor_clase = np.bincount(clase, weights=valor, minlength=3)
+    productos_clase = np.bincount(clase, minlength=3)
+    
+    def items(indices):
+        # El id y el código se completan después, solo para los pocos productos que llegan a las listas
+        return [
+            {
+                "indice": int(i),
+                "stock_actual": int(stock[i]),
+                "valor": round(float(valor[i]), 2),
+                "clase": ABC_CLASES[clase[i]],
+                "valor_en_riesgo": round(float(riesgo[i]), 2),
+                "dias_para_vencer": None if np.isnan(dias_vencer[i]) else int(dias_vencer[i]),
+                "dias_cobertura": None if np.isnan(cobertura[i]) else round(float(cobertura[i]), 1),
+            }
+            for i in indices
+        ]
+    
+    def mayores(valores, limite):
+        candidatos = np.flatnonzero(valores > 0)
+        if len(candidatos) > limite:
+            candidatos = candidatos[np.argpartition(-valores[candidatos], limite - 1)[:limite]]
+        return candidatos[np.argsort(-valores[candidatos], kind="stable")]
+    
+    # Menor cobertura entre los productos que se venden y tienen stock
+    cubiertos = np.flatnonzero(~np.isnan(cobertura) & (unidades > 0))
+    if len(cubiertos) > ANALYTICS_TOP:
+        cubiertos = cubiertos[np.argpartition(cobertura[cubiertos], ANALYTICS_TOP - 1)[:ANALYTICS_TOP]]
+    cubiertos = cubiertos[np.argsort(cobertura[cubiertos], kind="stable")]
+    
+    return {
+        "generado_en": datetime.now(timezone.utc),
+        "productos": n,
+        "unidades": int(unidades.sum()),
+        "valor_total": round(valor_total, 2),
+        "abc": [
+            {
+                "clase": nombre,
+                "productos": int(productos_clase[i]),
+                "valor": round(float(valor_clase[i]), 2),
+                "porcentaje_valor": round(float(valor_clase[i]) / valor_total * 100, 2) if valor_total > 0 else 0.0,
+            }
+            for i, nombre in enumerate(ABC_CLASES)
+        ],
+        "valor_en_riesgo": round(float(riesgo.sum()), 2),
+        "valor_vencido": round(float(valor[vencido].sum()), 2),
+        "productos_en_riesgo": int(np.count_nonzero(riesgo > 0)),
+        "dias_ventas": ANALYTICS_SALES_DAYS,
+        "con_ventas": bool(np.any(ventas > 0)),
+        "productos_sin_ventas": int(np.count_nonzero(ventas == 0)),
+        "productos_bajo_cobertura": int(np.count_nonzero(cobertura < ANALYTICS_MIN_COVER_DAYS)),
+        "mediana_dias_cobertura": round(float(np.nanmedian(cobertura)), 1) if np.any(~np.isnan(cobertura)) else None,
+        "top_valor": items(mayores(valor, ANALYTICS_TOP)),
+        "top_riesgo": items(mayores(riesgo, ANALYTICS_TOP)),
+        "menor_cobertura": items(cubiertos),
+    }
+
+async def leer_datos_analitica(hoy: date):
+    inicio_ventas = fecha_bson(datetime.now(timezone.utc).date() - timedelta(days=ANALYTICS_SALES_DAYS - 1))
+    datos = DatosAnalitica()
+    async for lote in db.productos.aggregate_raw_batches(analitica_pipeline(hoy, inicio_ventas), allowDiskUse=True):
+        datos.agregar_lote(lote)
+    return datos
+
+async def completar_codigos(analitica: dict, datos: DatosAnalitica):
+    listas = (analitica["top_valor"], analitica["top_riesgo"], analitica["menor_cobertura"])
+    ids_por_indice = datos.ids({item["indice"] for lista in listas for item in lista})
+    for lista in listas:
+        for item in lista:
+            item["id"] = ids_por_indice[item.pop("indice")]
+    ids = list(set(ids_por_indice.values()))
+    docs = await db.productos.find({"id": {"$in": ids}}, {"_id": 0, "id": 1, "codigo": 1}).to_list(length=None)
+    codigos = {doc["id"]: doc["codigo"] for doc in docs}
+    for lista in listas:
+        for item in lista:
+            item["codigo"] = codigos.get(item["id"], "")
+    return AnaliticaInventario(**analitica)
+
+@api_router.get("/analytics/inventario", response_model=AnaliticaInventario)
+async def analitica_inventario(current_user: Usuario = Depends(get_current_user)):
+    global analitica_cache
+    if np is None:
+        raise HTTPException(status_code=503, detail="Analítica no disponible: falta numpy")
+    # Se recalcula tras cualquier escritura de productos (todas suben la versión), al cambiar la configuración o el día
+    versiones, config = await asyncio.gather(version_cache.get(), cargar_configuracion())
+    hoy = datetime.now().date()
+    clave = (versiones.get("productos", 0), config.get("version", 0), hoy)
+    if analitica_cache[0] != clave:
+        async with analitica_lock:
+            # Las peticiones que esperaban el cálculo en curso reutilizan su resultado
+            if analitica_cache[0] != clave:
+                datos = await leer_datos_analitica(hoy)
+                horizonte = (date.fromisoformat(fecha_limite_alertas(config["vencimiento_alerta_meses"])) - hoy).days
+                fases = fases_actuales.get()
+                inicio = time.perf_counter()
+                analitica = await asyncio.to_thread(calcular_analitica, datos.columnas(), horizonte)
+                if fases is not None:
+                    fases.add("analitica", time.perf_counter() - inicio)
+                analitica = await completar_codigos(analitica, datos)
+                analitica_cache = (clave, json_bytes(analitica.model_dump(mode="json")))
+    return Response(content=analitica_cache[1], media_type="application/json")
+
 # CONTACTOS ENDPOINTS
 @api_router.post("/contactos", response_model=Contacto)
 async def crear_contacto(contacto: ContactoCreate, current_user: Usuario = Depends(get_current_user)):
     contacto_obj = Contacto(**contacto.dict())
-    await db.contactos.insert_one(contacto_obj.dict())
+    mongo_dict = contacto_obj.dict()
+    mongo_dict["_busqueda"] = tokens_busqueda(mongo_dict, SEARCH_FIELDS["contactos"])
+    await db.contactos.insert_one(mongo_dict)
+    await version_cache.bump("contactos")
     return contacto_obj
 
-@api_router.get("/contactos", response_model=List[Contacto])
-async def obtener_contactos(current_user: Usuario = Depends(get_current_user)):
-    contactos = await db.contactos.find().to_list(length=None)
+@api_router.get("/contactos", response_model=Union[List[Contacto], ContactoPagina])
+async def obtener_contactos(limit: Optional[int] = Query(None, ge=1, le=3000), cursor: Optional[str] = None, current_user: Usuario = Depends(get_current_user), etag_headers: dict = Depends(etag_dependency("contactos"))):
+    # Con cursor (vacío para la primera página) se pagina por (nombre, id) y se devuelve next_cursor
+    if cursor is not None:
+        contactos, next_cursor = await paginar_keyset(
+            db.contactos, ["nombre", "id"], cursor, limit or 1000, CONTACTO_JSON.projection if FAST_JSON else None
+        )
+        if FAST_JSON:
+            items, orjson_compatible = CONTACTO_JSON.rows(contactos)
+            return json_response({"items": items, "next_cursor": next_cursor}, orjson_compatible, etag_headers)
+        return ContactoPagina(
+            items=[Contacto(**contacto) for contacto in contactos],
+            next_cursor=next_cursor
+        )
+    # Sin cursor la lista sigue completa salvo que se pida un limit
+    if FAST_JSON:
+        contactos = await db.contactos.find({}, CONTACTO_JSON.projection).limit(limit or 0).to_list(length=None)
+        return json_response(*CONTACTO_JSON.rows(contactos), etag_headers)
+    contactos = await db.contactos.find().limit(limit or 0).to_list(length=None)
     return [Contacto(**contacto) for contacto in contactos]
 
+@api_router.get("/contactos/search", response_model=ContactoBusqueda)
+async def buscar_contactos(q: str = Query(..., min_length=1), skip: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=200), current_user: Usuario = Depends(get_current_user)):
+    contactos, total, truncado = await buscar_documentos(db.contactos, ["nombre"], q, skip, limit)
+    return ContactoBusqueda(items=[Contacto(**c) for c in contactos], total=total, truncado=truncado)
+
 @api_router.put("/contactos/{contacto_id}", response_model=Contacto)
 async def actualizar_contacto(contacto_id: str, contacto_update: ContactoUpdate, current_user: Usuario = Depends(get_current_user)):
     update_dict = {k: v for k, v in contacto_update.dict().items() if v is not None}
     if not update_dict:
         raise HTTPException(status_code=400, detail="No hay datos para actualizar")
     
+    update_dict["updated_at"] = datetime.now(timezone.utc)
+    
     result = await db.contactos.update_one(
         {"id": contacto_id}, 
         {"$set": update_dict}
@@ -365,8 +2395,14 @@ async def actualizar_contacto(contacto_id: str, contacto_update: ContactoUpdate,
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Contacto no encontrado")
+    await version_cache.bump("contactos")
     
     contacto_actualizado = await db.contactos.find_one({"id": contacto_id})
+    if "nombre" in update_dict or "correo" in update_dict:
+        await db.contactos.update_one(
+            {"id": contacto_id},
+            {"$set": {"_busqueda": tokens_busqueda(contacto_actualizado, SEARCH_FIELDS["contactos"])}}
+        )
     return Contacto(**contacto_actualizado)
 
 @api_router.delete("/contactos/{contacto_id}")
@@ -374,18 +2410,56 @@ async def eliminar_contacto(contacto_id: str, current_user: Usuario = Depends(ge
     result = await db.contactos.delete_one({"id": contacto_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Contacto no encontrado")
+    await registrar_eliminacion("contactos", contacto_id)
+    await version_cache.bump("contactos")
     return {"message": "Contacto eliminado exitosamente"}
 
 # CONFIGURACIÓN ENDPOINTS
+CONFIG_REFRESH_SECONDS = float(os.environ.get("CONFIG_REFRESH_SECONDS", "5"))
+
+class ConfigCache:
+    # Copia local de la configuración; cada worker la revalida por versión como máximo cada refresh_seconds
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self.config = None
+        self.checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def store(self, config: dict):
+        self.config = config
+        self.checked_at = time.monotonic()
+
+    async def load(self):
+        config = await db.configuracion.find_one({}, {"_id": 0})
+        if not config:
+            # Crear configuración por defecto
+            config = {**Configuracion().dict(), "version": 0}
+            await db.configuracion.insert_one(dict(config))
+        self.store(config)
+        return config
+
+    async def get(self, force: bool = False):
+        if self.config is None:
+            self.misses += 1
+            return await self.load()
+        if force or time.monotonic() - self.checked_at >= self.refresh_seconds:
+            actual = await db.configuracion.find_one({"id": self.config["id"]}, {"_id": 0, "version": 1})
+            if not actual or actual.get("version", 0) != self.config.get("version", 0):
+                self.misses += 1
+                return await self.load()
+            self.checked_at = time.monotonic()
+        self.hits += 1
+        return self.config
+
+config_cache = ConfigCache(CONFIG_REFRESH_SECONDS)
+
+async def cargar_configuracion(force: bool = False):
+    return await config_cache.get(force)
+
 @api_router.get("/configuracion", response_model=Configuracion)
-async def obtener_configuracion(current_user: Usuario = Depends(get_current_user)):
-    config = await db.configuracion.find_one()
-    if not config:
-        # Crear configuración por defecto
-        config_obj = Configuracion()
-        await db.configuracion.insert_one(config_obj.dict())
-        return config_obj
-    return Configuracion(**config)
+async def obtener_configuracion(current_user: Usuario = Depends(get_current_user), etag_headers: dict = Depends(etag_dependency("configuracion"))):
+    return Configuracion(**await cargar_configuracion())
 
 @api_router.put("/configuracion", response_model=Configuracion)
 async def actualizar_configuracion(config_update: ConfiguracionUpdate, current_user: Usuario = Depends(get_current_user)):
@@ -395,81 +2469,494 @@ async def actualizar_configuracion(config_update: ConfiguracionUpdate, current_u
     
     update_dict["updated_at"] = datetime.now(timezone.utc)
     
-    # Buscar configuración existente
-    config_existente = await db.configuracion.find_one()
-    if config_existente:
-        await db.configuracion.update_one(
-            {"id": config_existente["id"]}, 
-            {"$set": update_dict}
-        )
-        config_actualizada = await db.configuracion.find_one({"id": config_existente["id"]})
-    else:
+    # Escritura directa sobre la configuración cacheada; la versión avisa al resto de workers
+    config_existente = await cargar_configuracion()
+    config_actualizada = await db.configuracion.find_one_and_update(
+        {"id": config_existente["id"]},
+        {"$set": update_dict, "$inc": {"version": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not config_actualizada:
         # Crear nueva configuración
-        config_obj = Configuracion(**update_dict)
-        await db.configuracion.insert_one(config_obj.dict())
-        config_actualizada = config_obj.dict()
+        config_actualizada = {**Configuracion(**update_dict).dict(), "version": 0}
+        await db.configuracion.insert_one(dict(config_actualizada))
+    config_cache.store(config_actualizada)
     
+    # Los umbrales cambiaron: reconstruir la tabla de alertas completa
+    await reconstruir_alertas(config_actualizada)
+    await version_cache.bump("configuracion", "alertas")
     return Configuracion(**config_actualizada)
 
 # ALERTAS Y RECORDATORIOS ENDPOINT
-@api_router.get("/alertas", response_model=List[AlertaProducto])
-async def obtener_alertas(current_user: Usuario = Depends(get_current_user)):
-    # Obtener configuración
-    config = await db.configuracion.find_one()
-    if not config:
-        config = Configuracion().dict()
+def fecha_limite_alertas(meses_vencimiento: int):
+    return (datetime.now().date() + relativedelta(months=meses_vencimiento)).isoformat()
+
+def alertas_pipeline(stock_limite: int, meses_vencimiento: int, filtro: Optional[dict] = None):
+    hoy = datetime.now().date()
+    fecha_limite = fecha_limite_alertas(meses_vencimiento)
+    stock = {"$ifNull": ["$stock_actual", 0]}
+    por_vencer = {"$or": [
+        {"$and": [
+            {"$eq": [{"$type": "$fecha_vencimiento"}, "string"]},
+            {"$gt": ["$fecha_vencimiento", ""]},
+            {"$lte": ["$fecha_vencimiento", fecha_limite]},
+        ]},
+        {"$and": [
+            {"$eq": [{"$type": "$fecha_vencimiento"}, "date"]},
+            {"$lte": ["$fecha_vencimiento", fecha_bson(date.fromisoformat(fecha_limite))]},
+        ]},
+    ]}
+
+    def alerta(tipo_alerta, dias_para_vencer=None):
+        return {
+            "id": "$id",
+            "codigo": "$codigo",
+            "descripcion": "$descripcion",
+            "tipo_alerta": {"$literal": tipo_alerta},
+            "stock_actual": stock,
+            "fecha_vencimiento": {"$ifNull": ["$fecha_vencimiento", None]},
+            "dias_para_vencer": dias_para_vencer,
+        }
+
+    dias_para_vencer = {"$toInt": {"$divide": [
+        {"$subtract": [{"$toDate": "$fecha_vencimiento"}, datetime.combine(hoy, datetime.min.time())]},
+        24 * 60 * 60 * 1000,
+    ]}}
+
+    # Solo los productos con alguna alerta salen de la base de datos
+    match = {"$or": [
+        {"stock_actual": 0},
+        {"stock_actual": None},
+        {"stock_actual": {"$lt": stock_limite}},
+        *rango_vencimiento(None, fecha_limite),
+    ]}
+    if filtro:
+        match = {"$and": [filtro, match]}
+
+    return [
+        {"$match": match},
+        {"$project": {"alertas": {"$concatArrays": [
+            {"$cond": [
+                {"$eq": [stock, 0]},
+                [alerta("stock_cero")],
+                {"$cond": [{"$lt": [stock, stock_limite]}, [alerta("stock_bajo")], []]},
+            ]},
+            {"$cond": [por_vencer, [alerta("proximo_vencer", dias_para_vencer)], []]},
+        ]}}},
+        {"$unwind": {"path": "$alertas", "includeArrayIndex": "orden"}},
+        # producto_oid y orden conservan el orden del catálogo: por producto y luego por tipo de alerta
+        {"$replaceRoot": {"newRoot": {"$mergeObjects": [
+            "$alertas",
+            {"producto_oid": "$_id", "orden": "$orden"},
+        ]}}},
+    ]
+
+def config_pipeline(config: dict, filtro: Optional[dict] = None):
+    return alertas_pipeline(
+        config.get("stock_bajo_limite", 10),
+        config.get("vencimiento_alerta_meses", 2),
+        filtro,
+    )
+
+async def calcular_alertas(config: dict, filtro: Optional[dict] = None):
+    pipeline = config_pipeline(config, filtro) + [{"$sort": {"producto_oid": 1, "orden": 1}}]
+    return [AlertaProducto(**alerta) async for alerta in db.productos.aggregate(pipeline, allowDiskUse=True)]
+
+# Tabla materializada de alertas, mantenida por las escrituras de productos y configuración
+async def guardar_estado_alertas(config: dict):
+    await db.alertas_estado.update_one(
+        {"_id": "alertas"},
+        {"$set": {
+            "stock_bajo_limite": config.get("stock_bajo_limite", 10),
+            "vencimiento_alerta_meses": config.get("vencimiento_alerta_meses", 2),
+            "fecha_limite": fecha_limite_alertas(config.get("vencimiento_alerta_meses", 2)),
+        }},
+        upsert=True
+    )
+
+async def materializar_alertas(config: dict, filtro: dict, refresco: Optional[str] = None):
+    # refresco marca las filas escritas por esta pasada: las del filtro sin la marca ya no aplican
+    etapas = [{"$set": {"refresco": refresco}}] if refresco else []
+    pipeline = config_pipeline(config, filtro) + etapas + [{"$merge": {
+        "into": "alertas_materializadas",
+        "on": ["id", "tipo_alerta"],
+        "whenMatched": "replace",
+        "whenNotMatched": "insert",
+    }}]
+    await db.productos.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+
+async def reconstruir_alertas(config: dict):
+    # $out reemplaza la colección de forma atómica y conserva sus índices
+    pipeline = config_pipeline(config) + [{"$out": "alertas_materializadas"}]
+    await db.productos.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+    await guardar_estado_alertas(config)
+    await publicar_evento("alertas_reconstruidas", {})
+
+ALERTAS_REFRESCO_INTENTOS = 3
+
+async def versiones_productos(filtro: dict):
+    return {p["id"]: p.get("updated_at") async for p in db.productos.find(filtro, {"_id": 0, "id": 1, "updated_at": 1})}
+
+async def refrescar_alertas(filtro: dict, eliminado: bool = False):
+    # El filtro usa campos (id, codigo) presentes tanto en productos como en las alertas
+    antes = {
+        (a["id"], a["tipo_alerta"])
+        async for a in db.alertas_materializadas.find(filtro, {"_id": 0, "id": 1, "tipo_alerta": 1})
+    }
+    despues = []
+    if eliminado:
+        await db.alertas_materializadas.delete_many(filtro)
+    else:
+        # Primero se fusionan las alertas vigentes y después se borran las que ya no aplican: /alertas nunca lee
+        # el producto sin sus alertas. Si otra escritura cambió los productos durante la pasada, esta pudo fusionar
+        # el estado anterior después que aquella: se repite con el estado actual
+        config = await cargar_configuracion()
+        for _ in range(ALERTAS_REFRESCO_INTENTOS):
+            versiones = await versiones_productos(filtro)
+            refresco = uuid.uuid4().hex
+            await materializar_alertas(config, filtro, refresco)
+            await db.alertas_materializadas.delete_many({**filtro, "refresco": {"$ne": refresco}})
+            if await versiones_productos(filtro) == versiones:
+                break
+        despues = await db.alertas_materializadas.find(filtro, ALERTA_JSON.projection).to_list(length=None)
     
-    stock_limite = config.get("stock_bajo_limite", 10)
-    meses_vencimiento = config.get("vencimiento_alerta_meses", 2)
+    # Un solo evento por escritura con las alertas que entran y salen: un lote grande no desborda
+    # la cola de cada suscriptor de /events
+    claves = {(alerta["id"], alerta["tipo_alerta"]) for alerta in despues}
+    nuevas = ALERTA_JSON.rows([alerta for alerta in despues if (alerta["id"], alerta["tipo_alerta"]) not in antes])[0]
+    resueltas = [{"id": alerta_id, "tipo_alerta": tipo_alerta} for alerta_id, tipo_alerta in antes - claves]
+    if nuevas or resueltas:
+        await publicar_evento("alertas_cambiadas", {"nuevas": nuevas, "resueltas": resueltas})
+    return nuevas
+
+def estado_coincide(estado: Optional[dict], config: dict):
+    return bool(estado) and (
+        estado.get("stock_bajo_limite") == config.get("stock_bajo_limite", 10)
+        and estado.get("vencimiento_alerta_meses") == config.get("vencimiento_alerta_meses", 2)
+    )
+
+async def sincronizar_alertas():
+    config = await cargar_configuracion()
+    estado = await db.alertas_estado.find_one({"_id": "alertas"})
+    if not estado_coincide(estado, config):
+        # Otro worker pudo haber cambiado los umbrales: revalidar la caché antes de reconstruir
+        config = await cargar_configuracion(force=True)
+        if not estado_coincide(estado, config):
+            await reconstruir_alertas(config)
+            return
     
-    # Obtener todos los productos
-    productos = await db.productos.find().to_list(length=None)
+    # Con el paso de los días entran nuevos productos en la ventana de vencimiento
+    fecha_limite = fecha_limite_alertas(config.get("vencimiento_alerta_meses", 2))
+    if estado["fecha_limite"] < fecha_limite:
+        await materializar_alertas(config, {"$or": rango_vencimiento(estado["fecha_limite"], fecha_limite)})
+        await db.alertas_estado.update_one({"_id": "alertas"}, {"$set": {"fecha_limite": fecha_limite}})
+        await publicar_evento("alertas_reconstruidas", {})
+
+async def leer_documentos_alertas():
+    hoy = datetime.now().date()
     alertas = []
+    cursor = db.alertas_materializadas.find({}, ALERTA_JSON.projection).sort([("producto_oid", 1), ("orden", 1)])
+    async for alerta in cursor:
+        if alerta["tipo_alerta"] == "proximo_vencer":
+            alerta["dias_para_vencer"] = (como_fecha(alerta["fecha_vencimiento"]) - hoy).days
+        alertas.append(alerta)
+    return alertas
+
+async def leer_alertas_materializadas():
+    return [AlertaProducto(**alerta) for alerta in await leer_documentos_alertas()]
+
+@api_router.get("/alertas", response_model=List[AlertaProducto])
+async def obtener_alertas(current_user: Usuario = Depends(get_current_user), etag_headers: dict = Depends(etag_dependency("alertas"))):
+    await sincronizar_alertas()
+    if FAST_JSON:
+        return json_response(*ALERTA_JSON.rows(await leer_documentos_alertas()), etag_headers)
+    return await leer_alertas_materializadas()
+
+@api_router.get("/admin/alertas/verificar", response_model=dict)
+async def verificar_alertas(current_user: Usuario = Depends(get_current_maestro)):
+    config = await cargar_configuracion()
+    esperadas = {(a.id, a.tipo_alerta): a for a in await calcular_alertas(config)}
+    materializadas = {(a.id, a.tipo_alerta): a for a in await leer_alertas_materializadas()}
+    faltantes = [list(k) for k in esperadas if k not in materializadas]
+    sobrantes = [list(k) for k in materializadas if k not in esperadas]
+    desactualizadas = [
+        list(k) for k, alerta in esperadas.items()
+        if k in materializadas and materializadas[k] != alerta
+    ]
+    return {
+        "consistente": not (faltantes or sobrantes or desactualizadas),
+        "total_esperadas": len(esperadas),
+        "total_materializadas": len(materializadas),
+        "faltantes": faltantes[:100],
+        "sobrantes": sobrantes[:100],
+        "desactualizadas": desactualizadas[:100],
+    }
+
+@api_router.post("/admin/alertas/reconstruir", response_model=dict)
+async def reconstruir_alertas_admin(current_user: Usuario = Depends(get_current_maestro)):
+    config = await cargar_configuracion()
+    await reconstruir_alertas(config)
+    await version_cache.bump("alertas")
+    total = await db.alertas_materializadas.count_documents({})
+    return {"message": "Alertas reconstruidas exitosamente", "total": total}
+
+# BOOTSTRAP ENDPOINT
+async def leer_alertas_bootstrap():
+    await sincronizar_alertas()
+    return await leer_documentos_alertas()
+
+@api_router.get("/bootstrap", response_model=Bootstrap)
+async def bootstrap(limit: int = Query(1000, ge=1, le=3000), current_user: Usuario = Depends(get_current_user), etag_headers: dict = Depends(etag_dependency("productos", "contactos", "alertas", "configuracion"))):
+    # Una sola autenticación y las cuatro lecturas del panel en paralelo
+    productos, contactos, alertas, config = await asyncio.gather(
+        db.productos.find({}, PRODUCTO_JSON.projection).limit(limit).to_list(length=None),
+        db.contactos.find({}, CONTACTO_JSON.projection).to_list(length=None),
+        leer_alertas_bootstrap(),
+        cargar_configuracion(),
+    )
+    if not FAST_JSON:
+        return Bootstrap(
+            productos=[Producto(**p) for p in productos],
+            contactos=[Contacto(**c) for c in contactos],
+            alertas=[AlertaProducto(**a) for a in alertas],
+            configuracion=Configuracion(**config),
+        )
+    
+    productos, productos_compatibles = PRODUCTO_JSON.rows(productos)
+    contactos, contactos_compatibles = CONTACTO_JSON.rows(contactos)
+    alertas, _ = ALERTA_JSON.rows(alertas)
+    return json_response(
+        {
+            "productos": productos,
+            "contactos": contactos,
+            "alertas": alertas,
+            "configuracion": Configuracion(**config).model_dump(mode="json"),
+        },
+        productos_compatibles and contactos_compatibles,
+        etag_headers
+    )
+
+# SYNC ENDPOINT
+SYNC_OVERLAP_SECONDS = float(os.environ.get("SYNC_OVERLAP_SECONDS", "2"))
+
+async def registrar_eliminacion(coleccion: str, doc_id: str):
+    await db.eliminados.insert_one({"coleccion": coleccion, "id": doc_id, "deleted_at": datetime.now(timezone.utc)})
+
+async def leer_eliminados(desde: datetime):
+    eliminados = {"productos": [], "contactos": []}
+    async for doc in db.eliminados.find({"deleted_at": {"$gt": desde}}, {"_id": 0, "coleccion": 1, "id": 1}):
+        eliminados.setdefault(doc["coleccion"], []).append(doc["id"])
+    return eliminados
+
+async def sin_eliminados():
+    return {"productos": [], "contactos": []}
+
+@api_router.get("/sync", response_model=Sincronizacion)
+async def sincronizar(since: Optional[str] = None, current_user: Usuario = Depends(get_current_user)):
+    inicio = datetime.now(timezone.utc)
+    desde = None
+    if since:
+        try:
+            desde = datetime.fromisoformat(decode_cursor(since, ["since"])[0])
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Token de sincronización inválido")
+        if desde.tzinfo is None:
+            desde = desde.replace(tzinfo=timezone.utc)
+        if desde < inicio - timedelta(days=SYNC_TOMBSTONE_DAYS):
+            raise HTTPException(status_code=410, detail="Token de sincronización expirado, se requiere una carga completa")
     
-    fecha_limite = datetime.now().date() + relativedelta(months=meses_vencimiento)
+    filtro = {"updated_at": {"$gt": desde}} if desde else {}
+    productos, contactos, eliminados = await asyncio.gather(
+        db.productos.find(filtro, PRODUCTO_JSON.projection).to_list(length=None),
+        db.contactos.find(filtro, CONTACTO_JSON.projection).to_list(length=None),
+        leer_eliminados(desde) if desde else sin_eliminados(),
+    )
+    # El margen vuelve a incluir escrituras que seguían en curso al consultar; el cliente aplica los cambios de forma idempotente
+    token = encode_cursor([(inicio - timedelta(seconds=SYNC_OVERLAP_SECONDS)).isoformat()])
     
-    for producto in productos:
-        producto = parse_from_mongo(producto)
-        
-        # Alerta de stock cero
-        if producto.get("stock_actual", 0) == 0:
-            alertas.append(AlertaProducto(
-                id=producto["id"],
-                codigo=producto["codigo"],
-                descripcion=producto["descripcion"],
-                tipo_alerta="stock_cero",
-                stock_actual=producto.get("stock_actual", 0),
-                fecha_vencimiento=producto.get("fecha_vencimiento"),
-                dias_para_vencer=None
-            ))
-        
-        # Alerta de stock bajo
-        elif producto.get("stock_actual", 0) < stock_limite:
-            alertas.append(AlertaProducto(
-                id=producto["id"],
-                codigo=producto["codigo"],
-                descripcion=producto["descripcion"],
-                tipo_alerta="stock_bajo",
-                stock_actual=producto.get("stock_actual", 0),
-                fecha_vencimiento=producto.get("fecha_vencimiento"),
-                dias_para_vencer=None
-            ))
-        
-        # Alerta de próximo a vencer
-        if producto.get("fecha_vencimiento"):
-            if producto["fecha_vencimiento"] <= fecha_limite:
-                dias_para_vencer = (producto["fecha_vencimiento"] - datetime.now().date()).days
-                alertas.append(AlertaProducto(
-                    id=producto["id"],
-                    codigo=producto["codigo"],
-                    descripcion=producto["descripcion"],
-                    tipo_alerta="proximo_vencer",
-                    stock_actual=producto.get("stock_actual", 0),
-                    fecha_vencimiento=producto["fecha_vencimiento"],
-                    dias_para_vencer=dias_para_vencer
-                ))
+    if not FAST_JSON:
+        return Sincronizacion(
+            productos=[Producto(**p) for p in productos],
+            contactos=[Contacto(**c) for c in contactos],
+            eliminados=EliminadosSync(**eliminados),
+            token=token,
+            completo=desde is None,
+        )
     
-    return alertas
+    productos, productos_compatibles = PRODUCTO_JSON.rows(productos)
+    contactos, contactos_compatibles = CONTACTO_JSON.rows(contactos)
+    return json_response(
+        {
+            "productos": productos,
+            "contactos": contactos,
+            "eliminados": EliminadosSync(**eliminados).model_dump(mode="json"),
+            "token": token,
+            "completo": desde is None,
+        },
+        productos_compatibles and contactos_compatibles
+    )
+
+# EVENTOS (SERVER-SENT EVENTS)
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", "100"))
+EVENTS_HISTORY_SIZE = int(os.environ.get("EVENTS_HISTORY_SIZE", "1000"))
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get("EVENTS_HEARTBEAT_SECONDS", "15"))
+# Con change streams (replica set) los eventos pasan por la colección eventos y llegan a todos los workers
+EVENTS_CHANGE_STREAMS = os.environ.get("EVENTS_CHANGE_STREAMS", "0") == "1"
+
+class Suscriptor:
+    def __init__(self, queue_size: int):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflow = False
+
+class EventBus:
+    def __init__(self, queue_size: int, history_size: int):
+        self.queue_size = queue_size
+        self.worker = uuid.uuid4().hex[:8]
+        self.sequence = 0
+        self.history = deque(maxlen=history_size)
+        self.suscriptores = set()
+        self.descartados = 0
+
+    def next_id(self):
+        self.sequence += 1
+        return f"{self.worker}-{self.sequence}"
+
+    def publish(self, event_id: str, tipo: str, datos: str):
+        evento = (event_id, tipo, datos)
+        self.history.append(evento)
+        for suscriptor in list(self.suscriptores):
+            try:
+                suscriptor.queue.put_nowait(evento)
+            except asyncio.QueueFull:
+                # Consumidor lento: se desconecta y al reconectar retoma desde su Last-Event-ID
+                suscriptor.overflow = True
+                self.suscriptores.discard(suscriptor)
+                self.descartados += 1
+
+    def subscribe(self):
+        suscriptor = Suscriptor(self.queue_size)
+        self.suscriptores.add(suscriptor)
+        return suscriptor
+
+    def unsubscribe(self, suscriptor: Suscriptor):
+        self.suscriptores.discard(suscriptor)
+
+    def replay(self, last_event_id: str):
+        eventos = list(self.history)
+        for i, (event_id, _, _) in enumerate(eventos):
+            if event_id == last_event_id:
+                return eventos[i + 1:]
+        return None
+
+    def stats(self):
+        return {
+            "suscriptores": len(self.suscriptores),
+            "descartados": self.descartados,
+            "historial": len(self.history),
+        }
+
+event_bus = EventBus(EVENTS_QUEUE_SIZE, EVENTS_HISTORY_SIZE)
+
+async def publicar_evento(tipo: str, datos: dict):
+    datos_json = json_bytes(datos).decode("utf-8")
+    if EVENTS_CHANGE_STREAMS:
+        await db.eventos.insert_one({"tipo": tipo, "datos": datos_json, "created_at": datetime.now(timezone.utc)})
+    else:
+        event_bus.publish(event_bus.next_id(), tipo, datos_json)
+
+async def escuchar_eventos():
+    while True:
+        try:
+            async with db.eventos.watch([{"$match": {"operationType": "insert"}}]) as stream:
+                async for cambio in stream:
+                    doc = cambio["fullDocument"]
+                    event_bus.publish(str(doc["_id"]), doc["tipo"], doc["datos"])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Change stream de eventos interrumpido, reintentando")
+            await asyncio.sleep(5)
+
+async def eventos_perdidos(last_event_id: Optional[str]):
+    if not last_event_id:
+        return []
+    eventos = event_bus.replay(last_event_id)
+    if eventos is None and EVENTS_CHANGE_STREAMS and ObjectId.is_valid(last_event_id):
+        docs = await db.eventos.find({"_id": {"$gt": ObjectId(last_event_id)}}).sort("_id", 1).to_list(length=None)
+        eventos = [(str(doc["_id"]), doc["tipo"], doc["datos"]) for doc in docs]
+    return eventos
+
+def formatear_evento(event_id: Optional[str], tipo: str, datos: str):
+    cabecera = f"id: {event_id}\n" if event_id else ""
+    return f"{cabecera}event: {tipo}\ndata: {datos}\n\n"
+
+@api_router.get("/events")
+async def eventos(request: Request, last_event_id: Optional[str] = Query(None), current_user: Usuario = Depends(get_current_user_stream)):
+    ultimo = request.headers.get("last-event-id") or last_event_id
+    suscriptor = event_bus.subscribe()
+    
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            perdidos = await eventos_perdidos(ultimo)
+            if perdidos is None:
+                # El historial ya no cubre la desconexión: el cliente debe recargar
+                yield formatear_evento(None, "reset", "{}")
+                perdidos = []
+            enviados = set()
+            for evento in perdidos:
+                enviados.add(evento[0])
+                yield formatear_evento(*evento)
+            while not suscriptor.overflow:
+                try:
+                    evento = await asyncio.wait_for(suscriptor.queue.get(), EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if evento[0] not in enviados:
+                    yield formatear_evento(*evento)
+        finally:
+            event_bus.unsubscribe(suscriptor)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# MÉTRICAS
+def metricas_cache():
+    cachés = {"usuarios": user_cache, "codigos": codigo_cache, "configuracion": config_cache, "versiones": version_cache}
+    lineas = [
+        "# HELP cache_hits_total Aciertos por caché en proceso",
+        "# TYPE cache_hits_total counter",
+    ]
+    lineas += [f'cache_hits_total{{cache="{nombre}"}} {cache.hits}' for nombre, cache in cachés.items()]
+    lineas += [
+        "# HELP cache_misses_total Fallos por caché en proceso",
+        "# TYPE cache_misses_total counter",
+    ]
+    lineas += [f'cache_misses_total{{cache="{nombre}"}} {cache.misses}' for nombre, cache in cachés.items()]
+    lineas += [
+        "# HELP sse_subscribers Suscriptores conectados a /api/events",
+        "# TYPE sse_subscribers gauge",
+        f"sse_subscribers {len(event_bus.suscriptores)}",
+        "# HELP sse_dropped_subscribers_total Suscriptores desconectados por cola llena",
+        "# TYPE sse_dropped_subscribers_total counter",
+        f"sse_dropped_subscribers_total {event_bus.descartados}",
+    ]
+    return lineas
+
+@app.get("/metrics", include_in_schema=False)
+async def metricas(request: Request):
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    lineas = []
+    for metrica in METRICS:
+        lineas += metrica.render()
+    lineas += metricas_cache()
+    return PlainTextResponse("\n".join(lineas) + "\n", media_type="text/plain; version=0.0.4")
 
 # Root endpoint
 @api_router.get("/")
@@ -494,6 +2981,49 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    report = await ensure_indexes()
+    for label in report["created"]:
+        logger.info(f"Índice creado: {label}")
+    for label in report["updated"]:
+        logger.info(f"Índice actualizado: {label}")
+    for label in report["existing"]:
+        logger.info(f"Índice existente: {label}")
+
+@app.on_event("startup")
+async def load_configuration():
+    await config_cache.load()
+
+@app.on_event("startup")
+async def backfill_contact_timestamps():
+    # Contactos anteriores a updated_at toman su fecha de creación
+    await db.contactos.update_many(
+        {"updated_at": {"$exists": False}},
+        [{"$set": {"updated_at": "$created_at"}}]
+    )
+
+@app.on_event("startup")
+async def start_slow_query_explain():
+    slow_queries.loop = asyncio.get_running_loop()
+
+@app.on_event("startup")
+async def start_event_listener():
+    if EVENTS_CHANGE_STREAMS:
+        asyncio.create_task(escuchar_eventos())
+
+@app.on_event("startup")
+async def backfill_search_tokens():
+    asyncio.create_task(indexar_busqueda_pendiente())
+
+@app.on_event("startup")
+async def migrate_dates():
+    if FECHAS_NATIVAS:
+        asyncio.create_task(migrar_fechas())
+    else:
+        # Con DATE_STORAGE=string se vuelven a escribir textos: la migración tendrá que repetirse
+        await db.migraciones.delete_one({"_id": "fechas_nativas"})
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
@@ -5,11 +5,14 @@ Tests all CRUD endpoints for productos, contactos, configuracion, and alertas
 """
 
 import requests
+import base64
 import json
 from datetime import datetime, date, timedelta
+from dateutil.relativedelta import relativedelta
 from typing import Dict, List, Any
 import os
 import sys
+import time
 
 # Get backend URL from frontend environment
 def get_backend_url():
@@ -25,6 +28,9 @@ def get_backend_url():
 BASE_URL = get_backend_url() + "/api"
 print(f"Testing backend at: {BASE_URL}")
 
+TEST_USERNAME = os.environ.get("TEST_USERNAME", "backend_tester")
+TEST_PASSWORD = os.environ.get("TEST_PASSWORD", "Tester123!")
+
 class InventoryAPITester:
     def __init__(self):
         self.base_url = BASE_URL
@@ -33,10 +39,14 @@ class InventoryAPITester:
             "productos": {"passed": 0, "failed": 0, "errors": []},
             "contactos": {"passed": 0, "failed": 0, "errors": []},
             "configuracion": {"passed": 0, "failed": 0, "errors": []},
-            "alertas": {"passed": 0, "failed": 0, "errors": []}
+            "alertas": {"passed": 0, "failed": 0, "errors": []},
+            "pedidos": {"passed": 0, "failed": 0, "errors": []},
+            "paginacion": {"passed": 0, "failed": 0, "errors": []}
         }
         self.created_productos = []
         self.created_contactos = []
+        # Prefijo por ejecución: los productos de prueba no chocan con datos de ejecuciones anteriores
+        self.prefijo = f"T{int(time.time()) % 100000:05d}"
 
     def log_result(self, category: str, test_name: str, success: bool, error_msg: str = ""):
         if success:
@@ -47,6 +57,37 @@ class InventoryAPITester:
             self.test_results[category]["errors"].append(f"{test_name}: {error_msg}")
             print(f"❌ {test_name}: {error_msg}")
 
+    def autenticar(self):
+        """Register the test user if needed and send its token on every request"""
+        print("\n=== Authenticating ===")
+        try:
+            self.session.post(f"{self.base_url}/register", json={
+                "username": TEST_USERNAME,
+                "password": TEST_PASSWORD,
+                "nombre_completo": "Backend Tester"
+            })
+            response = self.session.post(f"{self.base_url}/login", json={"username": TEST_USERNAME, "password": TEST_PASSWORD})
+            if response.status_code == 200:
+                self.session.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+                print(f"✅ Logged in as {TEST_USERNAME}")
+                return True
+            print(f"❌ Login: HTTP {response.status_code}: {response.text}")
+            return False
+        except Exception as e:
+            print(f"❌ Login: Connection error - {str(e)}")
+            return False
+
+    def crear_producto_prueba(self, sufijo: str, **campos):
+        datos = {"codigo": f"{self.prefijo}-{sufijo}", "descripcion": f"Producto de prueba {sufijo}", **campos}
+        response = self.session.post(f"{self.base_url}/productos", json=datos)
+        if response.status_code != 200:
+            raise AssertionError(f"CREATE {datos['codigo']}: HTTP {response.status_code}: {response.text}")
+        return response.json()
+
+    def eliminar_productos_prueba(self, productos):
+        for producto in productos:
+            self.session.delete(f"{self.base_url}/productos/{producto['id']}")
+
     def test_api_root(self):
         """Test the root API endpoint"""
         print("\n=== Testing API Root ===")
@@ -413,6 +454,237 @@ class InventoryAPITester:
         except Exception as e:
             self.log_result("alertas", "GET alertas endpoint", False, str(e))
 
+    @staticmethod
+    def alertas_por_fila(productos, stock_limite: int, meses_vencimiento: int):
+        """Reference: the original per-product loop of GET /alertas, applied to the API representation"""
+        hoy = datetime.now().date()
+        fecha_limite = hoy + relativedelta(months=meses_vencimiento)
+        alertas = []
+        for producto in productos:
+            stock = producto.get("stock_actual", 0)
+            base = {
+                "id": producto["id"],
+                "codigo": producto["codigo"],
+                "descripcion": producto["descripcion"],
+                "stock_actual": stock,
+                "fecha_vencimiento": producto.get("fecha_vencimiento"),
+                "dias_para_vencer": None,
+            }
+            if stock == 0:
+                alertas.append({**base, "tipo_alerta": "stock_cero"})
+            elif stock < stock_limite:
+                alertas.append({**base, "tipo_alerta": "stock_bajo"})
+            if producto.get("fecha_vencimiento"):
+                vencimiento = date.fromisoformat(producto["fecha_vencimiento"])
+                if vencimiento <= fecha_limite:
+                    alertas.append({**base, "tipo_alerta": "proximo_vencer", "dias_para_vencer": (vencimiento - hoy).days})
+        return alertas
+
+    def test_alertas_equivalencia(self):
+        """GET /alertas must match the original per-row loop, including a product with two alerts"""
+        print("\n=== Testing Alertas Equivalence With Per-Row Loop ===")
+        creados = []
+        try:
+            config = self.session.get(f"{self.base_url}/configuracion").json()
+            limite = config["stock_bajo_limite"]
+            meses = config["vencimiento_alerta_meses"]
+            hoy = datetime.now().date()
+            fecha_limite = hoy + relativedelta(months=meses)
+            casos = [
+                ("CERO", {"stock_actual": 0}),
+                ("BAJO", {"stock_actual": limite - 1}),
+                # Stock bajo y próximo a vencer a la vez: dos alertas, en este orden
+                ("BAJO-VENCE", {"stock_actual": limite - 1, "fecha_vencimiento": (hoy + timedelta(days=10)).isoformat()}),
+                ("CERO-VENCIDO", {"stock_actual": 0, "fecha_vencimiento": (hoy - timedelta(days=3)).isoformat()}),
+                ("VENCE", {"stock_actual": limite + 50, "fecha_vencimiento": (hoy + timedelta(days=5)).isoformat()}),
+                ("LIMITES", {"stock_actual": limite, "fecha_vencimiento": fecha_limite.isoformat()}),
+                ("FUERA", {"stock_actual": limite + 50, "fecha_vencimiento": (fecha_limite + timedelta(days=1)).isoformat()}),
+                ("SIN-ALERTA", {"stock_actual": limite + 50}),
+            ]
+            for sufijo, campos in casos:
+                creados.append(self.crear_producto_prueba(sufijo, precio_venta=1.0, **campos))
+
+            response = self.session.get(f"{self.base_url}/alertas")
+            if response.status_code != 200:
+                self.log_result("alertas", "Alertas equivalence", False, f"HTTP {response.status_code}")
+                return
+            codigos = {producto["codigo"] for producto in creados}
+            obtenidas = [alerta for alerta in response.json() if alerta["codigo"] in codigos]
+            esperadas = self.alertas_por_fila(creados, limite, meses)
+            if obtenidas == esperadas:
+                self.log_result("alertas", "Alertas identical to per-row loop", True)
+            else:
+                self.log_result("alertas", "Alertas identical to per-row loop", False, f"expected {esperadas}, got {obtenidas}")
+
+            doble = [alerta["tipo_alerta"] for alerta in obtenidas if alerta["codigo"].endswith("-BAJO-VENCE")]
+            self.log_result(
+                "alertas", "Low stock and near expiry gives both alerts",
+                doble == ["stock_bajo", "proximo_vencer"], f"got {doble}"
+            )
+        except Exception as e:
+            self.log_result("alertas", "Alertas equivalence", False, str(e))
+        finally:
+            self.eliminar_productos_prueba(creados)
+
+    def stock_de(self, *productos):
+        return [self.session.get(f"{self.base_url}/productos/{p['id']}").json()["stock_actual"] for p in productos]
+
+    def test_pedidos_todo_o_nada(self):
+        """POST /pedidos applies every line or none of them
+        The server picks the transaction or the compensation path (PEDIDOS_TRANSACCIONES);
+        run once against a standalone mongod and once against a replica set to cover both"""
+        print("\n=== Testing Pedidos All-Or-Nothing ===")
+        creados = []
+        try:
+            a = self.crear_producto_prueba("PED-A", stock_actual=10)
+            b = self.crear_producto_prueba("PED-B", stock_actual=2)
+            creados = [a, b]
+
+            # La primera línea cabe, la segunda no: no se descuenta ninguna
+            response = self.session.post(f"{self.base_url}/pedidos", json={"lineas": [
+                {"id": a["id"], "cantidad": 8},
+                {"codigo": b["codigo"], "cantidad": 5},
+            ]})
+            detalle = response.json().get("detail", "") if response.status_code == 409 else ""
+            self.log_result(
+                "pedidos", "Short line rejects the whole order",
+                response.status_code == 409 and b["codigo"] in detalle and a["codigo"] not in detalle,
+                f"HTTP {response.status_code}: {response.text}"
+            )
+            stock = self.stock_de(a, b)
+            self.log_result("pedidos", "Rejected order leaves stock unchanged", stock == [10, 2], f"stock {stock}")
+
+            response = self.session.post(f"{self.base_url}/pedidos", json={"lineas": [
+                {"id": a["id"], "cantidad": 8},
+                {"codigo": b["codigo"], "cantidad": 2},
+            ]})
+            lineas = {l["codigo"]: l["stock_actual"] for l in response.json().get("lineas", [])} if response.status_code == 200 else {}
+            self.log_result(
+                "pedidos", "Order with enough stock is dispatched",
+                lineas == {a["codigo"]: 2, b["codigo"]: 0}, f"HTTP {response.status_code}: {response.text}"
+            )
+            stock = self.stock_de(a, b)
+            self.log_result("pedidos", "Dispatched order decrements every line", stock == [2, 0], f"stock {stock}")
+
+            # Repetir el pedido: A ya no alcanza y B está a cero
+            response = self.session.post(f"{self.base_url}/pedidos", json={"lineas": [
+                {"id": a["id"], "cantidad": 8},
+                {"codigo": b["codigo"], "cantidad": 2},
+            ]})
+            stock = self.stock_de(a, b)
+            self.log_result(
+                "pedidos", "Repeated order is rejected without changes",
+                response.status_code == 409 and stock == [2, 0], f"HTTP {response.status_code}, stock {stock}"
+            )
+
+            response = self.session.post(f"{self.base_url}/pedidos", json={"lineas": [
+                {"id": a["id"], "cantidad": 1},
+                {"codigo": f"{self.prefijo}-NO-EXISTE", "cantidad": 1},
+            ]})
+            stock = self.stock_de(a, b)
+            self.log_result(
+                "pedidos", "Unknown product returns 404 without changes",
+                response.status_code == 404 and stock == [2, 0], f"HTTP {response.status_code}, stock {stock}"
+            )
+
+            response = self.session.post(f"{self.base_url}/pedidos", json={"lineas": [
+                {"id": a["id"], "codigo": a["codigo"], "cantidad": 1},
+            ]})
+            self.log_result("pedidos", "Line with both id and codigo returns 400", response.status_code == 400, f"HTTP {response.status_code}")
+        except Exception as e:
+            self.log_result("pedidos", "Pedidos all-or-nothing", False, str(e))
+        finally:
+            self.eliminar_productos_prueba(creados)
+
+    @staticmethod
+    def cursor_de(valores):
+        # Mismo formato que encode_cursor en el servidor: JSON en base64 url-safe
+        return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+
+    def test_paginacion_keyset(self):
+        """Keyset paging of GET /productos: ordering, last page, invalid cursors and limits, deleted cursor rows; limit on GET /contactos"""
+        print("\n=== Testing Productos Keyset Pagination ===")
+        creados = []
+        try:
+            creados = [self.crear_producto_prueba(f"PAG-{i}", stock_actual=100) for i in range(1, 6)]
+
+            # Recorrido completo en páginas de 2
+            vistos = []
+            cursor = ""
+            paginas = 0
+            while cursor is not None and paginas < 10000:
+                response = self.session.get(f"{self.base_url}/productos", params={"cursor": cursor, "limit": 2})
+                if response.status_code != 200:
+                    raise AssertionError(f"page {paginas}: HTTP {response.status_code}: {response.text}")
+                pagina = response.json()
+                if len(pagina["items"]) > 2 or (pagina["next_cursor"] is not None and len(pagina["items"]) != 2):
+                    raise AssertionError(f"page {paginas}: {len(pagina['items'])} items, next_cursor {pagina['next_cursor']}")
+                vistos.extend((p["codigo"], p["id"]) for p in pagina["items"])
+                cursor = pagina["next_cursor"]
+                paginas += 1
+            self.log_result(
+                "paginacion", "Traversal is strictly ordered by (codigo, id)",
+                all(a < b for a, b in zip(vistos, vistos[1:])), "order or duplicate violation"
+            )
+            propios = [(p["codigo"], p["id"]) for p in creados]
+            self.log_result(
+                "paginacion", "Traversal returns every product",
+                cursor is None and set(propios) <= set(vistos), f"missing {set(propios) - set(vistos)}"
+            )
+
+            # Una página exactamente del tamaño del total es la última
+            if len(vistos) <= 3000:
+                response = self.session.get(f"{self.base_url}/productos", params={"cursor": "", "limit": len(vistos)})
+                pagina = response.json()
+                self.log_result(
+                    "paginacion", "Page that ends at the last product has no next_cursor",
+                    len(pagina["items"]) == len(vistos) and pagina["next_cursor"] is None,
+                    f"{len(pagina['items'])} items, next_cursor {pagina['next_cursor']}"
+                )
+
+            for limit in (0, -1, 3001):
+                response = self.session.get(f"{self.base_url}/productos", params={"cursor": "", "limit": limit})
+                self.log_result("paginacion", f"limit={limit} returns 422", response.status_code == 422, f"HTTP {response.status_code}")
+
+            invalidos = {
+                "not base64": "%%%",
+                "not a list": self.cursor_de({"codigo": "x"}),
+                "wrong length": self.cursor_de(["x"]),
+                "operator injection": self.cursor_de([{"$ne": "x"}, ""]),
+            }
+            for nombre, invalido in invalidos.items():
+                response = self.session.get(f"{self.base_url}/productos", params={"cursor": invalido, "limit": 2})
+                self.log_result("paginacion", f"Cursor {nombre} returns 400", response.status_code == 400, f"HTTP {response.status_code}")
+
+            # El producto al que apunta el cursor se elimina: la página sigue en el siguiente
+            cursor = self.cursor_de([creados[1]["codigo"], creados[1]["id"]])
+            self.session.delete(f"{self.base_url}/productos/{creados[1]['id']}")
+            response = self.session.get(f"{self.base_url}/productos", params={"cursor": cursor, "limit": 1})
+            items = response.json().get("items", []) if response.status_code == 200 else []
+            self.log_result(
+                "paginacion", "Cursor on a deleted product resumes at the next one",
+                [p["id"] for p in items] == [creados[2]["id"]], f"HTTP {response.status_code}: {response.text}"
+            )
+
+            # Sin cursor, /contactos aplica limit y sin él devuelve la lista completa
+            contactos = [
+                self.session.post(f"{self.base_url}/contactos", json={"nombre": f"Contacto {self.prefijo}-PAG-{i}"}).json()
+                for i in range(1, 3)
+            ]
+            limitada = self.session.get(f"{self.base_url}/contactos", params={"limit": 1}).json()
+            completa = self.session.get(f"{self.base_url}/contactos").json()
+            for contacto in contactos:
+                self.session.delete(f"{self.base_url}/contactos/{contacto['id']}")
+            self.log_result(
+                "paginacion", "GET /contactos without cursor honours limit",
+                len(limitada) == 1 and {c["id"] for c in contactos} <= {c["id"] for c in completa},
+                f"{len(limitada)} items with limit=1, {len(completa)} without"
+            )
+        except Exception as e:
+            self.log_result("paginacion", "Keyset pagination", False, str(e))
+        finally:
+            self.eliminar_productos_prueba(creados)
+
     def run_all_tests(self):
         """Run all test suites"""
         print("🚀 Starting Comprehensive Backend API Testing")
@@ -422,12 +694,18 @@ class InventoryAPITester:
         if not self.test_api_root():
             print("\n❌ CRITICAL: Cannot connect to API. Stopping tests.")
             return False
+        if not self.autenticar():
+            print("\n❌ CRITICAL: Cannot authenticate. Stopping tests.")
+            return False
         
         # Run all test suites
         self.test_productos_crud()
         self.test_contactos_crud()
         self.test_configuracion_endpoints()
         self.test_alertas_system()
+        self.test_alertas_equivalencia()
+        self.test_pedidos_todo_o_nada()
+        self.test_paginacion_keyset()
         
         # Print summary
         self.print_summary()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the GET /analytics/inventario cold path at 100k/1M SKUs
+Without --mongo-url, times the client side on synthetic raw batches shaped like the analitica_pipeline output:
+reading the columns out of the BSON, the numpy computation, and completing ids and the JSON response.
+With --mongo-url, times the whole cold path against a real database (for example one loaded with seed_catalogo.py),
+including the aggregation inside mongod and the transfer
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import bson
+
+# server.py needs these to import; the synthetic mode never talks to MongoDB
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import server  # noqa: E402
+from server import AnaliticaInventario, DatosAnalitica, calcular_analitica, json_bytes  # noqa: E402
+
+SIZES = [100_000, 1_000_000]
+REPEAT = 3
+HORIZONTE_DIAS = 61
+# Tamaño máximo de un lote que devuelve el servidor
+LOTE_BYTES = 16 * 1024 * 1024
+
+def generar_lotes(n: int):
+    """Raw BSON batches with one document per id prefix, typed like analitica_pipeline: int64 stock, double otherwise"""
+    rng = random.Random(n)
+    bloques = {}
+    for _ in range(n):
+        producto_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        bloque = bloques.setdefault(producto_id[:2], {
+            "n": 0, "id": [], "stock_actual": [], "precio_venta": [], "dias_para_vencer": [], "vendidas": [],
+        })
+        bloque["n"] += 1
+        bloque["id"].append(producto_id)
+        bloque["stock_actual"].append(bson.Int64(0 if rng.random() < 0.05 else int(rng.paretovariate(1.2) * 10)))
+        bloque["precio_venta"].append(round(rng.uniform(0.5, 300), 2))
+        bloque["dias_para_vencer"].append(float(rng.randint(-30, 720)) if rng.random() < 0.6 else float("nan"))
+        bloque["vendidas"].append(float(rng.randint(1, 400)) if rng.random() < 0.4 else 0.0)
+    lotes, actual = [], b""
+    for prefijo, columnas in bloques.items():
+        documento = bson.encode({"_id": prefijo, **columnas})
+        if actual and len(actual) + len(documento) > LOTE_BYTES:
+            lotes.append(actual)
+            actual = b""
+        actual += documento
+    return lotes + [actual]
+
+def completar(analitica: dict, datos: DatosAnalitica):
+    # Mismo paso que completar_codigos, sin la lectura de códigos
+    listas = (analitica["top_valor"], analitica["top_riesgo"], analitica["menor_cobertura"])
+    ids = datos.ids({item["indice"] for lista in listas for item in lista})
+    for lista in listas:
+        for item in lista:
+            item["id"] = ids[item.pop("indice")]
+            item["codigo"] = item["id"][:8]
+    return json_bytes(AnaliticaInventario(**analitica).model_dump(mode="json"))
+
+def imprimir(etiqueta, tiempos, anchos):
+    print(f"{etiqueta:>9} " + " ".join(f"{t * 1000:>{ancho}.1f}" for t, ancho in zip(tiempos, anchos)))
+
+def sintetico():
+    anchos = (12, 11, 10, 11)
+    print(f"{'SKUs':>9} {'read (ms)':>12} {'numpy (ms)':>11} {'json (ms)':>10} {'total (ms)':>11}")
+    for n in SIZES:
+        lotes = generar_lotes(n)
+        mejores = None
+        for _ in range(REPEAT):
+            inicio = time.perf_counter()
+            datos = DatosAnalitica()
+            for lote in lotes:
+                datos.agregar_lote(lote)
+            columnas = datos.columnas()
+            leido = time.perf_counter()
+            analitica = calcular_analitica(columnas, HORIZONTE_DIAS)
+            calculado = time.perf_counter()
+            completar(analitica, datos)
+            fin = time.perf_counter()
+            tiempos = (leido - inicio, calculado - leido, fin - calculado, fin - inicio)
+            mejores = tiempos if mejores is None or tiempos[3] < mejores[3] else mejores
+        imprimir(n, mejores, anchos)
+
+async def contra_mongo(mongo_url: str, db_name: str):
+    server.client = server.AsyncIOMotorClient(mongo_url)
+    server.db = server.client[db_name]
+    productos = await server.db.productos.estimated_document_count()
+    hoy = datetime.now().date()
+    anchos = (18, 11, 13, 11)
+    print(f"{db_name}: ~{productos} productos")
+    print(f"{'run':>9} {'aggregate+read (ms)':>18} {'numpy (ms)':>11} {'codes+json':>13} {'total (ms)':>11}")
+    for intento in range(1, REPEAT + 1):
+        inicio = time.perf_counter()
+        datos = await server.leer_datos_analitica(hoy)
+        leido = time.perf_counter()
+        analitica = calcular_analitica(datos.columnas(), HORIZONTE_DIAS)
+        calculado = time.perf_counter()
+        analitica = await server.completar_codigos(analitica, datos)
+        json_bytes(analitica.model_dump(mode="json"))
+        fin = time.perf_counter()
+        imprimir(intento, (leido - inicio, calculado - leido, fin - calculado, fin - inicio), anchos)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", help="Time the whole cold path against this MongoDB instead of synthetic batches")
+    parser.add_argument("--db", default=os.environ.get("DB_NAME", "inventario_escala"))
+    args = parser.parse_args()
+    if args.mongo_url:
+        asyncio.run(contra_mongo(args.mongo_url, args.db))
+    else:
+        sintetico()
+
+if __name__ == "__main__":
+    main()
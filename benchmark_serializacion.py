@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the list endpoint serialization paths
+Compares the Pydantic response_model path with the fast JSON path at 1k/10k/100k rows
+"""
+
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, date, timedelta
+from typing import List
+
+from pydantic import TypeAdapter
+
+# server.py needs these to import; the benchmark never talks to MongoDB
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from server import Producto, PRODUCTO_JSON, fecha_bson, json_bytes  # noqa: E402
+
+SIZES = [1_000, 10_000, 100_000]
+REPEAT = 3
+
+def generar_documentos(n: int):
+    """Documents shaped like the ones Motor returns for productos"""
+    base = datetime(2024, 1, 1, 8, 30, 15, 123000)
+    docs = []
+    for i in range(n):
+        docs.append({
+            "id": str(uuid.uuid4()),
+            "codigo": f"BEN{i:07d}",
+            "descripcion": f"Producto de prueba número {i}",
+            "unidad_venta": "Unidades" if i % 3 else "Cajas",
+            "stock_actual": i % 250,
+            "precio_venta": round(1 + (i % 997) * 0.37, 2),
+            "fecha_ingreso": fecha_bson(date(2024, 1, 1) + timedelta(days=i % 365)),
+            "fecha_vencimiento": fecha_bson(date(2025, 1, 1) + timedelta(days=i % 730)) if i % 5 else None,
+            "created_at": base + timedelta(seconds=i),
+            "updated_at": base + timedelta(seconds=2 * i),
+        })
+    return docs
+
+def ruta_actual(docs):
+    """Producto per row, response_model re-validation, JSON-mode dump and json.dumps, as FastAPI does"""
+    productos = [Producto(**doc) for doc in docs]
+    adapter = TypeAdapter(List[Producto])
+    validados = adapter.validate_python([p.model_dump() for p in productos])
+    contenido = adapter.dump_python(validados, mode="json")
+    return json.dumps(contenido, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def ruta_rapida(docs):
+    rows, orjson_compatible = PRODUCTO_JSON.rows(docs)
+    return json_bytes(rows, orjson_compatible)
+
+def medir(funcion, docs):
+    mejor = None
+    for _ in range(REPEAT):
+        # Each run gets fresh dicts, like a new Motor batch would
+        copia = [dict(doc) for doc in docs]
+        inicio = time.perf_counter()
+        resultado = funcion(copia)
+        transcurrido = time.perf_counter() - inicio
+        mejor = transcurrido if mejor is None else min(mejor, transcurrido)
+    return mejor, resultado
+
+def main():
+    print(f"{'filas':>8} {'actual (ms)':>12} {'rápida (ms)':>12} {'speedup':>8}  idéntico")
+    for n in SIZES:
+        docs = generar_documentos(n)
+        t_actual, salida_actual = medir(ruta_actual, docs)
+        t_rapida, salida_rapida = medir(ruta_rapida, docs)
+        print(
+            f"{n:>8} {t_actual * 1000:>12.1f} {t_rapida * 1000:>12.1f} "
+            f"{t_actual / t_rapida:>7.1f}x  {salida_actual == salida_rapida}"
+        )
+
+if __name__ == "__main__":
+    main()
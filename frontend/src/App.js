@@ -266,17 +266,12 @@ const InventoryApp = () => {
   const cargarDatos = async () => {
     setLoading(true);
     try {
-      const [productosRes, contactosRes, alertasRes, configRes] = await Promise.all([
-        axios.get(`${API}/productos`),
-        axios.get(`${API}/contactos`),
-        axios.get(`${API}/alertas`),
-        axios.get(`${API}/configuracion`)
-      ]);
-      
-      setProductos(productosRes.data);
-      setContactos(contactosRes.data);
-      setAlertas(alertasRes.data);
-      setConfiguracion(configRes.data);
+      const { data } = await axios.get(`${API}/bootstrap`);
+
+      setProductos(data.productos);
+      setContactos(data.contactos);
+      setAlertas(data.alertas);
+      setConfiguracion(data.configuracion);
     } catch (error) {
       console.error('Error cargando datos:', error);
       if (error.response?.status === 401) {
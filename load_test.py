@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Concurrent load test for the Inventory Management API
+Runs the backend_test.py scenarios (productos, contactos, configuracion, alertas) with asyncio/httpx
+and reports throughput and p50/p95/p99 latency per endpoint, optionally as JSON for diffing runs
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import date, timedelta
+
+import httpx
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Peso relativo de cada escenario; se puede sobrescribir con --mix nombre=peso,...
+DEFAULT_MIX = {
+    "productos_listar": 25,
+    "producto_obtener": 15,
+    "producto_crear": 6,
+    "producto_actualizar": 10,
+    "producto_eliminar": 3,
+    "contactos_listar": 10,
+    "contacto_crear": 3,
+    "contacto_actualizar": 3,
+    "contacto_eliminar": 1,
+    "configuracion_obtener": 10,
+    "configuracion_actualizar": 1,
+    "alertas": 13,
+}
+
+def get_backend_url():
+    try:
+        with open('/app/frontend/.env', 'r') as f:
+            for line in f:
+                if line.startswith('REACT_APP_BACKEND_URL='):
+                    return line.split('=', 1)[1].strip()
+    except FileNotFoundError:
+        return "http://localhost:8001"
+    return "http://localhost:8001"
+
+def parse_mix(value: str):
+    mix = {}
+    for part in value.split(","):
+        nombre, _, peso = part.partition("=")
+        nombre = nombre.strip()
+        if nombre not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Escenario desconocido: {nombre}")
+        mix[nombre] = float(peso or 1)
+    return mix
+
+def percentile(sorted_values, pct: float):
+    """Nearest-rank percentile over an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+class Stats:
+    def __init__(self):
+        self.latencias = {}
+        self.errores = {}
+        self.estados = {}
+
+    def record(self, endpoint: str, segundos: float, status_code: int, esperado: bool):
+        self.latencias.setdefault(endpoint, []).append(segundos)
+        estados = self.estados.setdefault(endpoint, {})
+        estados[str(status_code)] = estados.get(str(status_code), 0) + 1
+        if not esperado:
+            self.errores[endpoint] = self.errores.get(endpoint, 0) + 1
+
+    def summary(self, elapsed: float):
+        endpoints = {}
+        todas = []
+        for endpoint, valores in sorted(self.latencias.items()):
+            valores = sorted(valores)
+            todas.extend(valores)
+            endpoints[endpoint] = self._resumen(valores, elapsed)
+            endpoints[endpoint]["errores"] = self.errores.get(endpoint, 0)
+            endpoints[endpoint]["estados"] = dict(sorted(self.estados[endpoint].items()))
+        total = self._resumen(sorted(todas), elapsed)
+        total["errores"] = sum(self.errores.values())
+        return total, endpoints
+
+    @staticmethod
+    def _resumen(valores, elapsed: float):
+        return {
+            "peticiones": len(valores),
+            "rps": round(len(valores) / elapsed, 2) if elapsed else 0.0,
+            "media_ms": round(sum(valores) / len(valores) * 1000, 3) if valores else None,
+            "p50_ms": round(percentile(valores, 50) * 1000, 3) if valores else None,
+            "p95_ms": round(percentile(valores, 95) * 1000, 3) if valores else None,
+            "p99_ms": round(percentile(valores, 99) * 1000, 3) if valores else None,
+            "max_ms": round(valores[-1] * 1000, 3) if valores else None,
+        }
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.stats = Stats()
+        self.random = random.Random(args.seed)
+        self.run_id = uuid.uuid4().hex[:4].upper()
+        self.contador = 0
+        self.contador_peticiones = 0
+        self.tokens = []
+        self.productos = []
+        self.contactos = []
+        escenarios = args.mix or DEFAULT_MIX
+        self.escenarios = [getattr(self, nombre) for nombre in escenarios]
+        self.pesos = list(escenarios.values())
+
+    async def request(self, endpoint: str, method: str, url: str, token: str, esperado=(200,), **kwargs):
+        inicio = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers={"Authorization": f"Bearer {token}"}, **kwargs)
+        except httpx.HTTPError as e:
+            self.stats.record(endpoint, time.perf_counter() - inicio, 0, False)
+            if self.args.verbose:
+                print(f"❌ {endpoint}: {e}")
+            return None
+        self.stats.record(endpoint, time.perf_counter() - inicio, response.status_code, response.status_code in esperado)
+        if self.args.verbose and response.status_code not in esperado:
+            print(f"❌ {endpoint}: HTTP {response.status_code} {response.text[:200]}")
+        return response
+
+    def nuevo_codigo(self):
+        self.contador += 1
+        return f"LT{self.run_id}{self.contador:05d}"
+
+    def producto_data(self):
+        hoy = date.today()
+        return {
+            "codigo": self.nuevo_codigo(),
+            "descripcion": self.random.choice(["Arroz Extra", "Aceite Vegetal", "Lentejas", "Detergente", "Azúcar Rubia"]),
+            "unidad_venta": self.random.choice(["Kilogramos", "Litros", "Unidades"]),
+            "stock_actual": self.random.randint(0, 120),
+            "precio_venta": round(self.random.uniform(0.5, 30), 2),
+            "fecha_ingreso": hoy.isoformat(),
+            "fecha_vencimiento": (hoy + timedelta(days=self.random.randint(5, 400))).isoformat(),
+        }
+
+    def contacto_data(self):
+        n = self.random.randint(1, 10_000)
+        return {
+            "nombre": f"Distribuidora Carga {self.run_id} {n}",
+            "direccion": f"Av. Principal {n}",
+            "telefono": f"+51 9{n:08d}",
+            "correo": f"carga{n}@ejemplo.com",
+            "tipo": self.random.choice(["Proveedor", "Cliente"]),
+        }
+
+    # Fase de login: un token por usuario de carga, repartidos entre los workers
+    async def login(self):
+        password = "CargaPass123!"
+        for i in range(self.args.users):
+            username = f"carga_{self.run_id.lower()}_{i}"
+            await self.client.post("/register", json={"username": username, "nombre_completo": f"Usuario Carga {i}", "password": password})
+            response = await self.client.post("/login", json={"username": username, "password": password})
+            if response.status_code != 200:
+                raise SystemExit(f"Login fallido para {username}: HTTP {response.status_code} {response.text[:200]}")
+            self.tokens.append(response.json()["access_token"])
+
+    async def seed(self):
+        token = self.tokens[0]
+        for _ in range(self.args.seed_productos):
+            response = await self.client.post("/productos", json=self.producto_data(), headers={"Authorization": f"Bearer {token}"})
+            if response.status_code == 200:
+                self.productos.append(response.json()["id"])
+        for _ in range(self.args.seed_contactos):
+            response = await self.client.post("/contactos", json=self.contacto_data(), headers={"Authorization": f"Bearer {token}"})
+            if response.status_code == 200:
+                self.contactos.append(response.json()["id"])
+
+    async def cleanup(self):
+        token = self.tokens[0]
+        for producto_id in self.productos:
+            await self.client.delete(f"/productos/{producto_id}", headers={"Authorization": f"Bearer {token}"})
+        for contacto_id in self.contactos:
+            await self.client.delete(f"/contactos/{contacto_id}", headers={"Authorization": f"Bearer {token}"})
+
+    # Escenarios
+    async def productos_listar(self, token):
+        await self.request("GET /productos", "GET", "/productos", token, params={"limit": self.args.page_size})
+
+    async def producto_obtener(self, token):
+        if self.productos:
+            await self.request("GET /productos/{id}", "GET", f"/productos/{self.random.choice(self.productos)}", token, esperado=(200, 404))
+
+    async def producto_crear(self, token):
+        response = await self.request("POST /productos", "POST", "/productos", token, json=self.producto_data())
+        if response is not None and response.status_code == 200:
+            self.productos.append(response.json()["id"])
+
+    async def producto_actualizar(self, token):
+        if self.productos:
+            data = {"stock_actual": self.random.randint(0, 120), "precio_venta": round(self.random.uniform(0.5, 30), 2)}
+            await self.request("PUT /productos/{id}", "PUT", f"/productos/{self.random.choice(self.productos)}", token, esperado=(200, 404), json=data)
+
+    async def producto_eliminar(self, token):
+        if len(self.productos) > 1:
+            producto_id = self.productos.pop(self.random.randrange(len(self.productos)))
+            await self.request("DELETE /productos/{id}", "DELETE", f"/productos/{producto_id}", token, esperado=(200, 404))
+
+    async def contactos_listar(self, token):
+        await self.request("GET /contactos", "GET", "/contactos", token, params={"limit": self.args.page_size})
+
+    async def contacto_crear(self, token):
+        response = await self.request("POST /contactos", "POST", "/contactos", token, json=self.contacto_data())
+        if response is not None and response.status_code == 200:
+            self.contactos.append(response.json()["id"])
+
+    async def contacto_actualizar(self, token):
+        if self.contactos:
+            data = {"telefono": f"+51 9{self.random.randint(0, 99_999_999):08d}"}
+            await self.request("PUT /contactos/{id}", "PUT", f"/contactos/{self.random.choice(self.contactos)}", token, esperado=(200, 404), json=data)
+
+    async def contacto_eliminar(self, token):
+        if len(self.contactos) > 1:
+            contacto_id = self.contactos.pop(self.random.randrange(len(self.contactos)))
+            await self.request("DELETE /contactos/{id}", "DELETE", f"/contactos/{contacto_id}", token, esperado=(200, 404))
+
+    async def configuracion_obtener(self, token):
+        await self.request("GET /configuracion", "GET", "/configuracion", token)
+
+    async def configuracion_actualizar(self, token):
+        data = {"stock_bajo_limite": self.random.randint(5, 15), "vencimiento_alerta_meses": self.random.randint(1, 3)}
+        await self.request("PUT /configuracion", "PUT", "/configuracion", token, json=data)
+
+    async def alertas(self, token):
+        await self.request("GET /alertas", "GET", "/alertas", token)
+
+    async def worker(self, numero: int, deadline: float):
+        token = self.tokens[numero % len(self.tokens)]
+        while time.perf_counter() < deadline:
+            if self.args.requests and self.contador_peticiones >= self.args.requests:
+                return
+            self.contador_peticiones += 1
+            escenario = self.random.choices(self.escenarios, weights=self.pesos)[0]
+            await escenario(token)
+
+    async def run(self):
+        print(f"🔑 Login de {self.args.users} usuarios de carga...")
+        await self.login()
+        print(f"🌱 Creando {self.args.seed_productos} productos y {self.args.seed_contactos} contactos...")
+        await self.seed()
+        print(f"🚀 {self.args.concurrency} workers durante {self.args.duration}s...")
+        inicio = time.perf_counter()
+        deadline = inicio + self.args.duration
+        await asyncio.gather(*(self.worker(i, deadline) for i in range(self.args.concurrency)))
+        elapsed = time.perf_counter() - inicio
+        if not self.args.keep_data:
+            await self.cleanup()
+        total, endpoints = self.stats.summary(elapsed)
+        return {
+            "config": {
+                "target": self.args.target,
+                "concurrency": self.args.concurrency,
+                "duration": self.args.duration,
+                "requests": self.args.requests,
+                "users": self.args.users,
+                "seed": self.args.seed,
+                "mix": self.args.mix or DEFAULT_MIX,
+                "excluidos": self.args.excluidos,
+            },
+            "elapsed_s": round(elapsed, 3),
+            "total": total,
+            "endpoints": endpoints,
+        }
+
+def print_report(resultado: dict):
+    print("\n" + "=" * 96)
+    print("📊 LOAD TEST SUMMARY")
+    print("=" * 96)
+    print(f"{'ENDPOINT':28} {'REQS':>7} {'RPS':>9} {'P50 ms':>9} {'P95 ms':>9} {'P99 ms':>9} {'MAX ms':>9} {'ERR':>6}")
+    print("-" * 96)
+    filas = list(resultado["endpoints"].items()) + [("TOTAL", resultado["total"])]
+    for endpoint, r in filas:
+        print(
+            f"{endpoint:28} {r['peticiones']:>7} {r['rps']:>9.1f} {r['p50_ms'] or 0:>9.2f} "
+            f"{r['p95_ms'] or 0:>9.2f} {r['p99_ms'] or 0:>9.2f} {r['max_ms'] or 0:>9.2f} {r['errores']:>6}"
+        )
+    print("=" * 96)
+    for escenario, motivo in resultado["config"]["excluidos"].items():
+        print(f"⚠️  Escenario {escenario} excluido: {motivo}")
+
+async def run_http(args):
+    base_url = (args.url or get_backend_url()) + "/api"
+    args.target = base_url
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        return await LoadTest(client, args).run()
+
+async def run_in_process(args):
+    # La app corre en este proceso vía ASGITransport: no hay tráfico de red
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "inventario_carga")
+    sys.path.insert(0, os.path.join(ROOT_DIR, "backend"))
+    import server
+
+    if args.memory:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("--memory requiere mongomock-motor (pip install mongomock-motor)")
+        server.client = AsyncMongoMockClient()
+        server.db = server.client[os.environ["DB_NAME"]]
+
+        # mongomock no implementa $merge/$out: las alertas materializadas no se mantienen en memoria
+        async def sin_alertas(*args, **kwargs):
+            return None
+        server.refrescar_alertas = sin_alertas
+        server.reconstruir_alertas = sin_alertas
+        server.sincronizar_alertas = sin_alertas
+        args.target = "in-process (memory)"
+        # GET /alertas solo mediría una tabla vacía: el escenario queda fuera y el informe lo dice
+        args.excluidos = {"alertas": "mongomock no implementa $merge/$out; las escrituras no mantienen las alertas"}
+        args.mix = {nombre: peso for nombre, peso in (args.mix or DEFAULT_MIX).items() if nombre not in args.excluidos}
+        if not args.mix:
+            raise SystemExit("--memory no admite un --mix solo de alertas")
+    else:
+        args.target = f"in-process ({os.environ['MONGO_URL']})"
+
+    await server.app.router.startup()
+    try:
+        # Una excepción de la app llega como 500 y se cuenta como error en vez de abortar la prueba
+        transport = httpx.ASGITransport(app=server.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://carga/api", timeout=args.timeout) as client:
+            return await LoadTest(client, args).run()
+    finally:
+        await server.app.router.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Backend base URL (default: REACT_APP_BACKEND_URL or http://localhost:8001)")
+    parser.add_argument("--in-process", action="store_true", help="Run the app in this process through ASGITransport, against MONGO_URL")
+    parser.add_argument("--memory", action="store_true", help="With --in-process, use an in-memory Motor stand-in (mongomock-motor); the alertas scenario is left out")
+    parser.add_argument("-c", "--concurrency", type=int, default=20)
+    parser.add_argument("-d", "--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument("-n", "--requests", type=int, default=0, help="Stop after this many requests (0 = only duration)")
+    parser.add_argument("--mix", type=parse_mix, help="Scenario weights, e.g. productos_listar=5,alertas=2")
+    parser.add_argument("--users", type=int, default=4, help="Users created and logged in before the run")
+    parser.add_argument("--seed-productos", type=int, default=200)
+    parser.add_argument("--seed-contactos", type=int, default=50)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--keep-data", action="store_true", help="Do not delete the productos/contactos created by the run")
+    parser.add_argument("-o", "--output", help="Write the JSON results to this file")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    args.excluidos = {}
+    if args.memory:
+        args.in_process = True
+
+    resultado = asyncio.run(run_in_process(args) if args.in_process else run_http(args))
+    print_report(resultado)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(resultado, f, indent=2, sort_keys=True, ensure_ascii=False)
+        print(f"💾 Resultados guardados en {args.output}")
+    sys.exit(1 if resultado["total"]["errores"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Synthetic catalog generator for scale testing
+Loads N productos, contactos and usuarios into MongoDB with batched insert_many across parallel workers;
+stock is Zipf-like with a tunable share of zeros, expiry dates include a tunable near-expiry fraction
+and the output is deterministic for a given --seed and --fecha-base
+"""
+
+import argparse
+import functools
+import multiprocessing
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Prefijo de código al estilo de backend_test.py (ARZ001, ACE002, LEG003, DEL001)
+CATEGORIAS = [
+    ("ARZ", "Arroz", ["Extra", "Superior", "Integral", "Añejo"], "Kilogramos"),
+    ("ACE", "Aceite", ["Vegetal", "de Oliva", "de Girasol", "de Soya"], "Litros"),
+    ("LEG", "Lentejas", ["Bebé", "Verdes", "Rojas", "Pardinas"], "Kilogramos"),
+    ("DEL", "Detergente", ["en Polvo", "Líquido", "Multiusos", "Bebé"], "Unidades"),
+    ("AZU", "Azúcar", ["Rubia", "Blanca", "Morena", "Impalpable"], "Kilogramos"),
+    ("LEC", "Leche", ["Evaporada", "Entera", "Descremada", "Sin Lactosa"], "Unidades"),
+    ("FID", "Fideos", ["Spaghetti", "Tallarín", "Canuto", "Corbata"], "Unidades"),
+    ("GAL", "Galletas", ["de Soda", "de Vainilla", "Integrales", "de Chocolate"], "Cajas"),
+    ("ATU", "Atún", ["en Aceite", "en Agua", "Desmenuzado", "en Trozos"], "Unidades"),
+    ("JAB", "Jabón", ["de Tocador", "de Lavar", "Antibacterial", "Glicerina"], "Unidades"),
+]
+MARCAS = ["Costeño", "Primor", "Gloria", "Bolívar", "Don Vittorio", "Florida", "Paisana", "Cielo", "Laive", "Campomar"]
+PRESENTACIONES = ["250g", "500g", "1kg", "5kg", "900ml", "1L", "x6", "x12", "Familiar", "Económico"]
+TIPOS_CONTACTO = ["Proveedor", "Cliente"]
+CIUDADES = ["Lima", "Arequipa", "Trujillo", "Cusco", "Piura", "Chiclayo", "Huancayo", "Iquitos"]
+EMPRESAS = ["Distribuidora", "Comercial", "Inversiones", "Corporación", "Importadora", "Bodega", "Minimarket"]
+
+def rng_lote(seed: int, coleccion: str, lote: int):
+    # Cada lote tiene su propia semilla: el resultado no depende del número de workers
+    return random.Random(f"{seed}-{coleccion}-{lote}")
+
+def uuid_determinista(rng: random.Random):
+    # Equivale a uuid.UUID(int=..., version=4) sin el coste de construir el objeto
+    h = f"{rng.getrandbits(128):032x}"
+    return f"{h[:8]}-{h[8:12]}-4{h[13:16]}-{'89ab'[int(h[16], 16) & 3]}{h[17:20]}-{h[20:32]}"
+
+def stock_zipf(rng: random.Random, opciones: dict):
+    if rng.random() < opciones["stock_zero"]:
+        return 0
+    # Pareto discreta: muchos productos con poco stock y una cola larga con mucho
+    return min(opciones["stock_max"], int(rng.paretovariate(opciones["stock_alpha"]) * opciones["stock_scale"]))
+
+def fecha_vencimiento(rng: random.Random, base: date, opciones: dict):
+    r = rng.random()
+    if r < opciones["sin_vencimiento"]:
+        return None
+    r -= opciones["sin_vencimiento"]
+    if r < opciones["vencidos"]:
+        return base - timedelta(days=1 + int(rng.random() * 90))
+    r -= opciones["vencidos"]
+    dias = opciones["near_expiry_days"]
+    if r < opciones["near_expiry"]:
+        return base + timedelta(days=int(rng.random() * (dias + 1)))
+    return base + timedelta(days=dias + 1 + int(rng.random() * (730 - dias)))
+
+def marca_de_tiempo(rng: random.Random, base: date, dias: int):
+    inicio = datetime.combine(base, dt_time(), tzinfo=timezone.utc) - timedelta(days=dias)
+    return inicio + timedelta(seconds=int(rng.random() * dias * 86400))
+
+@functools.lru_cache(maxsize=1)
+def descripciones(server):
+    # Todas las combinaciones por categoría, con sus tokens de búsqueda ya calculados
+    por_categoria = []
+    for _, nombre, variantes, _ in CATEGORIAS:
+        combinaciones = []
+        for variante in variantes:
+            for marca in MARCAS:
+                for presentacion in PRESENTACIONES:
+                    descripcion = f"{nombre} {variante} {marca} {presentacion}"
+                    combinaciones.append((descripcion, server.tokens_busqueda({"descripcion": descripcion}, ["descripcion"])))
+        por_categoria.append(combinaciones)
+    return por_categoria
+
+def generar_productos(rng: random.Random, inicio: int, fin: int, opciones: dict, server):
+    base = opciones["fecha_base"]
+    ancho = max(3, len(str(opciones["total_productos"])))
+    por_categoria = descripciones(server)
+    docs = []
+    for i in range(inicio, fin):
+        categoria = i % len(CATEGORIAS)
+        prefijo, _, _, unidad = CATEGORIAS[categoria]
+        combinaciones = por_categoria[categoria]
+        descripcion, tokens = combinaciones[int(rng.random() * len(combinaciones))]
+        codigo = f"{prefijo}{i + 1:0{ancho}d}"
+        vencimiento = fecha_vencimiento(rng, base, opciones)
+        creado = marca_de_tiempo(rng, base, 365)
+        docs.append(server.prepare_for_mongo({
+            "id": uuid_determinista(rng),
+            "codigo": codigo,
+            "descripcion": descripcion,
+            "unidad_venta": unidad,
+            "stock_actual": stock_zipf(rng, opciones),
+            "precio_venta": round(rng.lognormvariate(1.5, 0.8), 2),
+            "fecha_ingreso": creado.date(),
+            "fecha_vencimiento": vencimiento,
+            "created_at": creado,
+            "updated_at": creado,
+            # Un código ASCII sin espacios produce un único token: él mismo en minúsculas
+            "_busqueda": sorted([*tokens, codigo.lower()]),
+        }))
+    return docs
+
+def generar_contactos(rng: random.Random, inicio: int, fin: int, opciones: dict, server):
+    docs = []
+    for i in range(inicio, fin):
+        ciudad = rng.choice(CIUDADES)
+        doc = {
+            "id": uuid_determinista(rng),
+            "nombre": f"{rng.choice(EMPRESAS)} {rng.choice(MARCAS)} {ciudad} {i + 1}",
+            "direccion": f"Av. {rng.choice(MARCAS)} {rng.randint(100, 9999)}, {ciudad}",
+            "telefono": f"+51 9{rng.randint(0, 99_999_999):08d}",
+            "correo": f"contacto{i + 1}@{server.normalizar_texto(rng.choice(MARCAS)).replace(' ', '')}.com.pe",
+            "tipo": rng.choice(TIPOS_CONTACTO),
+        }
+        doc["created_at"] = doc["updated_at"] = marca_de_tiempo(rng, opciones["fecha_base"], 365)
+        doc["_busqueda"] = server.tokens_busqueda(doc, server.SEARCH_FIELDS["contactos"])
+        docs.append(doc)
+    return docs
+
+def generar_usuarios(rng: random.Random, inicio: int, fin: int, opciones: dict, server):
+    docs = []
+    for i in range(inicio, fin):
+        docs.append({
+            "id": uuid_determinista(rng),
+            "username": f"usuario{i + 1:05d}",
+            "nombre_completo": f"Usuario Sintético {i + 1}",
+            # El hash de --password se calcula una sola vez y lo comparten todos
+            "hashed_password": opciones["hashed_password"],
+            "rol": "maestro" if i == 0 else "usuario",
+            "estado": "aprobado",
+            "activo": True,
+            "created_at": marca_de_tiempo(rng, opciones["fecha_base"], 365),
+        })
+    return docs
+
+# Colecciones derivadas de los datos cargados: con --drop se vacían para no quedar huérfanas
+DERIVADAS = ["alertas_materializadas", "movimientos", "movimientos_diarios", "eliminados"]
+
+GENERADORES = {
+    "productos": generar_productos,
+    "contactos": generar_contactos,
+    "usuarios": generar_usuarios,
+}
+
+_worker = {}
+
+def iniciar_worker(mongo_url: str, db_name: str, dry_run: bool):
+    os.environ.setdefault("MONGO_URL", mongo_url)
+    os.environ.setdefault("DB_NAME", db_name)
+    sys.path.insert(0, os.path.join(ROOT_DIR, "backend"))
+    import server
+
+    _worker["server"] = server
+    _worker["db"] = None if dry_run else MongoClient(mongo_url, w=1)[db_name]
+
+def cargar_lote(tarea):
+    coleccion, lote, inicio, fin, seed, opciones = tarea
+    rng = rng_lote(seed, coleccion, lote)
+    docs = GENERADORES[coleccion](rng, inicio, fin, opciones, _worker["server"])
+    if _worker["db"] is None:
+        return coleccion, len(docs), 0
+    try:
+        insertados = len(_worker["db"][coleccion].insert_many(docs, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        insertados = e.details["nInserted"]
+    return coleccion, insertados, len(docs) - insertados
+
+def tareas(coleccion: str, total: int, batch_size: int, seed: int, opciones: dict):
+    for lote, inicio in enumerate(range(0, total, batch_size)):
+        yield coleccion, lote, inicio, min(inicio + batch_size, total), seed, opciones
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default=os.environ.get("DB_NAME", "inventario_escala"))
+    parser.add_argument("-p", "--productos", type=int, default=100_000)
+    parser.add_argument("-c", "--contactos", type=int, default=1_000)
+    parser.add_argument("-u", "--usuarios", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--fecha-base", type=date.fromisoformat, default=date.today(), help="Reference date for expiry and timestamps (YYYY-MM-DD)")
+    parser.add_argument("--stock-zero", type=float, default=0.05, help="Share of productos with stock 0")
+    parser.add_argument("--stock-alpha", type=float, default=1.1, help="Pareto shape of the stock distribution (lower = longer tail)")
+    parser.add_argument("--stock-scale", type=float, default=10.0, help="Minimum non-zero stock; the tail grows from here")
+    parser.add_argument("--stock-max", type=int, default=10_000)
+    parser.add_argument("--near-expiry", type=float, default=0.10, help="Share of productos expiring within --near-expiry-days")
+    parser.add_argument("--near-expiry-days", type=int, default=60)
+    parser.add_argument("--expired", type=float, default=0.02, help="Share of productos already expired")
+    parser.add_argument("--no-expiry", type=float, default=0.20, help="Share of productos without fecha_vencimiento")
+    parser.add_argument("--password", default="Escala123!", help="Password shared by all generated usuarios")
+    parser.add_argument("-b", "--batch-size", type=int, default=5_000)
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--drop", action="store_true", help="Drop the target collections and their movimientos, alertas and eliminados first, and build indexes after loading")
+    parser.add_argument("--dry-run", action="store_true", help="Generate the documents without touching MongoDB")
+    args = parser.parse_args()
+
+    if args.stock_zero > 1 or args.near_expiry + args.expired + args.no_expiry > 1:
+        parser.error("Las fracciones de stock o de vencimiento suman más de 1")
+
+    os.environ.setdefault("MONGO_URL", args.mongo_url)
+    os.environ.setdefault("DB_NAME", args.db)
+    sys.path.insert(0, os.path.join(ROOT_DIR, "backend"))
+    import server
+
+    opciones = {
+        "fecha_base": args.fecha_base,
+        "total_productos": args.productos,
+        "stock_zero": args.stock_zero,
+        "stock_alpha": args.stock_alpha,
+        "stock_scale": args.stock_scale,
+        "stock_max": args.stock_max,
+        "near_expiry": args.near_expiry,
+        "near_expiry_days": args.near_expiry_days,
+        "vencidos": args.expired,
+        "sin_vencimiento": args.no_expiry,
+        "hashed_password": server.get_password_hash(args.password) if args.usuarios else None,
+    }
+    totales = {"productos": args.productos, "contactos": args.contactos, "usuarios": args.usuarios}
+
+    db = None if args.dry_run else MongoClient(args.mongo_url)[args.db]
+    if db is not None and args.drop:
+        for coleccion in list(totales) + DERIVADAS:
+            db[coleccion].drop()
+
+    print(f"🌱 Generando {args.productos} productos, {args.contactos} contactos y {args.usuarios} usuarios "
+          f"(seed={args.seed}, {args.workers} workers, lotes de {args.batch_size})")
+    inicio = time.perf_counter()
+    resultado = {coleccion: [0, 0] for coleccion in totales}
+    todas = [t for coleccion, total in totales.items() for t in tareas(coleccion, total, args.batch_size, args.seed, opciones)]
+    contexto = multiprocessing.get_context("spawn")
+    with contexto.Pool(args.workers, initializer=iniciar_worker, initargs=(args.mongo_url, args.db, args.dry_run)) as pool:
+        for coleccion, insertados, fallidos in pool.imap_unordered(cargar_lote, todas):
+            resultado[coleccion][0] += insertados
+            resultado[coleccion][1] += fallidos
+    carga = time.perf_counter() - inicio
+
+    if db is not None:
+        # Con --drop los índices se construyen una vez al final, más rápido que mantenerlos durante la carga
+        for coleccion in list(totales) + (DERIVADAS if args.drop else ["alertas_materializadas"]):
+            db[coleccion].create_indexes(server.MONGO_INDEXES[coleccion])
+        # Forzar la reconstrucción de alertas y nuevos ETags en la próxima petición
+        db.alertas_estado.delete_one({"_id": "alertas"})
+        db.versiones.update_one(
+            {"_id": "versiones"},
+            {"$inc": {"productos": 1, "contactos": 1, "alertas": 1}},
+            upsert=True
+        )
+
+    total = time.perf_counter() - inicio
+    verbo = "generados" if args.dry_run else "insertados"
+    for coleccion, (insertados, fallidos) in resultado.items():
+        detalle = f", {fallidos} duplicados" if fallidos else ""
+        print(f"✅ {coleccion:10} {insertados:>10} {verbo}{detalle}")
+    docs = sum(insertados for insertados, _ in resultado.values())
+    print(f"⏱️  Carga {carga:.1f}s ({docs / carga:,.0f} docs/s), total con índices {total:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Shared fixtures for the API tests, against a real MongoDB
+Uses MONGO_URL and the TEST_DB_NAME database (default inventario_test), which is dropped before each test;
+tests that need the database skip when MongoDB is not reachable
+"""
+
+import functools
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ["DB_NAME"] = os.environ.get("TEST_DB_NAME", "inventario_test")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from pymongo import MongoClient  # noqa: E402
+from pymongo.errors import ServerSelectionTimeoutError  # noqa: E402
+
+import server  # noqa: E402
+
+def reiniciar_caches():
+    server.user_cache.clear()
+    server.codigo_cache.clear()
+    server.version_cache.versions = {}
+    server.version_cache.checked_at = 0.0
+    server.config_cache.config = None
+    server.analitica_cache = (None, None)
+    server.transacciones_soportadas = None
+
+@pytest.fixture
+def api():
+    try:
+        with MongoClient(os.environ["MONGO_URL"], serverSelectionTimeoutMS=2000) as cliente:
+            cliente.drop_database(os.environ["DB_NAME"])
+    except ServerSelectionTimeoutError:
+        pytest.skip("MongoDB no disponible")
+    # Un cliente Motor por prueba: TestClient abre su propio event loop
+    server.client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    server.db = server.client[os.environ["DB_NAME"]]
+    reiniciar_caches()
+    with TestClient(server.app) as cliente:
+        yield cliente
+
+def ejecutar(api, funcion, *args, **kwargs):
+    # Acceso directo a la base desde la prueba, en el event loop de la aplicación
+    return api.portal.call(functools.partial(funcion, *args, **kwargs))
+
+def autenticar(api, username: str = "tester", password: str = "clave-tester", rol: str = None):
+    api.post("/api/register", json={"username": username, "password": password, "nombre_completo": username.title()})
+    if rol:
+        ejecutar(api, server.db.usuarios.update_one, {"username": username}, {"$set": {"rol": rol}})
+        server.user_cache.invalidate(username)
+    respuesta = api.post("/api/login", json={"username": username, "password": password})
+    assert respuesta.status_code == 200, respuesta.text
+    return {"Authorization": f"Bearer {respuesta.json()['access_token']}"}
+
+@pytest.fixture
+def auth(api):
+    return autenticar(api)
@@ -0,0 +1,42 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+from .conftest import autenticar, ejecutar
+
+import server
+
+def alertas_de(api, auth, producto_id: str):
+    return [a["tipo_alerta"] for a in api.get("/api/alertas", headers=auth).json() if a["id"] == producto_id]
+
+def test_cambios_de_stock_reemplazan_las_alertas(api, auth):
+    producto = api.post("/api/productos", headers=auth, json={"codigo": "AL-1", "descripcion": "Alerta", "stock_actual": 3}).json()
+    assert alertas_de(api, auth, producto["id"]) == ["stock_bajo"]
+
+    api.put(f"/api/productos/{producto['id']}", headers=auth, json={"stock_actual": 0})
+    assert alertas_de(api, auth, producto["id"]) == ["stock_cero"]
+
+    vence = (date.today() + timedelta(days=5)).isoformat()
+    api.put(f"/api/productos/{producto['id']}", headers=auth, json={"stock_actual": 50, "fecha_vencimiento": vence})
+    assert alertas_de(api, auth, producto["id"]) == ["proximo_vencer"]
+
+    api.delete(f"/api/productos/{producto['id']}", headers=auth)
+    assert alertas_de(api, auth, producto["id"]) == []
+    assert ejecutar(api, server.db.alertas_materializadas.count_documents, {"id": producto["id"]}) == 0
+
+def test_refrescos_concurrentes_dejan_el_estado_final(api, auth):
+    producto = api.post("/api/productos", headers=auth, json={"codigo": "AL-2", "descripcion": "Concurrente", "stock_actual": 3}).json()
+    filtro = {"id": producto["id"]}
+
+    async def escribir(stock: int):
+        await server.db.productos.update_one(filtro, {"$set": {"stock_actual": stock, "updated_at": datetime.now(timezone.utc)}})
+        await server.refrescar_alertas(filtro)
+
+    async def escenario():
+        # Alterna sin stock, stock bajo y stock suficiente; la última escritura deja stock bajo
+        await asyncio.gather(*(escribir(stock) for stock in [0, 50, 3, 0, 50, 0, 3, 50, 0, 3]))
+        await escribir(3)
+
+    api.portal.call(escenario)
+    assert alertas_de(api, auth, producto["id"]) == ["stock_bajo"]
+    verificacion = api.get("/api/admin/alertas/verificar", headers=autenticar(api, "maestro", rol="maestro")).json()
+    assert verificacion["consistente"], verificacion
@@ -0,0 +1,50 @@
+import bson
+import numpy as np
+import pytest
+
+from .conftest import ejecutar
+
+import server
+
+def bloque(prefijo: str, n: int, **columnas):
+    valores = {
+        "stock_actual": [bson.Int64(i % 50) for i in range(n)],
+        "precio_venta": [1.5 + i for i in range(n)],
+        "dias_para_vencer": [float(i) if i % 3 else float("nan") for i in range(n)],
+        "vendidas": [float(i % 7) for i in range(n)],
+    }
+    valores.update(columnas)
+    return bson.encode({"_id": prefijo, "n": n, "id": [f"{prefijo}-{i}" for i in range(n)], **valores})
+
+def test_columnas_bson_igual_que_decodificar():
+    # 12345 elementos cruzan los tramos de claves de 1 a 5 dígitos
+    lote = bloque("aa", 12345) + bloque("ab", 7)
+    datos = server.DatosAnalitica()
+    datos.agregar_lote(lote)
+    columnas = datos.columnas()
+    decodificados = bson.decode_all(lote)
+    for campo, _, _, dtype in server.ANALITICA_COLUMNAS:
+        esperado = np.array([v for doc in decodificados for v in doc[campo]], dtype=dtype)
+        np.testing.assert_array_equal(columnas[campo], esperado)
+    assert datos.ids([0, 12344, 12345, 12351]) == {0: "aa-0", 12344: "aa-12344", 12345: "ab-0", 12351: "ab-6"}
+
+def test_columna_con_tipos_mezclados_falla():
+    lote = bloque("aa", 3, stock_actual=[bson.Int64(1), 2, bson.Int64(3)])
+    with pytest.raises(ValueError):
+        server.DatosAnalitica().agregar_lote(lote)
+
+def test_fecha_no_iso_no_rompe_la_analitica(api, auth):
+    for codigo, vencimiento in (("AN-1", "2030-01-31"), ("AN-2", "31/12/2030")):
+        respuesta = api.post("/api/productos", headers=auth, json={
+            "codigo": codigo, "descripcion": codigo, "stock_actual": 5, "precio_venta": 2.0,
+        })
+        assert respuesta.status_code == 200, respuesta.text
+        # Un texto que la migración de fechas dejó sin convertir
+        ejecutar(api, server.db.productos.update_one, {"codigo": codigo}, {"$set": {"fecha_vencimiento": vencimiento}})
+    server.analitica_cache = (None, None)
+
+    respuesta = api.get("/api/analytics/inventario", headers=auth)
+    assert respuesta.status_code == 200, respuesta.text
+    analitica = respuesta.json()
+    assert (analitica["productos"], analitica["unidades"], analitica["valor_total"]) == (2, 10, 20.0)
+    assert {item["codigo"] for item in analitica["top_valor"]} == {"AN-1", "AN-2"}
@@ -0,0 +1,59 @@
+from .conftest import autenticar, ejecutar
+
+import server
+
+def usuario_id(api, username: str):
+    return ejecutar(api, server.db.usuarios.find_one, {"username": username})["id"]
+
+def login(api, username: str, password: str):
+    return api.post("/api/login", json={"username": username, "password": password})
+
+def test_cache_de_usuarios(api, auth):
+    maestro = autenticar(api, "maestro", rol="maestro")
+    hits, misses = server.user_cache.hits, server.user_cache.misses
+    assert api.get("/api/me", headers=auth).json()["nombre_completo"] == "Tester"
+    assert (server.user_cache.hits, server.user_cache.misses) == (hits, misses + 1)
+
+    # Un acierto no vuelve a leer la base: un cambio directo no se ve hasta invalidar
+    ejecutar(api, server.db.usuarios.update_one, {"username": "tester"}, {"$set": {"nombre_completo": "Cambiado"}})
+    assert api.get("/api/me", headers=auth).json()["nombre_completo"] == "Tester"
+    assert (server.user_cache.hits, server.user_cache.misses) == (hits + 1, misses + 1)
+
+    api.put(f"/api/usuarios/{usuario_id(api, 'tester')}", headers=maestro, json={"nombre_completo": "Por API"})
+    assert api.get("/api/me", headers=auth).json()["nombre_completo"] == "Por API"
+
+def test_usuario_desactivado_se_rechaza_en_la_siguiente_peticion(api, auth):
+    maestro = autenticar(api, "maestro", rol="maestro")
+    assert api.get("/api/me", headers=auth).status_code == 200
+
+    respuesta = api.put(f"/api/usuarios/{usuario_id(api, 'tester')}", headers=maestro, json={"activo": False})
+    assert respuesta.status_code == 200, respuesta.text
+    respuesta = api.get("/api/me", headers=auth)
+    assert (respuesta.status_code, respuesta.json()["detail"]) == (401, "Usuario inactivo")
+    assert login(api, "tester", "clave-tester").status_code == 400
+
+def test_cambio_de_password_exige_la_actual(api, auth):
+    propio = usuario_id(api, "tester")
+    for actual in (None, "incorrecta"):
+        respuesta = api.post("/api/usuarios/password", headers=auth, json={"user_id": propio, "new_password": "nueva", "current_password": actual})
+        assert (respuesta.status_code, respuesta.json()["detail"]) == (400, "Contraseña actual incorrecta")
+    assert login(api, "tester", "clave-tester").status_code == 200
+
+    autenticar(api, "otro")
+    respuesta = api.post("/api/usuarios/password", headers=auth, json={"user_id": usuario_id(api, "otro"), "new_password": "x", "current_password": "clave-tester"})
+    assert respuesta.status_code == 403
+
+    respuesta = api.post("/api/usuarios/password", headers=auth, json={"user_id": propio, "new_password": "nueva", "current_password": "clave-tester"})
+    assert respuesta.status_code == 200, respuesta.text
+    assert login(api, "tester", "clave-tester").status_code == 401
+    assert login(api, "tester", "nueva").status_code == 200
+
+def test_maestro_restablece_sin_password_actual(api, auth):
+    maestro = autenticar(api, "maestro", rol="maestro")
+    respuesta = api.post("/api/usuarios/password", headers=maestro, json={"user_id": usuario_id(api, "tester"), "new_password": "restablecida"})
+    assert respuesta.status_code == 200, respuesta.text
+    assert login(api, "tester", "clave-tester").status_code == 401
+    assert login(api, "tester", "restablecida").status_code == 200
+
+    respuesta = api.post("/api/usuarios/password", headers=maestro, json={"user_id": "no-existe", "new_password": "x"})
+    assert respuesta.status_code == 404
@@ -0,0 +1,50 @@
+import server
+
+def crear(api, auth, codigo: str, descripcion: str):
+    respuesta = api.post("/api/productos", headers=auth, json={"codigo": codigo, "descripcion": descripcion})
+    assert respuesta.status_code == 200, respuesta.text
+
+def buscar(api, auth, q: str, **params):
+    respuesta = api.get("/api/productos/search", headers=auth, params={"q": q, **params})
+    assert respuesta.status_code == 200, respuesta.text
+    return respuesta.json()
+
+def test_exactas_antes_que_prefijos_sin_tildes(api, auth):
+    crear(api, auth, "AR-3", "Arrozal")
+    crear(api, auth, "AR-2", "Arroz blanco")
+    crear(api, auth, "AR-1", "Arroz integral")
+    crear(api, auth, "AZ-1", "Azúcar rubia")
+
+    resultado = buscar(api, auth, "ARROZ")
+    assert [p["codigo"] for p in resultado["items"]] == ["AR-1", "AR-2", "AR-3"]
+    assert (resultado["total"], resultado["truncado"]) == (3, False)
+    assert [p["codigo"] for p in buscar(api, auth, "azucar")["items"]] == ["AZ-1"]
+    assert [p["codigo"] for p in buscar(api, auth, "ar-2")["items"]] == ["AR-2"]
+    assert buscar(api, auth, "!!") == {"items": [], "total": 0, "truncado": False}
+
+def test_candidatos_truncados_en_orden_del_catalogo(api, auth, monkeypatch):
+    monkeypatch.setattr(server, "SEARCH_MAX_CANDIDATES", 4)
+    # Exactas y por prefijo mezcladas, insertadas fuera de orden
+    for codigo, descripcion in (("LE-6", "Leche 6"), ("LE-2", "Lechera 2"), ("LE-5", "Leche 5"),
+                                ("LE-1", "Leche 1"), ("LE-4", "Lechera 4"), ("LE-3", "Leche 3")):
+        crear(api, auth, codigo, descripcion)
+
+    resultado = buscar(api, auth, "leche")
+    # Las cuatro exactas con menor código, aunque haya coincidencias por prefijo antes en el catálogo
+    assert [p["codigo"] for p in resultado["items"]] == ["LE-1", "LE-3", "LE-5", "LE-6"]
+    assert (resultado["total"], resultado["truncado"]) == (6, True)
+    assert buscar(api, auth, "leche") == resultado
+    assert [p["codigo"] for p in buscar(api, auth, "leche", skip=2, limit=10)["items"]] == ["LE-5", "LE-6"]
+
+    resultado = buscar(api, auth, "lech")
+    assert [p["codigo"] for p in resultado["items"]] == ["LE-1", "LE-2", "LE-3", "LE-4"]
+    assert (resultado["total"], resultado["truncado"]) == (6, True)
+
+def test_busca_contactos_por_correo(api, auth):
+    for nombre, correo in (("Distribuidora Norte", "ventas@norte.com"), ("Lácteos del Sur", "pedidos@sur.com")):
+        respuesta = api.post("/api/contactos", headers=auth, json={"nombre": nombre, "correo": correo})
+        assert respuesta.status_code == 200, respuesta.text
+
+    resultado = api.get("/api/contactos/search", headers=auth, params={"q": "ventas@norte.com"}).json()
+    assert [c["nombre"] for c in resultado["items"]] == ["Distribuidora Norte"]
+    assert [c["nombre"] for c in api.get("/api/contactos/search", headers=auth, params={"q": "lacteos"}).json()["items"]] == ["Lácteos del Sur"]
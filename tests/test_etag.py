@@ -0,0 +1,47 @@
+def etag(api, auth, ruta: str):
+    respuesta = api.get(ruta, headers=auth)
+    assert respuesta.status_code == 200, respuesta.text
+    assert respuesta.headers["Cache-Control"] == "no-cache"
+    return respuesta.headers["ETag"]
+
+def etags(api, auth):
+    return {ruta: etag(api, auth, ruta) for ruta in ("/api/productos", "/api/contactos", "/api/configuracion", "/api/alertas")}
+
+def test_if_none_match_devuelve_304_sin_cuerpo(api, auth):
+    for ruta in ("/api/productos", "/api/contactos", "/api/configuracion", "/api/alertas", "/api/bootstrap"):
+        actual = etag(api, auth, ruta)
+        respuesta = api.get(ruta, headers={**auth, "If-None-Match": actual})
+        assert respuesta.status_code == 304, ruta
+        assert respuesta.content == b""
+        assert respuesta.headers["ETag"] == actual
+        # Lista de ETags y validadores débiles también coinciden
+        assert api.get(ruta, headers={**auth, "If-None-Match": f'"otro", W/{actual}'}).status_code == 304
+        assert api.get(ruta, headers={**auth, "If-None-Match": '"otro"'}).status_code == 200
+    # La consulta forma parte del ETag: otra página no es la misma representación
+    assert etag(api, auth, "/api/productos?limit=5") != etag(api, auth, "/api/productos")
+
+def test_cada_escritura_cambia_el_etag(api, auth):
+    def cambiadas(escribir):
+        antes = etags(api, auth)
+        respuesta = escribir()
+        assert respuesta.status_code == 200, respuesta.text
+        despues = etags(api, auth)
+        return respuesta.json(), {ruta for ruta in antes if antes[ruta] != despues[ruta]}
+
+    producto, rutas = cambiadas(lambda: api.post("/api/productos", headers=auth, json={"codigo": "ET-1", "descripcion": "ETag", "stock_actual": 5}))
+    assert rutas == {"/api/productos", "/api/alertas"}
+    _, rutas = cambiadas(lambda: api.put(f"/api/productos/{producto['id']}", headers=auth, json={"stock_actual": 0}))
+    assert rutas == {"/api/productos", "/api/alertas"}
+    _, rutas = cambiadas(lambda: api.delete(f"/api/productos/{producto['id']}", headers=auth))
+    assert rutas == {"/api/productos", "/api/alertas"}
+
+    contacto, rutas = cambiadas(lambda: api.post("/api/contactos", headers=auth, json={"nombre": "Contacto ETag"}))
+    assert rutas == {"/api/contactos"}
+    _, rutas = cambiadas(lambda: api.put(f"/api/contactos/{contacto['id']}", headers=auth, json={"telefono": "123"}))
+    assert rutas == {"/api/contactos"}
+    _, rutas = cambiadas(lambda: api.delete(f"/api/contactos/{contacto['id']}", headers=auth))
+    assert rutas == {"/api/contactos"}
+
+    # El límite de stock bajo cambia qué productos tienen alerta
+    _, rutas = cambiadas(lambda: api.put("/api/configuracion", headers=auth, json={"stock_bajo_limite": 20}))
+    assert rutas == {"/api/configuracion", "/api/alertas"}
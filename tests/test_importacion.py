@@ -0,0 +1,85 @@
+import json
+
+from .conftest import ejecutar
+
+import server
+
+def importar(api, auth, nombre: str, contenido: bytes, **params):
+    return api.post("/api/productos/import", headers=auth, params=params, files={"archivo": (nombre, contenido)})
+
+def producto(api, auth, codigo: str):
+    respuesta = api.get(f"/api/productos/codigo/{codigo}", headers=auth)
+    return respuesta.json() if respuesta.status_code == 200 else None
+
+def test_importa_csv(api, auth):
+    contenido = (
+        "codigo,descripcion,stock_actual,precio_venta,fecha_vencimiento\n"
+        "CSV-1,Arroz 1kg,10,2.5,2030-01-31\n"
+        'CSV-2,"Aceite, 1L",0,,\n'
+    ).encode()
+    respuesta = importar(api, auth, "productos.csv", contenido)
+    assert respuesta.status_code == 200, respuesta.text
+    assert respuesta.json() == {"insertados": 2, "actualizados": 0, "fallidos": 0, "errores": []}
+
+    arroz = producto(api, auth, "CSV-1")
+    assert (arroz["stock_actual"], arroz["precio_venta"], arroz["fecha_vencimiento"]) == (10, 2.5, "2030-01-31")
+    aceite = producto(api, auth, "CSV-2")
+    assert (aceite["descripcion"], aceite["precio_venta"], aceite["fecha_vencimiento"]) == ("Aceite, 1L", 0.0, None)
+
+def test_ndjson_filas_invalidas_no_detienen_la_importacion(api, auth):
+    lineas = [
+        json.dumps({"codigo": "ND-1", "descripcion": "Válido", "stock_actual": 3}).encode(),
+        json.dumps({"codigo": 7501234567890, "descripcion": "Código numérico"}).encode(),
+        b"{no es json",
+        b"[1, 2]",
+        json.dumps({"codigo": "ND-2"}).encode(),
+        b"",
+        '{"codigo": "ND-3", "descripcion": "Latin-1 \xf1"}'.encode("latin-1"),
+        json.dumps({"codigo": "ND-4", "descripcion": "También válido"}).encode(),
+    ]
+    respuesta = importar(api, auth, "productos.ndjson", b"\n".join(lineas) + b"\n")
+    assert respuesta.status_code == 200, respuesta.text
+    resultado = respuesta.json()
+    assert (resultado["insertados"], resultado["actualizados"], resultado["fallidos"]) == (2, 0, 5)
+    errores = {error["fila"]: error for error in resultado["errores"]}
+    assert sorted(errores) == [2, 3, 4, 5, 7]
+    assert errores[2]["codigo"] == "7501234567890"
+    assert errores[5]["codigo"] == "ND-2" and errores[5]["errores"][0].startswith("descripcion")
+    assert errores[7]["errores"] == ["La línea no es UTF-8 válido"]
+    assert producto(api, auth, "ND-1")["stock_actual"] == 3
+    assert producto(api, auth, "ND-4") is not None
+    assert producto(api, auth, "7501234567890") is None
+
+def test_csv_no_utf8_se_rechaza_sin_escribir(api, auth):
+    contenido = "codigo,descripcion\nOK-1,Valido\nMAL-1,Año\n".encode("latin-1")
+    respuesta = importar(api, auth, "productos.csv", contenido, batch_size=1)
+    assert respuesta.status_code == 400
+    assert "línea 3" in respuesta.json()["detail"]
+    assert ejecutar(api, server.db.productos.count_documents, {}) == 0
+
+def test_upsert_no_pisa_columnas_ausentes(api, auth):
+    creado = api.post("/api/productos", headers=auth, json={
+        "codigo": "UP-1",
+        "descripcion": "Original",
+        "unidad_venta": "Cajas",
+        "stock_actual": 10,
+        "precio_venta": 7.5,
+        "fecha_vencimiento": "2031-06-30",
+    })
+    assert creado.status_code == 200, creado.text
+
+    contenido = b"codigo,descripcion,stock_actual\nUP-1,Renombrado,4\nUP-2,Nuevo,1\n"
+    respuesta = importar(api, auth, "productos.csv", contenido)
+    assert respuesta.json() == {"insertados": 1, "actualizados": 1, "fallidos": 0, "errores": []}
+
+    actualizado = producto(api, auth, "UP-1")
+    assert actualizado["id"] == creado.json()["id"]
+    assert (actualizado["descripcion"], actualizado["stock_actual"]) == ("Renombrado", 4)
+    assert (actualizado["unidad_venta"], actualizado["precio_venta"], actualizado["fecha_vencimiento"]) == ("Cajas", 7.5, "2031-06-30")
+    # Las columnas ausentes toman su valor por defecto solo al insertar
+    nuevo = producto(api, auth, "UP-2")
+    assert (nuevo["unidad_venta"], nuevo["precio_venta"]) == ("Unidades", 0.0)
+
+    # La diferencia de stock queda como movimiento de importación y el producto nuevo como alta
+    movimientos = ejecutar(api, server.db.movimientos.find({"tipo": {"$in": ["importacion", "alta"]}}, {"_id": 0}).to_list, None)
+    assert {(m["codigo"], m["tipo"], m["delta"]) for m in movimientos} >= {("UP-1", "importacion", -6), ("UP-2", "alta", 1)}
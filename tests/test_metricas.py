@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+
+import server
+
+ETIQUETAS = ("GET", "/api/productos/export")
+
+@pytest.mark.skipif(not server.METRICS_ENABLED, reason="METRICS_ENABLED=0")
+def test_streaming_mide_hasta_el_ultimo_bloque(api, auth, monkeypatch):
+    en_curso = []
+
+    async def exportar_lento(filtro, formato):
+        yield "primero\n"
+        en_curso.append(server.http_in_flight.valores.get(ETIQUETAS))
+        await asyncio.sleep(0.2)
+        yield "ultimo\n"
+
+    monkeypatch.setattr(server, "exportar_productos_stream", exportar_lento)
+    _, peticiones, segundos = server.http_latency.valores.get(ETIQUETAS, [None, 0, 0.0])
+
+    respuesta = api.get("/api/productos/export", headers=auth)
+    assert respuesta.text == "primero\nultimo\n"
+    # Entre bloques la petición sigue en curso; al terminar el cuerpo se cierra una sola vez
+    assert en_curso == [1]
+    assert server.http_in_flight.valores[ETIQUETAS] == 0
+    _, despues, segundos_despues = server.http_latency.valores[ETIQUETAS]
+    assert despues == peticiones + 1
+    assert segundos_despues - segundos >= 0.2
@@ -0,0 +1,53 @@
+from datetime import datetime, time, timedelta, timezone
+
+from .conftest import ejecutar
+
+import server
+
+HOY = datetime.now(timezone.utc).date()
+
+def hace(dias: int, hora: int = 12):
+    return datetime.combine(HOY - timedelta(days=dias), time(hora), tzinfo=timezone.utc)
+
+def registrar(api, *movimientos):
+    for mov in movimientos:
+        ejecutar(api, server.registrar_movimientos, [server.movimiento("P1", "MV-1", *mov)])
+
+def resumen(api, dias: int):
+    return ejecutar(api, server.db.movimientos_diarios.find_one, {"producto_id": "P1", "dia": server.fecha_bson(HOY - timedelta(days=dias))})
+
+def stock_diario(api, auth, dias: int, producto_id: str = "P1"):
+    return api.get(f"/api/productos/{producto_id}/stock-diario", headers=auth, params={"dias": dias})
+
+def test_cierre_del_dia_es_el_del_ultimo_movimiento(api):
+    # (tipo, delta, stock_resultante, usuario, fecha), escritos fuera de orden
+    registrar(api, ("ajuste", 3, 8, "tester", hace(1, 12)), ("ajuste", 5, 5, "tester", hace(1, 10)))
+    dia = resumen(api, 1)
+    assert (dia["entradas"], dia["salidas"], dia["movimientos"], dia["cierre"]) == (8, 0, 2, 8)
+
+    # Un movimiento anterior al cierre suma en los contadores pero no lo reemplaza
+    registrar(api, ("pedido", -2, 6, "tester", hace(1, 11)))
+    dia = resumen(api, 1)
+    assert (dia["entradas"], dia["salidas"], dia["vendidas"], dia["movimientos"], dia["cierre"]) == (8, 2, 2, 3, 8)
+
+    registrar(api, ("ajuste", -1, 7, "tester", hace(1, 13)))
+    dia = resumen(api, 1)
+    assert (dia["salidas"], dia["vendidas"], dia["cierre"]) == (3, 2, 7)
+
+def test_stock_diario_deduce_la_apertura_y_rellena_huecos(api, auth):
+    ejecutar(api, server.db.productos.insert_one, {"id": "P1", "codigo": "MV-1", "descripcion": "Movimientos", "stock_actual": 7})
+    registrar(api, ("ajuste", 4, 10, "tester", hace(5)), ("pedido", -3, 7, "tester", hace(2)))
+
+    # Sin resumen anterior, la apertura sale del primer día con movimientos: 10 - 4
+    serie = stock_diario(api, auth, 7).json()
+    assert [d["dia"] for d in serie] == [(HOY - timedelta(days=n)).isoformat() for n in range(6, -1, -1)]
+    assert [d["cierre"] for d in serie] == [6, 10, 10, 10, 7, 7, 7]
+    assert (serie[1]["entradas"], serie[4]["salidas"], serie[4]["vendidas"], serie[2]["entradas"]) == (4, 3, 3, 0)
+
+    # Con un resumen anterior al periodo, la apertura es su cierre
+    assert [d["cierre"] for d in stock_diario(api, auth, 4).json()] == [10, 7, 7, 7]
+    # Sin movimientos en el periodo, el stock actual
+    assert [d["cierre"] for d in stock_diario(api, auth, 2).json()] == [7, 7]
+
+def test_stock_diario_de_producto_inexistente(api, auth):
+    assert stock_diario(api, auth, 7, "no-existe").status_code == 404
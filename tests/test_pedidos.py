@@ -0,0 +1,116 @@
+"""
+All-or-nothing dispatch of /pedidos on both paths, against a real MongoDB
+Uses MONGO_URL and the TEST_DB_NAME database (default inventario_test); skips when MongoDB is not
+reachable, and the transaction path also skips unless the deployment is a replica set or mongos
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ["DB_NAME"] = os.environ.get("TEST_DB_NAME", "inventario_test")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from pymongo.errors import ServerSelectionTimeoutError  # noqa: E402
+
+import server  # noqa: E402
+
+async def conectar(ruta: str):
+    # Un cliente por prueba: cada asyncio.run abre su propio event loop
+    server.client = AsyncIOMotorClient(os.environ["MONGO_URL"], serverSelectionTimeoutMS=2000)
+    server.db = server.client[os.environ["DB_NAME"]]
+    try:
+        hello = await server.db.command("hello")
+    except ServerSelectionTimeoutError:
+        pytest.skip("MongoDB no disponible")
+    if ruta == "transaccion" and not (hello.get("setName") or hello.get("msg") == "isdbgrid"):
+        pytest.skip("Las transacciones requieren replica set o mongos")
+
+async def crear_productos(**stocks):
+    prefijo = uuid.uuid4().hex[:8]
+    productos = {
+        nombre: {"id": str(uuid.uuid4()), "codigo": f"{prefijo}-{nombre}", "descripcion": nombre, "stock_actual": stock}
+        for nombre, stock in stocks.items()
+    }
+    await server.db.productos.insert_many([dict(p) for p in productos.values()])
+    return productos
+
+async def estado(productos: dict):
+    documentos = await server.db.productos.find(
+        {"id": {"$in": [p["id"] for p in productos.values()]}}, {"_id": 0}
+    ).to_list(length=None)
+    return {d["codigo"].split("-", 1)[1]: d for d in documentos}
+
+async def despachar(ruta: str, productos: dict, **cantidades):
+    por_id = {productos[nombre]["id"]: cantidad for nombre, cantidad in cantidades.items()}
+    codigos = {p["id"]: p["codigo"] for p in productos.values()}
+    ahora = datetime.now(timezone.utc)
+    if ruta == "transaccion":
+        await server.despachar_con_transaccion(por_id, codigos, ahora)
+    else:
+        await server.despachar_con_compensacion(por_id, codigos, ahora, str(uuid.uuid4()))
+
+async def limpiar(productos: dict):
+    await server.db.productos.delete_many({"id": {"$in": [p["id"] for p in productos.values()]}})
+
+@pytest.mark.parametrize("ruta", ["transaccion", "compensacion"])
+def test_linea_sin_stock_no_descuenta_ninguna(ruta):
+    async def prueba():
+        await conectar(ruta)
+        productos = await crear_productos(A=10, B=2, C=5)
+        try:
+            with pytest.raises(server.StockInsuficiente) as error:
+                await despachar(ruta, productos, A=8, B=5, C=5)
+            assert error.value.args[0] == [productos["B"]["codigo"]]
+            documentos = await estado(productos)
+            assert {nombre: d["stock_actual"] for nombre, d in documentos.items()} == {"A": 10, "B": 2, "C": 5}
+            assert not any("_pedidos_pendientes" in d for d in documentos.values())
+        finally:
+            await limpiar(productos)
+    asyncio.run(prueba())
+
+@pytest.mark.parametrize("ruta", ["transaccion", "compensacion"])
+def test_pedido_completo_descuenta_todas(ruta):
+    async def prueba():
+        await conectar(ruta)
+        productos = await crear_productos(A=10, B=2)
+        try:
+            await despachar(ruta, productos, A=8, B=2)
+            documentos = await estado(productos)
+            assert {nombre: d["stock_actual"] for nombre, d in documentos.items()} == {"A": 2, "B": 0}
+            assert not any("_pedidos_pendientes" in d for d in documentos.values())
+
+            # A ya no alcanza: el segundo pedido se rechaza sin cambios
+            with pytest.raises(server.StockInsuficiente) as error:
+                await despachar(ruta, productos, A=3)
+            assert error.value.args[0] == [productos["A"]["codigo"]]
+            documentos = await estado(productos)
+            assert {nombre: d["stock_actual"] for nombre, d in documentos.items()} == {"A": 2, "B": 0}
+        finally:
+            await limpiar(productos)
+    asyncio.run(prueba())
+
+def test_compensacion_respeta_pedidos_concurrentes():
+    # Un pedido rechazado solo devuelve lo que él mismo descontó
+    async def prueba():
+        await conectar("compensacion")
+        productos = await crear_productos(A=10, B=1)
+        try:
+            await asyncio.gather(
+                despachar("compensacion", productos, A=4),
+                despachar("compensacion", productos, A=4, B=5),
+                return_exceptions=True,
+            )
+            documentos = await estado(productos)
+            assert documentos["A"]["stock_actual"] == 6
+            assert documentos["B"]["stock_actual"] == 1
+            assert not any("_pedidos_pendientes" in d for d in documentos.values())
+        finally:
+            await limpiar(productos)
+    asyncio.run(prueba())
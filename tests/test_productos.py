@@ -0,0 +1,9 @@
+def test_put_devuelve_updated_at_como_se_guarda(api, auth):
+    producto = api.post("/api/productos", headers=auth, json={"codigo": "PR-1", "descripcion": "Producto", "stock_actual": 1}).json()
+    respuesta = api.put(f"/api/productos/{producto['id']}", headers=auth, json={"stock_actual": 2})
+    assert respuesta.status_code == 200, respuesta.text
+
+    # Sin zona y en milisegundos, igual que GET y que el evento producto_actualizado
+    actualizado = respuesta.json()
+    assert actualizado == api.get(f"/api/productos/{producto['id']}", headers=auth).json()
+    assert not actualizado["updated_at"].endswith("+00:00")